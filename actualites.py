@@ -0,0 +1,119 @@
+"""
+Agrégation des actualités transport (flux RSS), en cache.
+
+Les flux sont téléchargés en parallèle, chacun avec son propre timeout et en
+GET conditionnel (ETag / Last-Modified) : un flux inchangé répond 304 et on
+garde ses articles déjà filtrés. Le tri par mots-clés et le formatage sont
+faits une fois par rafraîchissement ; /api/news ne fait que lire la liste prête.
+Tous les rafraîchissements, le premier compris, se font en tâche de fond : tant
+que le premier n'est pas fini, /api/news renvoie une liste vide.
+
+Les URL peuvent être des `file://` (flux de test locaux).
+"""
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import feedparser
+from dateutil import parser as date_parser
+
+
+def telecharger(url, etag=None, modifie=None, timeout=8.0):
+    """GET conditionnel. Retourne (statut, contenu, etag, last_modified) ; contenu None si 304."""
+    req = urllib.request.Request(url, headers={'User-Agent': 'finaltrans/1.0 (+rss)'})
+    if etag:
+        req.add_header('If-None-Match', etag)
+    if modifie:
+        req.add_header('If-Modified-Since', modifie)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return 200, resp.read(), resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return 304, None, etag, modifie
+        raise
+
+
+def formater_articles(contenu, mots_cles):
+    """Articles d'un flux qui parlent de transport, au format attendu par index.html."""
+    feed = feedparser.parse(contenu)
+    source = (feed.feed.get('title') or '').split('-')[0].strip()[:15]
+    articles = []
+    for entry in feed.entries:
+        titre = entry.get('title', '')
+        description = entry.get('description', '')
+        text_content = (titre + " " + description).lower()
+        if not any(k in text_content for k in mots_cles):
+            continue
+        try:
+            date_str = date_parser.parse(entry.published).strftime("%d/%m %H:%M")
+        except Exception:
+            date_str = "Récemment"
+        articles.append({
+            "title": titre,
+            "link": entry.get('link', ''),
+            "source": source,
+            "date": date_str,
+            "summary": description.replace('<p>', '').replace('</p>', '')[:120] + "..."
+        })
+    return articles
+
+
+class AgregateurActualites:
+    def __init__(self, urls, mots_cles, nb_max=10, intervalle=600.0, timeout=8.0, recuperer=telecharger):
+        self.urls = list(urls)
+        self.mots_cles = mots_cles
+        self.nb_max = nb_max
+        self.intervalle = intervalle
+        self.timeout = timeout
+        self.recuperer = recuperer
+        self._etat = {url: {'etag': None, 'modifie': None, 'articles': []} for url in self.urls}
+        self._actualites = []
+        self._dernier_rafraichissement = None
+        self._verrou = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def actualites(self):
+        """Liste prête à servir (vide tant que le premier rafraîchissement n'est pas fini)."""
+        self._demarrer()
+        return self._actualites
+
+    def rafraichir(self):
+        """Télécharge tous les flux en parallèle ; un flux en erreur garde ses anciens articles."""
+        with ThreadPoolExecutor(max_workers=max(1, len(self.urls))) as pool:
+            list(pool.map(self._rafraichir_flux, self.urls))
+        articles = [a for url in self.urls for a in self._etat[url]['articles']]
+        with self._verrou:
+            self._actualites = articles[:self.nb_max]
+            self._dernier_rafraichissement = time.time()
+
+    def _rafraichir_flux(self, url):
+        etat = self._etat[url]
+        try:
+            statut, contenu, etag, modifie = self.recuperer(url, etat['etag'], etat['modifie'], self.timeout)
+            if statut == 304:
+                return
+            etat['articles'] = formater_articles(contenu, self.mots_cles)
+            etat['etag'], etat['modifie'] = etag, modifie
+        except Exception as e:
+            print(f"Erreur News ({url}): {e}")
+
+    def _demarrer(self):
+        # Rafraîchissement périodique en tâche de fond (relancé après un fork gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._verrou:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._boucle, name='actualites', daemon=True)
+            self._thread.start()
+
+    def _boucle(self):
+        while True:
+            self.rafraichir()
+            time.sleep(self.intervalle)
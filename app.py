@@ -1,18 +1,46 @@
 import os
-import math
+import time
+import atexit
 import datetime 
-import feedparser
-from dateutil import parser as date_parser
-from flask import Flask, request, jsonify, send_from_directory
+import hmac
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from supabase import create_client, Client
 from flask_cors import CORS
 from dotenv import load_dotenv
+from depot import DepotSupabase
+from cache import CacheTTL
+from flotte import FlotteMemoire, FlotteSQLite, EcrivainLots, epoch_depuis_iso
+from distances import haversine_km, DISTANCE_INCONNUE
+from diffusion import Diffuseur, calculer_delta, evenement_sse
+from index_lignes import IndexLignes, normaliser, TERMINUS_DEPART, TERMINUS_ARRIVEE
+from demande import IndexDemande, SessionsDemande
+from ingestion import FiltrePings, Ingestion
+from actualites import AgregateurActualites
+from itineraires import CacheRoutes, decoder_polyline, encoder_polyline, simplifier
+from index_arrets import IndexArrets
+from vitesses import ModeleVitesses
+from lieux import RepertoireLieux
+from evenements import GrilleEvenements
+from arrets import TuilesArrets
+from historique import HistoriqueTrajets
+from metriques import Metriques, ClientInstrumente, ProfileurEchantillons, instrumenter
+from reponses import compacter, compresser, etag_contenu, version_fiche
 
 # --- CONFIGURATION ---
 load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Métriques Prometheus (/metrics) : latence par route, appels Supabase par table ;
+# SLOW_REQUEST_PROFILE_MS active l'échantillonnage des piles des requêtes plus lentes que ce seuil
+metriques = Metriques()
+SEUIL_LENT_MS = os.getenv("SLOW_REQUEST_PROFILE_MS")
+profileur = ProfileurEchantillons(seuil_s=float(SEUIL_LENT_MS) / 1000) if SEUIL_LENT_MS else None
+instrumenter(app, metriques, profileur)
+
+# Réponses JSON compressées (gzip) au-delà de 1 Ko, pour les voyageurs en données mobiles
+compresser(app, seuil=int(os.getenv("GZIP_MIN_BYTES", 1024)))
+
 # Récupération des clés
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -28,43 +56,119 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     print("⚠️ ERREUR: Les clés SUPABASE_URL ou SUPABASE_KEY sont manquantes.")
     supabase = None
 else:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase: Client = ClientInstrumente(create_client(SUPABASE_URL, SUPABASE_KEY), metriques)
+
+# Couche d'accès aux données (lectures groupées + cache des profils chauffeurs)
+cache_chauffeurs = CacheTTL(
+    taille_max=int(os.getenv("DRIVER_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("DRIVER_CACHE_TTL", 300))
+)
+depot = DepotSupabase(supabase, cache=cache_chauffeurs) if supabase else None
+
+# Flotte en direct : les pings vivent en mémoire, active_trips est recopiée par lots
+BUS_TIMEOUT_S = 45
+if os.getenv("FLEET_BACKEND", "memoire") == "sqlite":
+    flotte = FlotteSQLite(os.getenv("FLEET_SQLITE_PATH", "/tmp/finaltrans_flotte.db"), duree_vie=BUS_TIMEOUT_S)
+else:
+    flotte = FlotteMemoire(duree_vie=BUS_TIMEOUT_S, sync_s=float(os.getenv("FLEET_SYNC_SECONDS", 5)))
+ecrivain_trajets = EcrivainLots(supabase, intervalle=float(os.getenv("FLEET_FLUSH_SECONDS", 2)))
+atexit.register(ecrivain_trajets.flush)
+
+# Flux temps réel des voyageurs (SSE)
+# Un flux ouvert tient un thread jusqu'à FLUX_DUREE_MAX_S : au-delà de STREAM_MAX_CLIENTS flux
+# (par défaut 48 sur les 64 threads de gunicorn.conf.py), 503 et le client repasse au sondage
+diffuseur = Diffuseur(max_abonnes=int(os.getenv("STREAM_MAX_CLIENTS", 48)))
+FLUX_TICK_S = float(os.getenv("STREAM_RESYNC_SECONDS", 5))
+FLUX_DUREE_MAX_S = float(os.getenv("STREAM_MAX_SECONDS", 300))
+
+# Ingestion des pings GPS : doublons écartés, écriture active_trips par lots en tâche de fond
+filtre_pings = FiltrePings(
+    distance_min_m=float(os.getenv("PING_MIN_DISTANCE_M", 15)),
+    intervalle_min_s=float(os.getenv("PING_MIN_INTERVAL_SECONDS", 0.5)),
+    entretien_s=float(os.getenv("PING_KEEPALIVE_SECONDS", 15))
+)
+
+# Historique des trajets : pings retenus filtrés à l'estime, en segments locaux compressés (voir historique.py)
+historique = HistoriqueTrajets(
+    os.getenv("HISTORY_PATH", "/tmp/finaltrans_historique"),
+    tolerance_m=float(os.getenv("HISTORY_TOLERANCE_M", 10)),
+    flush_s=float(os.getenv("HISTORY_FLUSH_SECONDS", 60)),
+    retention_jours=int(os.getenv("HISTORY_RETENTION_DAYS", 90))
+)
+atexit.register(historique.flush, tout=True)
+ingestion = Ingestion(flotte, ecrivain_trajets, filtre_pings, publier=diffuseur.publier, historique=historique)
 
 # --- ROUTE HEALTH CHECK (AJOUTÉ : INDISPENSABLE POUR RENDER) ---
 @app.route('/health')
 def health_check():
-    return jsonify({"status": "ok", "timestamp": datetime.datetime.now().isoformat()}), 200
+    return jsonify({
+        "status": "ok",
+        "timestamp": datetime.datetime.now().isoformat(),
+        "cache_chauffeurs": cache_chauffeurs.stats(),
+        "cache_routes": routes.stats(),
+        "arrets": tuiles_arrets.stats(),
+        "eta": modele_vitesses.stats(),
+        "demande": sessions_demande.stats(),
+        "evenements": len(evenements),
+        "historique": historique.stats()
+    }), 200
 
 # --- 1. LE CERVEAU GÉOGRAPHIQUE ---
-CITIES_DB = {
-    "tizi ouzou": {"lat": 36.7118, "lon": 4.0505},
-    "tizi": {"lat": 36.7118, "lon": 4.0505},
-    "alger": {"lat": 36.7528, "lon": 3.0420},
-    "oran": {"lat": 35.6971, "lon": -0.6308},
-    "bejaia": {"lat": 36.7509, "lon": 5.0567},
-    "bouira": {"lat": 36.3749, "lon": 3.9020},
-    "draa ben khedda": {"lat": 36.7333, "lon": 3.9667},
-    "dbk": {"lat": 36.7333, "lon": 3.9667},
-    "azazga": {"lat": 36.7447, "lon": 4.3722},
-    "freha": {"lat": 36.7667, "lon": 4.3167},
-    "tamda": {"lat": 36.7167, "lon": 4.1333}
-}
+# Répertoire local des lieux d'Algérie (fichier compact ouvert en mmap) : noms, alias ("tizi", "dbk"...), coordonnées
+lieux = RepertoireLieux(os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lieux_dz.bin")))
+CITIES_DB = lieux.coordonnees()
+
+# Index des lignes (noms de villes + alias -> terminus des chauffeurs)
+index_lignes = IndexLignes(CITIES_DB)
+
+# Demande voyageurs par destination (15 min), relue depuis passenger_requests toutes les quelques secondes
+# (avec un recouvrement plus long que le flush des écrivains des autres workers)
+demande = IndexDemande(index_lignes.correspond, sync_s=float(os.getenv("DEMAND_SYNC_SECONDS", 5)),
+                       chevauchement_s=float(os.getenv("FLEET_FLUSH_SECONDS", 2)) + 8)
+DEMANDE_RAYON_KM = float(os.getenv("DEMAND_RADIUS_KM", 30)) or None
+# Une ligne passenger_requests par voyageur, réécrite seulement s'il bouge / change de recherche / battement
+ecrivain_demandes = EcrivainLots(supabase, intervalle=float(os.getenv("FLEET_FLUSH_SECONDS", 2)),
+                                 table='passenger_requests', cle='passenger_id',
+                                 colonnes_repli=('user_lat', 'user_lon', 'depart_text', 'arrivee_text'))
+atexit.register(ecrivain_demandes.flush)
+sessions_demande = SessionsDemande(
+    ecrivain_demandes,
+    distance_min_m=float(os.getenv("DEMAND_MIN_MOVE_M", 50)),
+    battement_s=float(os.getenv("DEMAND_HEARTBEAT_SECONDS", 60))
+)
 
 def haversine(lat1, lon1, lat2, lon2):
     """Calcul la distance en KM entre deux points GPS (Version Robuste)"""
+    # Vérification stricte pour éviter les crashs si GPS manquant
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return DISTANCE_INCONNUE
     try:
-        # Vérification stricte pour éviter les crashs si GPS manquant
-        if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
-            return 999999 
-
-        R = 6371.0
-        dlat = math.radians(float(lat2) - float(lat1))
-        dlon = math.radians(float(lon2) - float(lon1))
-        a = math.sin(dlat / 2)**2 + math.cos(math.radians(float(lat1))) * math.cos(math.radians(float(lat2))) * math.sin(dlon / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return round(R * c, 2)
-    except Exception as e:
-        return 999999
+        return round(haversine_km(float(lat1), float(lon1), float(lat2), float(lon2)), 2)
+    except (TypeError, ValueError):
+        return DISTANCE_INCONNUE
+
+def _nombre(valeur, type_, positif=True):
+    """Convertit un paramètre client en nombre, None si absent ou invalide."""
+    try:
+        n = type_(valeur)
+    except (TypeError, ValueError):
+        return None
+    if positif and n <= 0: return None
+    return n
+
+def _par_lots(iterable, taille):
+    """Découpe un itérable en listes de `taille` éléments (une seule liste si taille est None)."""
+    if taille is None:
+        lot = list(iterable)
+        if lot: yield lot
+        return
+    lot = []
+    for x in iterable:
+        lot.append(x)
+        if len(lot) >= taille:
+            yield lot
+            lot = []
+    if lot: yield lot
 
 # --- ROUTES PAGES (FRONTEND) ---
 @app.route('/')
@@ -95,7 +199,7 @@ def register():
             uid = auth.user.id
             
             if role == 'chauffeur':
-                supabase.table('drivers').insert({
+                res = supabase.table('drivers').insert({
                     'id': uid,
                     'nom_complet': data.get('nom'),
                     'telephone': data.get('tel'),
@@ -108,6 +212,9 @@ def register():
                     'arr_lat': data.get('arr_lat'),
                     'arr_lon': data.get('arr_lon')
                 }).execute()
+                # La ligne renvoyée par Supabase porte les valeurs par défaut (tarifs, ticket_actif...)
+                if res.data: depot.rafraichir_chauffeur(uid, res.data[0])
+                else: depot.invalider_chauffeur(uid)
             else:
                 supabase.table('passengers').insert({
                     'id': uid, 'nom_complet': data.get('nom'), 'telephone': data.get('tel')
@@ -129,7 +236,10 @@ def login():
         
         driver = supabase.table('drivers').select('*').eq('id', uid).execute()
         if driver.data:
-            return jsonify({"status": "success", "role": "chauffeur", "user": driver.data[0]})
+            depot.rafraichir_chauffeur(uid, driver.data[0])
+            # Jeton d'accès : seul moyen pour le chauffeur de relire son propre historique
+            return jsonify({"status": "success", "role": "chauffeur", "user": driver.data[0],
+                            "access_token": auth.session.access_token if auth.session else None})
         
         passenger = supabase.table('passengers').select('*').eq('id', uid).execute()
         if passenger.data:
@@ -138,80 +248,82 @@ def login():
         return jsonify({"error": "Rôle inconnu"}), 400
     except: return jsonify({"error": "Email ou mot de passe incorrect"}), 401
 
+def _voyageurs_visibles(direction, lat, lon):
+    """Voyageurs qui vont dans la direction du bus, et pas trop loin de lui."""
+    try:
+        demande.synchroniser(supabase)
+        return demande.voyageurs_vers(direction, _nombre(lat, float, positif=False),
+                                      _nombre(lon, float, positif=False), DEMANDE_RAYON_KM)
+    except Exception as e:
+        print(f"Erreur recup voyageurs: {e}")
+        return []
+
 # --- API 3 : MISE A JOUR POSITION ---
 @app.route('/api/update-position', methods=['POST'])
 def update_position():
     data = request.json
+    try:
+        driver = depot.chauffeur(data.get('id'))
+        if not driver: return jsonify({"error": "Chauffeur inconnu"}), 404
+        return jsonify(traiter_position(data, driver))
+    except Exception as e: return jsonify({"error": str(e)}), 500
+
+def traiter_position(data, driver):
+    """Applique un ping GPS d'un chauffeur connu ; retourne la réponse (dict) de /api/update-position."""
     driver_id = data.get('id')
     lat = data.get('lat')
     lon = data.get('lon')
 
-    try:
-        driver_info = supabase.table('drivers').select('*').eq('id', driver_id).execute().data
-        if not driver_info: return jsonify({"error": "Chauffeur inconnu"}), 404
-        driver = driver_info[0]
-        
-        v_dep_nom = driver.get('ville_depart', '')
-        v_arr_nom = driver.get('ville_arrivee', '')
-
-        coord_dep = None
-        if driver.get('dep_lat'): coord_dep = {'lat': driver['dep_lat'], 'lon': driver['dep_lon']}
-        else: coord_dep = CITIES_DB.get(v_dep_nom)
-
-        coord_arr = None
-        if driver.get('arr_lat'): coord_arr = {'lat': driver['arr_lat'], 'lon': driver['arr_lon']}
-        else: coord_arr = CITIES_DB.get(v_arr_nom)
-
-        destination_actuelle = "Inconnue"
-
-        if coord_dep and coord_arr:
-            dist_to_dep = haversine(lat, lon, coord_dep['lat'], coord_dep['lon'])
-            dist_to_arr = haversine(lat, lon, coord_arr['lat'], coord_arr['lon'])
-
-            if dist_to_arr < 0.3:
-                supabase.table('active_trips').delete().eq('chauffeur_id', driver_id).execute()
-                return jsonify({
-                    "status": "finished", 
-                    "message": "Vous êtes arrivé au terminus. Mode hors ligne activé."
-                })
-
-            if dist_to_dep < dist_to_arr:
-                destination_actuelle = v_arr_nom 
-            else:
-                destination_actuelle = v_dep_nom 
-
-        supabase.table('active_trips').upsert({
-            'chauffeur_id': driver_id,
-            'current_lat': lat,
-            'current_lon': lon,
-            'direction_actuelle': destination_actuelle,
-            'last_update': 'now()'
-        }).execute()
+    # Ping en double ou périmé : réponse depuis l'état en mémoire (terminus vérifié plus bas quand même)
+    trajet = ingestion.trajet_si_doublon(driver_id, lat, lon, _nombre(data.get('ts'), float))
+    
+    v_dep_nom = driver.get('ville_depart', '')
+    v_arr_nom = driver.get('ville_arrivee', '')
+
+    coord_dep = None
+    if driver.get('dep_lat'): coord_dep = {'lat': driver['dep_lat'], 'lon': driver['dep_lon']}
+    else: coord_dep = lieux.resoudre(v_dep_nom)
+
+    coord_arr = None
+    if driver.get('arr_lat'): coord_arr = {'lat': driver['arr_lat'], 'lon': driver['arr_lon']}
+    else: coord_arr = lieux.resoudre(v_arr_nom)
+
+    destination_actuelle = "Inconnue"
+
+    if coord_dep and coord_arr:
+        # Ping ignoré : la position retenue reste celle du trajet en mémoire
+        pos_lat, pos_lon = (trajet['current_lat'], trajet['current_lon']) if trajet is not None else (lat, lon)
+        dist_to_dep = haversine(pos_lat, pos_lon, coord_dep['lat'], coord_dep['lon'])
+        dist_to_arr = haversine(pos_lat, pos_lon, coord_arr['lat'], coord_arr['lon'])
+
+        if dist_to_arr < 0.3:
+            ingestion.terminer(driver_id)
+            modele_vitesses.oublier(driver_id)
+            return {
+                "status": "finished", 
+                "message": "Vous êtes arrivé au terminus. Mode hors ligne activé."
+            }
+
+        if dist_to_dep < dist_to_arr:
+            destination_actuelle = v_arr_nom 
+        else:
+            destination_actuelle = v_dep_nom 
+
+    if trajet is not None:
+        return {
+            "status": "updated",
+            "direction": trajet['direction_actuelle'],
+            "voyageurs": _voyageurs_visibles(trajet['direction_actuelle'], lat, lon)
+        }
 
-        voyageurs_visibles = []
-        try:
-            fifteen_mins_ago = (datetime.datetime.utcnow() - datetime.timedelta(minutes=15)).isoformat()
-            requests = supabase.table('passenger_requests').select('*').gt('created_at', fifteen_mins_ago).execute().data
-            
-            if requests:
-                current_dest_clean = destination_actuelle.lower().strip()
-                for req in requests:
-                    r_arr = (req.get('arrivee_text') or "").lower().strip()
-                    is_match = False
-                    if r_arr and current_dest_clean and (r_arr in current_dest_clean or current_dest_clean in r_arr):
-                        is_match = True
-                    if is_match and req.get('user_lat'):
-                        voyageurs_visibles.append({'lat': req['user_lat'], 'lon': req['user_lon']})
-        except Exception as e:
-            print(f"Erreur recup voyageurs: {e}")
-        
-        return jsonify({
-            "status": "updated", 
-            "direction": destination_actuelle,
-            "voyageurs": voyageurs_visibles
-        })
-        
-    except Exception as e: return jsonify({"error": str(e)}), 500
+    ingestion.enregistrer(driver_id, lat, lon, destination_actuelle)
+    _observer_vitesse(driver, lat, lon)
+    
+    return {
+        "status": "updated", 
+        "direction": destination_actuelle,
+        "voyageurs": _voyageurs_visibles(destination_actuelle, lat, lon)
+    }
 
 # --- ROUTE STOP ---
 @app.route('/api/stop-driving', methods=['POST'])
@@ -219,147 +331,325 @@ def stop_driving():
     data = request.json
     driver_id = data.get('id')
     try:
-        supabase.table('active_trips').delete().eq('chauffeur_id', driver_id).execute()
+        ingestion.terminer(driver_id)
+        modele_vitesses.oublier(driver_id)
         return jsonify({'status': 'success', 'message': 'Vous êtes hors ligne'})
     except Exception as e:
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
 # --- API 4 : TROUVER BUS (INTELLIGENT) ---
-@app.route('/api/trouver-bus', methods=['POST'])
-def api_trouver_bus():
-    data = request.json
-    user_lat = data.get('user_lat')
-    user_lon = data.get('user_lon')
-    is_visible = data.get('visible', True)
-
-    def clean_text(t):
-        if not t: return ""
-        return t.lower().replace('-', ' ').strip()
-
-    txt_dep = clean_text(data.get('depart_text', ''))
-    txt_arr = clean_text(data.get('arrivee_text', ''))
-
+def clean_text(t):
+    if not t: return ""
+    return t.lower().replace('-', ' ').strip()
+
+def lire_recherche(data):
+    """Normalise les paramètres d'une recherche voyageur (corps JSON ou query string)."""
+    visible = data.get('visible', True)
+    if isinstance(visible, str): visible = visible.lower() not in ('0', 'false', 'non')
+    return {
+        'user_lat': _nombre(data.get('user_lat'), float, positif=False),
+        'user_lon': _nombre(data.get('user_lon'), float, positif=False),
+        'txt_dep': clean_text(data.get('depart_text', '')),
+        'txt_arr': clean_text(data.get('arrivee_text', '')),
+        'visible': visible,
+        'passenger_id': data.get('passenger_id'),
+        # Paramètres optionnels : nombre max de bus et rayon de recherche autour du voyageur
+        'limite': _nombre(data.get('limit'), int),
+        'rayon_km': _nombre(data.get('radius_km'), float),
+    }
+
+def enregistrer_demande(recherche):
+    """Signale le voyageur aux chauffeurs de sa direction (s'il est visible et localisé)."""
+    user_lat, user_lon = recherche['user_lat'], recherche['user_lon']
+    txt_dep, txt_arr = recherche['txt_dep'], recherche['txt_arr']
+    if recherche['visible'] and (txt_dep or txt_arr) and user_lat and user_lon:
+        # Anciens clients sans identifiant : la position arrondie sert de clé
+        passenger_id = recherche['passenger_id'] or f"pos:{round(user_lat, 4)},{round(user_lon, 4)}"
+        demande.ajouter(txt_arr, user_lat, user_lon, cle=passenger_id)
+        sessions_demande.signaler(passenger_id, user_lat, user_lon, txt_dep, txt_arr)
+
+def _cle_ligne(ligne):
+    """Clé (dep_lat, dep_lon, arr_lat, arr_lon) du tracé d'une ligne, None si un terminus est inconnu."""
+    if not (ligne.coord_dep and ligne.coord_arr): return None
+    try:
+        return tuple(float(c[k]) for c in (ligne.coord_dep, ligne.coord_arr) for k in ('lat', 'lon'))
+    except (TypeError, ValueError):
+        return None
+
+def _positions_sur_ligne(ligne, user_lat, user_lon, trip, memo):
+    """
+    (cle, abscisse_bus, abscisse_voyageur) en km le long du tracé de la ligne, de ville_depart
+    vers ville_arrivee. None tant que le tracé n'est pas prêt ou si l'un des deux est hors ligne.
+    """
+    cle = _cle_ligne(ligne)
+    trace = index_arrets.ligne(cle) if cle else None
+    if trace is None: return None
+    # Position du voyageur sur la ligne : une seule projection par recherche
+    if ('abscisse', cle) not in memo:
+        memo[('abscisse', cle)] = trace.projeter(user_lat, user_lon)
+    p_user = memo[('abscisse', cle)]
+    p_bus = trace.projeter(trip['current_lat'], trip['current_lon'])
+    if p_user is None or p_bus is None: return None
+    return cle, p_bus[0], p_user[0]
+
+def _observer_vitesse(driver, lat, lon):
+    """Alimente le modèle de vitesses avec la position du bus le long de sa ligne (si elle est tracée)."""
+    try:
+        cle = _cle_ligne(index_lignes.ligne(driver))
+        trace = index_arrets.ligne(cle) if cle else None
+        if trace is None: return
+        p = trace.projeter(lat, lon)
+        if p is not None:
+            modele_vitesses.observer(cle, trace.longueur_km, driver['id'], p[0])
+    except Exception as e: print(f"⚠️ Vitesses: {e}")
+
+def evaluer_bus(recherche, trip, driver, dist_index=None, dist_user_dest=None):
+    """
+    Applique à un bus les filtres de ligne et de sens d'une recherche.
+    Retourne la fiche du bus pour le voyageur, ou None s'il ne le concerne pas.
+    """
+    user_lat, user_lon = recherche['user_lat'], recherche['user_lon']
+    txt_dep, txt_arr = recherche['txt_dep'], recherche['txt_arr']
     has_dep = len(txt_dep) > 0
     has_arr = len(txt_arr) > 0
     recherche_active = (has_dep or has_arr)
-
-    if is_visible and recherche_active and user_lat and user_lon:
-        try:
-            supabase.table('passenger_requests').insert({
-                'user_lat': user_lat, 'user_lon': user_lon,
-                'depart_text': txt_dep, 'arrivee_text': txt_arr
-            }).execute()
-        except Exception as e: print(f"⚠️ Erreur: {e}")
-
+    if dist_user_dest is None: dist_user_dest = {}
+
+    # Ligne précalculée du chauffeur : plus de tests de sous-chaînes bus par bus
+    ligne = index_lignes.ligne(driver)
+    direction_reelle = clean_text(trip.get('direction_actuelle', ''))
+    sens = ligne.sens(normaliser(direction_reelle))
+    m_dep = index_lignes.masque(txt_dep, ligne)
+    m_arr = index_lignes.masque(txt_arr, ligne)
+
+    if recherche_active:
+        if has_dep and has_arr:
+            bus_sur_la_ligne = bool((m_dep & TERMINUS_DEPART and m_arr & TERMINUS_ARRIVEE) or (m_dep & TERMINUS_ARRIVEE and m_arr & TERMINUS_DEPART))
+        else: bus_sur_la_ligne = bool(m_dep | m_arr)
+        if not bus_sur_la_ligne: return None
+
+    coord_destination_user = None
+    if has_arr:
+        if m_arr & TERMINUS_DEPART: coord_destination_user = ligne.coord_dep
+        elif m_arr & TERMINUS_ARRIVEE: coord_destination_user = ligne.coord_arr
+        if not coord_destination_user:
+            # Ville citée dans le texte saisi ("gare d'azazga"), sans parcourir tout le répertoire
+            coord_destination_user = lieux.trouver_dans(txt_arr)
+
+    # Le bus doit rouler vers la destination du voyageur
+    if direction_reelle and has_arr:
+        if not (m_arr & sens if sens else txt_arr in direction_reelle): return None 
+
+    # Tracé de la ligne disponible : distance restante le long de la route, signée
+    sur_ligne = None
+    restant_ligne = None
+    if user_lat and trip['current_lat'] and sens:
+        sur_ligne = _positions_sur_ligne(ligne, user_lat, user_lon, trip, dist_user_dest)
+    if sur_ligne:
+        _, a_bus, a_user = sur_ligne
+        restant_ligne = (a_user - a_bus) if sens == TERMINUS_ARRIVEE else (a_bus - a_user)
+
+    if restant_ligne is not None:
+        if coord_destination_user and restant_ligne < -MARGE_PASSAGE_KM: return None
+    elif user_lat and trip['current_lat'] and coord_destination_user:
+        # Même destination pour la plupart des bus : distance voyageur -> destination calculée une fois
+        cle_dest = (coord_destination_user['lat'], coord_destination_user['lon'])
+        if cle_dest not in dist_user_dest:
+            dist_user_dest[cle_dest] = haversine(user_lat, user_lon, *cle_dest)
+        dist_user_to_dest = dist_user_dest[cle_dest]
+        dist_bus_to_dest = haversine(trip['current_lat'], trip['current_lon'], coord_destination_user['lat'], coord_destination_user['lon'])
+        if dist_bus_to_dest < (dist_user_to_dest - 2.0): return None 
+
+    dist_user_bus = 0
+    eta_min = 0 
+    if user_lat and trip['current_lat']:
+        # Distance déjà calculée par l'index spatial quand le voyageur est localisé
+        dist_user_bus = dist_index if dist_index is not None else haversine(user_lat, user_lon, trip['current_lat'], trip['current_lon'])
+        if restant_ligne is not None and restant_ligne > 0:
+            # Vitesses apprises tronçon par tronçon sur cette ligne, à cette heure
+            eta_min = int(modele_vitesses.duree_s(*sur_ligne) / 60)
+        else:
+            eta_min = int(dist_user_bus / modele_vitesses.vitesse_creneau() * 60)
+        if eta_min < 1: eta_min = 1
+
+    return {
+        'bus_id': trip['chauffeur_id'],
+        'current_lat': trip['current_lat'],
+        'current_lon': trip['current_lon'],
+        'distance_km': round(dist_user_bus, 1),
+        'eta': eta_min,
+        **fiche_bus(driver, direction_reelle, ligne)
+    }
+
+def fiche_bus(driver, direction_reelle, ligne=None):
+    """Partie statique de la fiche d'un bus (profil, terminus et tarifs du sens) : change rarement."""
+    if ligne is None: ligne = index_lignes.ligne(driver)
+    sens = ligne.sens(normaliser(direction_reelle))
+    vers_depart = (sens == TERMINUS_DEPART) if sens else normaliser(direction_reelle) in ligne.v1
+    if vers_depart:
+        coord_arr_ligne = ligne.coord_dep
+        coord_dep_ligne = ligne.coord_arr
+    else:
+        coord_arr_ligne = ligne.coord_arr
+        coord_dep_ligne = ligne.coord_dep
+
+    # FILTRAGE INTELLIGENT DES TICKETS (précalculé par sens dans la ligne)
+    tarifs_filtrés = ligne.tarifs_vers(normaliser(direction_reelle))
+
+    return {
+        'chauffeur': driver['nom_complet'],
+        'modele': driver.get('modele_vehicule', 'Bus'),
+        'matricule': driver.get('matricule_vehicule', ''),
+        'direction': direction_reelle,
+        'terminus_officiel': coord_arr_ligne, 
+        'ligne_start': coord_dep_ligne,
+        'ligne_end': coord_arr_ligne,
+        'ticket_actif': driver.get('ticket_actif', False),
+        'tarifs': tarifs_filtrés
+    }
+
+def rechercher_bus(recherche):
+    """Liste des bus qui correspondent à une recherche, du plus proche au plus loin."""
+    flotte.synchroniser(depot)
+    limite = recherche['limite']
+    if recherche['user_lat'] is not None and recherche['user_lon'] is not None:
+        # Les bus arrivent du plus proche au plus loin : on s'arrête dès `limite` bus retenus
+        candidats = flotte.iter_proches(recherche['user_lat'], recherche['user_lon'], recherche['rayon_km'])
+    else:
+        candidats = ((None, t) for t in flotte.trajets_actifs())
+    taille_lot = max(limite * 4, 20) if limite else None
+    bus_proches = []
+    dist_user_dest = {}
+
+    for lot in _par_lots(candidats, taille_lot):
+        # Un seul aller-retour par paquet de chauffeurs (aucun s'ils sont en cache)
+        drivers = depot.chauffeurs([t['chauffeur_id'] for _, t in lot])
+        for dist_index, trip in lot:
+            if limite and len(bus_proches) >= limite: break
+            driver = drivers.get(trip['chauffeur_id'])
+            if not driver: continue
+            bus = evaluer_bus(recherche, trip, driver, dist_index, dist_user_dest)
+            if bus: bus_proches.append(bus)
+        if limite and len(bus_proches) >= limite: break
+
+    bus_proches.sort(key=lambda x: x['distance_km'])
+    return bus_proches
+
+@app.route('/api/trouver-bus', methods=['GET', 'POST'])
+def api_trouver_bus():
+    """
+    POST (historique) : liste complète. GET (mêmes paramètres en query string) :
+    réponse conditionnelle, 304 tant que son contenu ne change pas (If-None-Match).
+    format=compact : seulement id, position, ETA et distance par bus, la partie
+    statique se lit une fois par /api/fiches-bus (voir reponses.py).
+    """
+    data = request.args if request.method == 'GET' else (request.json or {})
+    recherche = lire_recherche(data)
+    enregistrer_demande(recherche)
+    compact = data.get('format') == 'compact'
+    etag = None
     try:
-        timeout_limit = (datetime.datetime.utcnow() - datetime.timedelta(seconds=45)).isoformat()
-        active_trips = supabase.table('active_trips').select('*').gt('last_update', timeout_limit).execute().data
-        bus_proches = []
-
-        for trip in active_trips:
-            try:
-                driver_req = supabase.table('drivers').select('*').eq('id', trip['chauffeur_id']).execute()
-                if not driver_req.data: continue
-                driver = driver_req.data[0]
-            except: continue
-
-            v1 = clean_text(driver.get('ville_depart', ''))
-            v2 = clean_text(driver.get('ville_arrivee', ''))
-            direction_reelle = clean_text(trip.get('direction_actuelle', ''))
-
-            if recherche_active:
-                bus_sur_la_ligne = False
-                match_v1 = (txt_dep in v1 or txt_arr in v1)
-                match_v2 = (txt_dep in v2 or txt_arr in v2)
-                if has_dep and has_arr:
-                    if (txt_dep in v1 and txt_arr in v2) or (txt_dep in v2 and txt_arr in v1): bus_sur_la_ligne = True
-                elif match_v1 or match_v2: bus_sur_la_ligne = True
-                if not bus_sur_la_ligne: continue
-
-            coord_destination_user = None
-            if has_arr:
-                if txt_arr in v1: 
-                     if driver.get('dep_lat'): coord_destination_user = {'lat': driver['dep_lat'], 'lon': driver['dep_lon']}
-                     else: coord_destination_user = CITIES_DB.get(v1)
-                elif txt_arr in v2:
-                     if driver.get('arr_lat'): coord_destination_user = {'lat': driver['arr_lat'], 'lon': driver['arr_lon']}
-                     else: coord_destination_user = CITIES_DB.get(v2)
-                if not coord_destination_user:
-                     for k in CITIES_DB:
-                         if k in txt_arr: coord_destination_user = CITIES_DB[k]; break
-
-            if direction_reelle and has_arr:
-                if txt_arr not in direction_reelle: continue 
-
-            if user_lat and trip['current_lat'] and coord_destination_user:
-                dist_user_to_dest = haversine(user_lat, user_lon, coord_destination_user['lat'], coord_destination_user['lon'])
-                dist_bus_to_dest = haversine(trip['current_lat'], trip['current_lon'], coord_destination_user['lat'], coord_destination_user['lon'])
-                if dist_bus_to_dest < (dist_user_to_dest - 2.0): continue 
-
-            real_dep_coord = None
-            if driver.get('dep_lat') and driver.get('dep_lon'):
-                real_dep_coord = {'lat': driver['dep_lat'], 'lon': driver['dep_lon']}
-            else: real_dep_coord = CITIES_DB.get(v1)
-
-            real_arr_coord = None
-            if driver.get('arr_lat') and driver.get('arr_lon'):
-                real_arr_coord = {'lat': driver['arr_lat'], 'lon': driver['arr_lon']}
-            else: real_arr_coord = CITIES_DB.get(v2)
-
-            coord_dep_ligne = None
-            coord_arr_ligne = None
-            if direction_reelle in v1:
-                coord_arr_ligne = real_dep_coord
-                coord_dep_ligne = real_arr_coord
-            else:
-                coord_arr_ligne = real_arr_coord
-                coord_dep_ligne = real_dep_coord
-
-            dist_user_bus = 0
-            eta_min = 0 
-            if user_lat and trip['current_lat']:
-                dist_user_bus = haversine(user_lat, user_lon, trip['current_lat'], trip['current_lon'])
-                vitesse_moyenne = 25.0 
-                temps_heures = dist_user_bus / vitesse_moyenne
-                eta_min = int(temps_heures * 60)
-                if eta_min < 1: eta_min = 1
-
-            # FILTRAGE INTELLIGENT DES TICKETS
-            tarifs_bruts = driver.get('tarifs', [])
-            tarifs_filtrés = []
-            
-            if direction_reelle:
-                for t in tarifs_bruts:
-                    dest_ticket = clean_text(t.get('dest', ''))
-                    if dest_ticket and (dest_ticket in direction_reelle or direction_reelle in dest_ticket):
-                        tarifs_filtrés.append(t)
-                if not tarifs_filtrés and tarifs_bruts: tarifs_filtrés = tarifs_bruts
-            else:
-                tarifs_filtrés = tarifs_bruts
-
-            bus_proches.append({
-                'bus_id': trip['chauffeur_id'],
-                'chauffeur': driver['nom_complet'],
-                'modele': driver.get('modele_vehicule', 'Bus'),
-                'matricule': driver.get('matricule_vehicule', ''),
-                'current_lat': trip['current_lat'],
-                'current_lon': trip['current_lon'],
-                'distance_km': round(dist_user_bus, 1),
-                'eta': eta_min,
-                'direction': direction_reelle,
-                'terminus_officiel': coord_arr_ligne, 
-                'ligne_start': coord_dep_ligne,
-                'ligne_end': coord_arr_ligne,
-                'ticket_actif': driver.get('ticket_actif', False),
-                'tarifs': tarifs_filtrés
-            })
-
-        bus_proches.sort(key=lambda x: x['distance_km'])
-        return jsonify({"bus_proches": bus_proches})
-
+        bus = rechercher_bus(recherche)
     except Exception as e:
         print(f"🔴 ERREUR: {e}")
-        return jsonify({"bus_proches": []})
+        bus = None
+    corps = compacter(bus or []) if compact else {"bus_proches": bus or []}
+    if request.method == 'GET' and bus is not None:
+        etag = etag_contenu(corps)
+        if request.if_none_match.contains_weak(etag):
+            reponse = Response(status=304)
+            reponse.set_etag(etag, weak=True)
+            reponse.headers['Cache-Control'] = 'private, no-cache'
+            return reponse
+    reponse = jsonify(corps)
+    if etag:
+        reponse.set_etag(etag, weak=True)
+        reponse.headers['Cache-Control'] = 'private, no-cache'
+    return reponse
+
+@app.route('/api/fiches-bus', methods=['GET'])
+def api_fiches_bus():
+    """Parties statiques des fiches des bus `ids` (séparés par des virgules), avec leur version."""
+    ids = [i for i in request.args.get('ids', '').split(',') if i][:100]
+    fiches = {}
+    try:
+        drivers = depot.chauffeurs(ids)
+        for driver_id in ids:
+            trip, driver = flotte.trajet(driver_id), drivers.get(driver_id)
+            if not trip or not driver: continue
+            fiche = fiche_bus(driver, clean_text(trip.get('direction_actuelle', '')))
+            fiches[driver_id] = dict(fiche, version=version_fiche(fiche))
+    except Exception as e:
+        print(f"🔴 ERREUR fiches: {e}")
+    return jsonify({"fiches": fiches})
+
+# --- API 4 bis : FLUX TEMPS RÉEL (remplace le polling de /api/trouver-bus) ---
+def _fiches_bus(recherche, ids):
+    """Fiches à jour des bus `ids` pour une recherche (bus absents ou hors critères omis)."""
+    drivers = depot.chauffeurs(ids)
+    fiches = {}
+    for driver_id in ids:
+        trip, driver = flotte.trajet(driver_id), drivers.get(driver_id)
+        if not trip or not driver: continue
+        bus = evaluer_bus(recherche, trip, driver)
+        if bus and (not recherche['rayon_km'] or bus['distance_km'] <= recherche['rayon_km']):
+            fiches[driver_id] = bus
+    return fiches
+
+@app.route('/api/flux-bus', methods=['GET'])
+def flux_bus():
+    """
+    Flux SSE : un évènement `snapshot` à l'ouverture, puis des `delta`
+    ({maj: [...], retires: [...]}) à chaque ping d'un bus concerné. Tout est
+    recalculé toutes les FLUX_TICK_S secondes (bus expirés, pings reçus par
+    d'autres workers). Le flux se ferme après FLUX_DUREE_MAX_S secondes :
+    EventSource se reconnecte tout seul. 503 si le worker a déjà
+    STREAM_MAX_CLIENTS flux ouverts : le client sonde /api/trouver-bus.
+    """
+    recherche = lire_recherche(request.args)
+    enregistrer_demande(recherche)
+    ab = diffuseur.abonner(recherche)
+    if ab is None:
+        return jsonify({"error": "Trop de flux ouverts, utiliser /api/trouver-bus"}), 503, {'Retry-After': '60'}
+
+    def flux():
+        try:
+            yield evenement_sse('abonnement', {'id': ab.id})
+            bus = rechercher_bus(ab.recherche)
+            ab.envoyes = {b['bus_id']: b for b in bus}
+            yield evenement_sse('snapshot', {'bus_proches': bus})
+            fin = time.monotonic() + FLUX_DUREE_MAX_S
+            while time.monotonic() < fin:
+                ids, tout = ab.attendre(FLUX_TICK_S)
+                if tout or not ids:
+                    # Réveil par timeout ou nouvelle recherche : on recalcule toute la liste
+                    nouveaux = {b['bus_id']: b for b in rechercher_bus(ab.recherche)}
+                    ids = set(ab.envoyes) | set(nouveaux)
+                else:
+                    nouveaux = _fiches_bus(ab.recherche, list(ids))
+                delta = calculer_delta(ab.envoyes, nouveaux, ids)
+                if delta: yield evenement_sse('delta', delta)
+                else: yield ": ping\n\n"
+        except Exception as e:
+            print(f"🔴 ERREUR flux: {e}")
+        finally:
+            diffuseur.desabonner(ab)
+
+    reponse = Response(stream_with_context(flux()), mimetype='text/event-stream',
+                       headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Client parti avant le premier évènement : le générateur n'a jamais démarré, son finally non plus
+    reponse.call_on_close(lambda: diffuseur.desabonner(ab))
+    return reponse
+
+@app.route('/api/flux-bus/<ab_id>', methods=['POST'])
+def modifier_flux_bus(ab_id):
+    """Met à jour la position / la recherche d'un flux ouvert (404 : rouvrir le flux)."""
+    ab = diffuseur.abonnement(ab_id)
+    if not ab: return jsonify({"error": "Flux inconnu"}), 404
+    recherche = lire_recherche(request.json)
+    enregistrer_demande(recherche)
+    ab.modifier(recherche)
+    return jsonify({"status": "success"})
 
 # --- API 5 : UPDATE PROFILE ---
 @app.route('/api/update-driver-profile', methods=['POST'])
@@ -383,72 +673,255 @@ def update_driver_profile():
         if 'ticket_actif' in data: update_data['ticket_actif'] = data.get('ticket_actif')
         if 'tarifs' in data: update_data['tarifs'] = data.get('tarifs')
 
-        supabase.table('drivers').update(update_data).eq('id', uid).execute()
+        res = supabase.table('drivers').update(update_data).eq('id', uid).execute()
+        if res.data: depot.rafraichir_chauffeur(uid, res.data[0])
+        else: depot.invalider_chauffeur(uid)
+        diffuseur.publier(uid)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # --- API 6 : NEWS ALGERIE ---
+# Flux surchargeables par NEWS_FEEDS (URL séparées par des virgules, file:// accepté pour les tests)
+RSS_URLS = [u.strip() for u in os.getenv("NEWS_FEEDS", "").split(",") if u.strip()] or [
+    "https://www.tsa-algerie.com/feed/",
+    "https://www.algerie360.com/feed/",
+    "https://www.aps.dz/algerie?format=feed"
+]
+NEWS_KEYWORDS = ["transport", "bus", "tramway", "métro", "route", "circulation", "tizi ouzou", "naftal", "etusa", "train", "sntf", "autoroute"]
+actualites = AgregateurActualites(
+    RSS_URLS, NEWS_KEYWORDS,
+    intervalle=float(os.getenv("NEWS_REFRESH_SECONDS", 600)),
+    timeout=float(os.getenv("NEWS_TIMEOUT_SECONDS", 8))
+)
+
 @app.route('/api/news', methods=['GET'])
 def get_transport_news():
-    rss_urls = [
-        "https://www.tsa-algerie.com/feed/",
-        "https://www.algerie360.com/feed/",
-        "https://www.aps.dz/algerie?format=feed"
-    ]
-    keywords = ["transport", "bus", "tramway", "métro", "route", "circulation", "tizi ouzou", "naftal", "etusa", "train", "sntf", "autoroute"]
-    news_items = []
-
     try:
-        for url in rss_urls:
-            feed = feedparser.parse(url)
-            for entry in feed.entries:
-                text_content = (entry.title + " " + entry.description).lower()
-                if any(k in text_content for k in keywords):
-                    try:
-                        dt = date_parser.parse(entry.published)
-                        date_str = dt.strftime("%d/%m %H:%M")
-                    except:
-                        date_str = "Récemment"
-
-                    summary_text = entry.description.replace('<p>', '').replace('</p>', '')[:120] + "..."
-
-                    news_items.append({
-                        "title": entry.title,
-                        "link": entry.link,
-                        "source": feed.feed.title.split('-')[0].strip()[:15], 
-                        "date": date_str,
-                        "summary": summary_text
-                    })
-        
-        return jsonify(news_items[:10]) 
+        return jsonify(actualites.actualites())
     except Exception as e:
         print(f"Erreur News: {e}")
         return jsonify([])
 
 # --- API 7 : SIGNALEMENTS (WAZE-LIKE) ---
+# Signalements en mémoire (grille + révisions), regroupés s'ils sont proches ; road_events relue par lots pour les autres workers
+evenements = GrilleEvenements(
+    duree_vie=float(os.getenv("EVENT_TTL_SECONDS", 2 * 3600)),
+    rayon_fusion_m=float(os.getenv("EVENT_MERGE_METERS", 150)),
+    sync_s=float(os.getenv("EVENT_SYNC_SECONDS", 15))
+)
+
 @app.route('/api/report-event', methods=['POST'])
 def report_event():
     data = request.json
     try:
-        supabase.table('road_events').insert({
+        res = supabase.table('road_events').insert({
             'type': data.get('type'),
             'lat': data.get('lat'),
             'lon': data.get('lon'),
             'reported_by': data.get('user_id')
         }).execute()
-        return jsonify({"status": "success"})
+        ligne = (res.data or [None])[0]
+        if not ligne or ligne.get('id') is None:
+            # Sans id, la ligne serait comptée une 2e fois à la relecture : on la relit tout de suite à la place
+            evenements.synchroniser(supabase, force=True)
+            return jsonify({"status": "success", "evenement": None})
+        evt = evenements.ajouter_ligne(ligne)
+        return jsonify({"status": "success", "evenement": evt})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _bbox(valeur):
+    """bbox=ouest,sud,est,nord (ordre de Leaflet toBBoxString) -> (sud, ouest, nord, est)."""
+    try:
+        ouest, sud, est, nord = (float(v) for v in valeur.split(','))
+    except (AttributeError, ValueError):
+        return None
+    return (min(sud, nord), min(ouest, est), max(sud, nord), max(ouest, est))
+
 @app.route('/api/get-events', methods=['GET'])
 def get_events():
+    """
+    Sans paramètre : liste des événements actifs (ancien format).
+    Avec bbox et/ou since : {curseur, complet, evenements, retires}, seulement ce qui a changé après `since`.
+    """
+    evenements.synchroniser(supabase)
+    bbox = _bbox(request.args.get('bbox'))
+    since = request.args.get('since')
+    if bbox is None and since is None:
+        return jsonify(evenements.depuis()['evenements'])
+    return jsonify(evenements.depuis(since, bbox))
+
+# --- API 8 : ITINÉRAIRES (OSRM EN CACHE) ---
+routes = CacheRoutes(
+    os.getenv("ROUTE_CACHE_PATH", "/tmp/finaltrans_routes.db"),
+    pas_deg=float(os.getenv("ROUTE_SNAP_DEG", 0.001)),
+    taille_memoire=int(os.getenv("ROUTE_CACHE_SIZE", 512))
+)
+
+def _tracer_ligne(cle):
+    """Polyline complète d'une ligne (dep_lat, dep_lon, arr_lat, arr_lon) et ses arrêts OSM, via les caches."""
+    points = decoder_polyline(routes.route(*cle)['polyline'])
     try:
-        two_hours_ago = (datetime.datetime.utcnow() - datetime.timedelta(hours=2)).isoformat()
-        events = supabase.table('road_events').select('*').gt('created_at', two_hours_ago).execute().data
-        return jsonify(events)
+        arrets = tuiles_arrets.arrets_le_long(points)
     except Exception as e:
-        return jsonify([])
+        print(f"⚠️ Arrêts de la ligne {cle}: {e}")
+        arrets = []
+    return points, (arrets or None)
+
+# Lignes tracées pour "bus déjà passé" et l'ETA ; construites en tâche de fond au premier besoin
+index_arrets = IndexArrets(construire=_tracer_ligne)
+MARGE_PASSAGE_KM = float(os.getenv("PASSED_MARGIN_KM", 0.3))
+# Vitesses apprises des pings (par ligne, tronçon et demi-heure) pour l'ETA ; 25 km/h tant qu'on ne sait rien
+modele_vitesses = ModeleVitesses(
+    longueur_troncon_km=float(os.getenv("ETA_SEGMENT_KM", 1.0)),
+    vitesse_defaut=float(os.getenv("ETA_DEFAULT_SPEED_KMH", 25))
+)
+
+@app.route('/api/route', methods=['GET'])
+def get_route():
+    a = request.args
+    coords = [_nombre(a.get(k), float, positif=False) for k in ('dep_lat', 'dep_lon', 'arr_lat', 'arr_lon')]
+    if None in coords:
+        return jsonify({"error": "Coordonnées manquantes"}), 400
+    zoom = _nombre(a.get('zoom'), int, positif=False)
+    try:
+        trajet = routes.route(*coords, zoom=zoom)
+    except Exception as e:
+        print(f"Erreur OSRM: {e}")
+        return jsonify({"error": "Itinéraire indisponible"}), 502
+    resp = jsonify(trajet)
+    # Même couple arrondi = même tracé : le navigateur peut le garder
+    resp.headers['Cache-Control'] = 'public, max-age=86400'
+    return resp
+
+# --- API 9 : GÉOCODAGE / AUTOCOMPLÉTION (RÉPERTOIRE LOCAL) ---
+@app.route('/api/geocode', methods=['GET'])
+def geocode():
+    limite = min(_nombre(request.args.get('limit'), int) or 5, 20)
+    resp = jsonify(lieux.rechercher(request.args.get('q', ''), limite))
+    resp.headers['Cache-Control'] = 'public, max-age=86400'
+    return resp
+
+# --- API 10 : ARRÊTS DE BUS PAR TUILES (OSM EN CACHE) ---
+# Tuiles z/x/y (zoom >= 14) en cache SQLite ; préchargement : python arrets.py sud ouest nord est
+tuiles_arrets = TuilesArrets(
+    os.getenv("STOP_TILES_PATH", "/tmp/finaltrans_arrets.db"),
+    duree_vie=float(os.getenv("STOP_TILES_TTL_SECONDS", 30 * 86400))
+)
+
+@app.route('/api/arrets/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_arrets(z, x, y):
+    try:
+        tuile = tuiles_arrets.tuile(z, x, y)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Erreur Overpass: {e}")
+        return jsonify({"error": "Arrêts indisponibles"}), 502
+    resp = jsonify(tuile)
+    # Les arrêts ne bougent presque jamais : une semaine dans le cache du navigateur
+    resp.headers['Cache-Control'] = 'public, max-age=604800'
+    return resp
+
+# --- API 11 : MÉTRIQUES (PROMETHEUS) ---
+def _caches():
+    return {'chauffeurs': cache_chauffeurs.stats(), 'routes': routes.memoire.stats(), 'arrets': tuiles_arrets.memoire.stats()}
+
+metriques.collecter('flotte_bus', 'gauge', "Bus actifs dans la flotte en mémoire", lambda: len(flotte))
+metriques.collecter('flux_abonnes', 'gauge', "Voyageurs abonnés au flux SSE", lambda: len(diffuseur))
+metriques.collecter('flux_refuses_total', 'counter', "Flux SSE refusés (STREAM_MAX_CLIENTS atteint)",
+                    lambda: diffuseur.refuses)
+metriques.collecter('evenements_actifs', 'gauge', "Signalements routiers actifs", lambda: len(evenements))
+metriques.collecter('cache_hits_total', 'counter', "Lectures servies par le cache",
+                    lambda: {(nom,): s['hits'] for nom, s in _caches().items()}, ('cache',))
+metriques.collecter('cache_misses_total', 'counter', "Lectures absentes du cache",
+                    lambda: {(nom,): s['misses'] for nom, s in _caches().items()}, ('cache',))
+metriques.collecter('cache_ratio', 'gauge', "Taux de hits du cache",
+                    lambda: {(nom,): s['ratio'] for nom, s in _caches().items()}, ('cache',))
+metriques.collecter('pings_total', 'counter', "Pings GPS reçus, par sort",
+                    lambda: {(k,): v for k, v in filtre_pings.stats().items()}, ('resultat',))
+metriques.collecter('appels_externes_total', 'counter', "Appels aux services externes (OSRM, Overpass)",
+                    lambda: {('osrm',): routes.appels_osrm, ('overpass',): tuiles_arrets.appels_overpass}, ('service',))
+metriques.collecter('eta_observations_total', 'counter', "Observations de vitesse apprises",
+                    lambda: modele_vitesses.observations)
+metriques.collecter('historique_points_total', 'counter', "Pings ajoutés à l'historique, reçus et gardés par le filtre",
+                    lambda: {('recus',): historique.recus, ('gardes',): historique.gardes}, ('etat',))
+metriques.collecter('historique_octets_total', 'counter', "Octets écrits dans les segments d'historique",
+                    lambda: historique.octets)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metriques.exposer(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/lentes', methods=['GET'])
+def get_requetes_lentes():
+    # Profils des dernières requêtes lentes (SLOW_REQUEST_PROFILE_MS)
+    if profileur is None:
+        return jsonify({"error": "Profilage désactivé (SLOW_REQUEST_PROFILE_MS)"}), 404
+    return jsonify(list(profileur.lentes))
+
+# --- API 12 : HISTORIQUE DES TRAJETS (REJEU) ---
+HISTORIQUE_MAX_S = 7 * 86400
+# Jeton d'administration (Authorization: Bearer ...) donnant accès à l'historique de tous les chauffeurs
+HISTORIQUE_JETON_ADMIN = os.getenv("HISTORY_ADMIN_TOKEN")
+
+def _refus_historique(driver_id):
+    """
+    None si la requête peut lire l'historique de `driver_id`, sinon la réponse d'erreur :
+    il faut le jeton d'accès Supabase du chauffeur lui-même (renvoyé par /api/login) ou HISTORY_ADMIN_TOKEN.
+    """
+    jeton = request.headers.get('Authorization', '').partition('Bearer ')[2].strip()
+    if not jeton:
+        return jsonify({"error": "Authentification requise"}), 401
+    if HISTORIQUE_JETON_ADMIN and hmac.compare_digest(jeton, HISTORIQUE_JETON_ADMIN):
+        return None
+    try:
+        uid = supabase.auth.get_user(jeton).user.id if supabase else None
+    except Exception:
+        uid = None
+    if uid is None:
+        return jsonify({"error": "Jeton invalide"}), 401
+    if uid != driver_id:
+        return jsonify({"error": "Historique d'un autre chauffeur"}), 403
+    return None
+
+def _instant(valeur):
+    """Timestamp d'un paramètre client : nombre (epoch) ou date ISO, None si absent ou invalide."""
+    if not valeur: return None
+    n = _nombre(valeur, float)
+    return n if n is not None else epoch_depuis_iso(valeur)
+
+@app.route('/api/historique/<driver_id>', methods=['GET'])
+def get_historique(driver_id):
+    """
+    Trajet d'un chauffeur entre `debut` et `fin` (epoch ou ISO ; par défaut la dernière heure) :
+    polyline des points gardés + leurs horodatages. `a=<instant>` : position rejouée à cet instant.
+    `tolerance_m` : tracé simplifié (Douglas-Peucker) pour l'affichage, sans horodatages.
+    Réservé au chauffeur concerné (ou à l'administration), voir `_refus_historique`.
+    """
+    refus = _refus_historique(driver_id)
+    if refus: return refus
+    a = request.args
+    if a.get('a'):
+        instant = _instant(a.get('a'))
+        if instant is None: return jsonify({"error": "Instant invalide"}), 400
+        position = historique.position_a(driver_id, instant)
+        if position is None: return jsonify({"error": "Aucune position à cet instant"}), 404
+        return jsonify({"chauffeur": driver_id, "position": position})
+    fin = _instant(a.get('fin')) or time.time()
+    debut = _instant(a.get('debut')) or fin - 3600
+    if debut > fin or fin - debut > HISTORIQUE_MAX_S:
+        return jsonify({"error": "Intervalle invalide (7 jours au plus)"}), 400
+    points = historique.points(driver_id, debut, fin)
+    corps = {"chauffeur": driver_id, "debut": debut, "fin": fin, "points": len(points)}
+    tolerance_m = _nombre(a.get('tolerance_m'), float)
+    if tolerance_m:
+        corps["polyline"] = encoder_polyline(simplifier([(p[1], p[2]) for p in points], tolerance_m / 111320.0))
+    else:
+        corps["polyline"] = encoder_polyline([(p[1], p[2]) for p in points])
+        corps["horodatages"] = [round(p[0], 3) for p in points]
+    return jsonify(corps)
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,258 @@
+"""
+Arrêts de bus (OpenStreetMap) servis par tuiles z/x/y, en cache persistant.
+
+Les arrêts ne changent presque jamais : au lieu d'une requête Overpass à
+chaque déplacement de la carte, on les range par tuile de zoom `zoom_base`
+(14, ~2,4 km à Tizi Ouzou) dans SQLite.
+- Une tuile absente est chargée avec ses voisines manquantes en une seule
+  requête Overpass (bloc de tuiles), puis gardée `duree_vie` (30 jours).
+- Si Overpass ne répond pas, une tuile périmée est servie telle quelle.
+- Une tuile est stockée en polyline encodée (format Google, précision 1e-5)
+  des arrêts triés, plus la liste de leurs noms : quelques octets par arrêt.
+- `python arrets.py sud ouest nord est` précharge une zone (jeu local).
+
+Le même jeu d'arrêts sert à l'index des lignes : `arrets_le_long(points)`
+donne les arrêts d'un tracé, dans l'ordre, pour `index_arrets.LigneTracee`.
+"""
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import requests
+
+from cache import CacheTTL
+from index_arrets import LigneTracee
+from itineraires import decoder_polyline, encoder_polyline
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+ZOOM_BASE = 14
+BLOC_MAX = 8   # au plus 8 x 8 tuiles par requête Overpass
+VOISINAGE = 4  # une tuile manquante est chargée avec son bloc aligné de 4 x 4 tuiles
+NB_VERROUS = 256  # verrous de chargement répartis par tuile (x, y)
+
+_session = requests.Session()
+
+
+# --- TUILES (SCHÉMA XYZ, COMME LEAFLET) ---
+def tuile_de(lat, lon, z):
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def bbox_tuile(z, x, y):
+    """(sud, ouest, nord, est) de la tuile."""
+    n = 2 ** z
+
+    def lat(y_):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y_ / n))))
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def telecharger_arrets(sud, ouest, nord, est, timeout=60):
+    """[(nom, lat, lon), ...] des arrêts OSM de la zone (Overpass)."""
+    zone = f"({sud},{ouest},{nord},{est})"
+    requete = (f'[out:json][timeout:{int(timeout)}];'
+               f'(node["highway"="bus_stop"]{zone};node["public_transport"="platform"]{zone};);out body;')
+    reponse = _session.post(OVERPASS_URL, data={'data': requete}, timeout=timeout + 5)
+    reponse.raise_for_status()
+    return [(e.get('tags', {}).get('name', ''), e['lat'], e['lon'])
+            for e in reponse.json().get('elements', []) if 'lat' in e]
+
+
+class TuilesArrets:
+    def __init__(self, chemin, telecharger=telecharger_arrets, zoom_base=ZOOM_BASE,
+                 duree_vie=30 * 86400, taille_memoire=4096, horloge=time.time):
+        """`telecharger(sud, ouest, nord, est)` -> [(nom, lat, lon), ...]."""
+        self.chemin = chemin
+        self.telecharger = telecharger
+        self.zoom_base = zoom_base
+        self.duree_vie = duree_vie
+        self.horloge = horloge
+        self.memoire = CacheTTL(taille_max=taille_memoire, ttl=duree_vie)
+        self._local = threading.local()
+        # Un verrou par groupe de tuiles (et pas un verrou global) : deux chargements ne s'attendent
+        # que s'ils touchent les mêmes tuiles
+        self._verrous = [threading.Lock() for _ in range(NB_VERROUS)]
+        self.appels_overpass = 0
+        with self._conn() as conn:
+            conn.execute("""create table if not exists tuiles (
+                x integer, y integer, polyline text, noms text, cree real, primary key (x, y))""")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.chemin, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # --- LECTURE ---
+    def tuile(self, z, x, y):
+        """
+        {'z', 'x', 'y', 'polyline', 'noms'} des arrêts de la tuile (zoom >= zoom_base).
+        Lève ValueError pour une tuile invalide, l'erreur d'Overpass si rien n'est disponible.
+        """
+        n = 2 ** z
+        if z < self.zoom_base or not (0 <= x < n and 0 <= y < n):
+            raise ValueError("Tuile invalide")
+        d = z - self.zoom_base
+        arrets = self._base(x >> d, y >> d)
+        if d:
+            sud, ouest, nord, est = bbox_tuile(z, x, y)
+            arrets = [a for a in arrets if sud <= a[1] < nord and ouest <= a[2] < est]
+        return {'z': z, 'x': x, 'y': y, 'polyline': encoder_polyline([(a[1], a[2]) for a in arrets]),
+                'noms': [a[0] for a in arrets]}
+
+    def arrets_dans(self, sud, ouest, nord, est):
+        """Arrêts [(nom, lat, lon), ...] de la zone (les tuiles manquantes sont chargées en blocs)."""
+        x0, y0 = tuile_de(nord, ouest, self.zoom_base)
+        x1, y1 = tuile_de(sud, est, self.zoom_base)
+        self._charger(x0, y0, x1, y1)
+        return [a for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for a in self._base(x, y)
+                if sud <= a[1] <= nord and ouest <= a[2] <= est]
+
+    def arrets_le_long(self, points, ecart_max_km=0.05, fusion_km=0.05):
+        """
+        Arrêts à moins de `ecart_max_km` du tracé, dans l'ordre du parcours.
+        Deux arrêts à moins de `fusion_km` l'un de l'autre le long du tracé
+        (les deux côtés de la route) n'en font qu'un.
+        """
+        if len(points) < 2:
+            return []
+        # Seulement les tuiles du couloir autour du tracé, pas de toute sa boîte englobante
+        # (une ligne interwilayas couvrirait des milliers de tuiles)
+        tuiles = self.tuiles_couloir(points, ecart_max_km * 2)
+        self._charger_tuiles(tuiles)
+        candidats = [a for t in sorted(tuiles) for a in self._base(*t)]
+        ligne = LigneTracee(points)
+        projetes = []
+        for nom, lat, lon in candidats:
+            p = ligne.projeter(lat, lon, ecart_max_km)
+            if p is not None:
+                projetes.append((p[0], nom, lat, lon))
+        projetes.sort()
+        arrets, derniere = [], None
+        for abscisse, nom, lat, lon in projetes:
+            if derniere is None or abscisse - derniere >= fusion_km:
+                arrets.append((nom or 'Arrêt', lat, lon))
+                derniere = abscisse
+        return arrets
+
+    def tuiles_couloir(self, points, marge_km):
+        """Tuiles (x, y) de zoom_base à moins de `marge_km` du tracé (segments parcourus par demi-tuile)."""
+        largeur = 360.0 / 2 ** self.zoom_base
+        marge_lat = marge_km / 111.0
+        tuiles = set()
+        for (lat_a, lon_a), (lat_b, lon_b) in zip(points, points[1:]):
+            cos_lat = max(math.cos(math.radians(lat_a)), 0.01)
+            pas = largeur * cos_lat / 2
+            n = max(1, int(math.ceil(max(abs(lat_b - lat_a), abs(lon_b - lon_a)) / pas)))
+            marge_lon = marge_lat / cos_lat
+            for i in range(n + 1):
+                lat, lon = lat_a + (lat_b - lat_a) * i / n, lon_a + (lon_b - lon_a) * i / n
+                x0, y0 = tuile_de(lat + marge_lat, lon - marge_lon, self.zoom_base)
+                x1, y1 = tuile_de(lat - marge_lat, lon + marge_lon, self.zoom_base)
+                tuiles.update((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        return tuiles
+
+    def _base(self, x, y):
+        arrets = self.memoire.get((x, y))
+        if arrets is not None:
+            return arrets
+        row = self._conn().execute("select polyline, noms, cree from tuiles where x = ? and y = ?", (x, y)).fetchone()
+        if row is None or self.horloge() - row[2] >= self.duree_vie:
+            x0, y0 = x - x % VOISINAGE, y - y % VOISINAGE
+            try:
+                self._charger(x0, y0, x0 + VOISINAGE - 1, y0 + VOISINAGE - 1)
+            except Exception:
+                if row is None:
+                    raise
+                print(f"⚠️ Overpass indisponible, tuile {x}/{y} périmée servie")
+            else:
+                row = self._conn().execute("select polyline, noms, cree from tuiles where x = ? and y = ?", (x, y)).fetchone()
+        arrets = [(nom, lat, lon) for nom, (lat, lon) in zip(json.loads(row[1]), decoder_polyline(row[0]))]
+        self.memoire.put((x, y), arrets)
+        return arrets
+
+    # --- CHARGEMENT ---
+    def _charger(self, x0, y0, x1, y1):
+        """Télécharge les tuiles manquantes (ou périmées) du rectangle."""
+        self._charger_tuiles([(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)])
+
+    def _charger_tuiles(self, tuiles):
+        """Télécharge les tuiles manquantes (ou périmées) de `tuiles`, par blocs alignés de BLOC_MAX x BLOC_MAX."""
+        blocs = {}
+        for x, y in set(tuiles):
+            blocs.setdefault((x // BLOC_MAX, y // BLOC_MAX), []).append((x, y))
+        for cle in sorted(blocs):
+            self._charger_bloc(blocs[cle])
+
+    def _charger_bloc(self, tuiles):
+        # Verrous des tuiles pris dans l'ordre : deux requêtes sur les mêmes tuiles n'en téléchargent qu'une
+        verrous = [self._verrous[i] for i in sorted({(x * 7919 + y) % NB_VERROUS for x, y in tuiles})]
+        for v in verrous:
+            v.acquire()
+        try:
+            xs, ys = [t[0] for t in tuiles], [t[1] for t in tuiles]
+            limite = self.horloge() - self.duree_vie
+            fraiches = set(self._conn().execute(
+                "select x, y from tuiles where x between ? and ? and y between ? and ? and cree > ?",
+                (min(xs), max(xs), min(ys), max(ys), limite)).fetchall())
+            manquantes = [t for t in tuiles if t not in fraiches]
+            if not manquantes:
+                return
+            xs, ys = [t[0] for t in manquantes], [t[1] for t in manquantes]
+            sud, ouest, _, _ = bbox_tuile(self.zoom_base, min(xs), max(ys))
+            _, _, nord, est = bbox_tuile(self.zoom_base, max(xs), min(ys))
+            self.appels_overpass += 1
+            par_tuile = {t: [] for t in manquantes}
+            vus = set()   # un noeud à la fois bus_stop et platform ne compte qu'une fois
+            for nom, lat, lon in self.telecharger(sud, ouest, nord, est):
+                cle = tuile_de(lat, lon, self.zoom_base)
+                if cle in par_tuile and (lat, lon) not in vus:
+                    vus.add((lat, lon))
+                    par_tuile[cle].append((nom, lat, lon))
+            maintenant = self.horloge()
+            lignes = []
+            for (x, y), arrets in par_tuile.items():
+                arrets.sort(key=lambda a: (a[1], a[2]))
+                lignes.append((x, y, encoder_polyline([(a[1], a[2]) for a in arrets]),
+                               json.dumps([a[0] for a in arrets], ensure_ascii=False), maintenant))
+            with self._conn() as conn:
+                conn.executemany("insert or replace into tuiles values (?, ?, ?, ?, ?)", lignes)
+            for cle in par_tuile:
+                self.memoire.invalider(cle)
+        finally:
+            for v in reversed(verrous):
+                v.release()
+
+    def precharger(self, sud, ouest, nord, est):
+        """Charge toutes les tuiles de la zone ; retourne le nombre d'appels Overpass faits."""
+        avant = self.appels_overpass
+        x0, y0 = tuile_de(nord, ouest, self.zoom_base)
+        x1, y1 = tuile_de(sud, est, self.zoom_base)
+        self._charger(x0, y0, x1, y1)
+        return self.appels_overpass - avant
+
+    def stats(self):
+        stats = self.memoire.stats()
+        stats['appels_overpass'] = self.appels_overpass
+        stats['disque'] = self._conn().execute("select count(*) from tuiles").fetchone()[0]
+        return stats
+
+
+if __name__ == "__main__":
+    # Préchargement d'une zone, ex. la wilaya de Tizi Ouzou : python arrets.py 36.45 3.70 36.95 4.55
+    if len(sys.argv) != 5:
+        sys.exit("Usage : python arrets.py sud ouest nord est")
+    tuiles = TuilesArrets(os.getenv("STOP_TILES_PATH", "/tmp/finaltrans_arrets.db"))
+    appels = tuiles.precharger(*(float(v) for v in sys.argv[1:]))
+    print(f"✅ {appels} requête(s) Overpass, {tuiles.stats()['disque']} tuiles en cache")
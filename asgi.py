@@ -0,0 +1,213 @@
+"""
+Mode de service asynchrone (ASGI) : uvicorn asgi:application
+
+Les routes chaudes sont servies nativement en asyncio, avec un client Supabase
+asynchrone (acreate_client) sur un pool de connexions HTTP partagé par tout le
+worker ; les lectures indépendantes partent en même temps (asyncio.gather) :
+- /api/login : les profils `drivers` et `passengers` sont lus en parallèle ;
+- /api/update-position : profil du chauffeur et synchronisation de la demande ;
+- /api/trouver-bus : synchronisation de la flotte puis, en un seul appel,
+  les profils des bus qui ne sont pas en cache.
+Une fois ces lectures faites, le calcul (le même code que app.py, caches
+chauds) tourne dans le pool de threads du loop, pour qu'un itinéraire OSRM
+ou une tuile Overpass à charger ne bloque pas les autres requêtes.
+
+Toutes les autres routes (pages, SSE, inscription, sondage conditionnel GET
+de /api/trouver-bus...) passent par l'application Flask, servie par un pool de
+FLASK_THREADS threads (a2wsgi) : un flux SSE ouvert n'occupe qu'un de ces
+threads. Sans clés Supabase, tout passe par Flask.
+
+En production : gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+(ou GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker, voir gunicorn.conf.py).
+"""
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from supabase import AsyncClientOptions, acreate_client
+
+import app as A
+from depot import DepotSupabaseAsync
+from metriques import ClientInstrumente
+
+# Pool HTTP du client asynchrone : connexions gardées ouvertes vers Supabase
+POOL_CONNEXIONS = int(os.getenv("SUPABASE_POOL_SIZE", 100))
+POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", 20))
+TIMEOUT_S = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", 10))
+
+# Routes Flask : un thread du pool par requête en cours (asgiref.WsgiToAsgi les passerait toutes
+# par un seul thread, et un flux SSE ouvert bloquerait tout le reste)
+flask_asgi = WSGIMiddleware(A.app, workers=int(os.getenv("FLASK_THREADS", 64)))
+
+
+class ServeurAsync:
+    def __init__(self):
+        self.client = None
+        self.depot = None
+        self._http = None
+        self._verrou = None
+
+    async def demarrer(self):
+        """Crée le client asynchrone dans le loop courant (une fois par worker)."""
+        if self.client is not None or not (A.SUPABASE_URL and A.SUPABASE_KEY):
+            return self.client
+        if self._verrou is None:
+            self._verrou = asyncio.Lock()
+        async with self._verrou:
+            if self.client is None:
+                self._http = httpx.AsyncClient(
+                    timeout=TIMEOUT_S,
+                    limits=httpx.Limits(max_connections=POOL_CONNEXIONS, max_keepalive_connections=POOL_KEEPALIVE))
+                client = await acreate_client(A.SUPABASE_URL, A.SUPABASE_KEY,
+                                              options=AsyncClientOptions(httpx_client=self._http))
+                self.client = ClientInstrumente(client, A.metriques)
+                # Même cache de profils que les routes Flask
+                self.depot = DepotSupabaseAsync(self.client, cache=A.cache_chauffeurs)
+        return self.client
+
+    async def arreter(self):
+        if self._http is not None:
+            await self._http.aclose()
+        self.client = self.depot = self._http = None
+
+    # --- SYNCHRONISATIONS (mêmes règles que FlotteMemoire / IndexDemande.synchroniser) ---
+    async def synchroniser_flotte(self):
+        depuis = A.flotte.debut_synchro()
+        if depuis is None:
+            return
+        try:
+            rows = await self.depot.trajets_actifs(depuis)
+        except Exception as e:
+            print(f"⚠️ Sync flotte: {e}")
+            return
+        A.flotte.fusionner(rows)
+
+    async def synchroniser_demande(self):
+        curseur = A.demande.debut_synchro()
+        if curseur is None:
+            return
+        try:
+            rows = (await self.client.table('passenger_requests').select('*')
+                    .gt(A.demande.colonne_sync, curseur).order(A.demande.colonne_sync).execute()).data
+        except Exception as e:
+            A.demande.echec_synchro(e)
+            return
+        A.demande.fusionner(rows)
+        limite = A.demande.debut_purge()
+        if limite is not None:
+            try:
+                await self.client.table('passenger_requests').delete().lt('updated_at', limite).execute()
+            except Exception as e:
+                print(f"⚠️ Purge demande: {e}")
+
+    # --- ROUTES ---
+    async def login(self, data):
+        try:
+            auth = await self.client.auth.sign_in_with_password(
+                {"email": data.get('email'), "password": data.get('password')})
+            uid = auth.user.id
+            driver, passenger = await asyncio.gather(
+                self.client.table('drivers').select('*').eq('id', uid).execute(),
+                self.client.table('passengers').select('*').eq('id', uid).execute())
+        except Exception:
+            return {"error": "Email ou mot de passe incorrect"}, 401
+        if driver.data:
+            self.depot.rafraichir_chauffeur(uid, driver.data[0])
+            return {"status": "success", "role": "chauffeur", "user": driver.data[0],
+                    "access_token": auth.session.access_token if auth.session else None}, 200
+        if passenger.data:
+            return {"status": "success", "role": "voyageur", "user": passenger.data[0]}, 200
+        return {"error": "Rôle inconnu"}, 400
+
+    async def update_position(self, data):
+        try:
+            driver, _ = await asyncio.gather(self.depot.chauffeur(data.get('id')), self.synchroniser_demande())
+            if not driver:
+                return {"error": "Chauffeur inconnu"}, 404
+            return await asyncio.get_running_loop().run_in_executor(None, A.traiter_position, data, driver), 200
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    async def trouver_bus(self, data):
+        recherche = A.lire_recherche(data)
+        A.enregistrer_demande(recherche)
+        try:
+            await self.synchroniser_flotte()
+            # Profils des bus en ligne absents du cache : un seul aller-retour
+            await self.depot.chauffeurs([t['chauffeur_id'] for t in A.flotte.trajets_actifs()])
+            bus = await asyncio.get_running_loop().run_in_executor(None, A.rechercher_bus, recherche)
+            return (A.compacter(bus) if data.get('format') == 'compact' else {"bus_proches": bus}), 200
+        except Exception as e:
+            print(f"🔴 ERREUR: {e}")
+            return {"bus_proches": []}, 200
+
+
+serveur = ServeurAsync()
+
+ROUTES = {
+    '/api/login': serveur.login,
+    '/api/update-position': serveur.update_position,
+    '/api/trouver-bus': serveur.trouver_bus,
+}
+
+
+async def _lire_corps(receive):
+    morceaux = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        morceaux.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(morceaux)
+
+
+async def _repondre(send, corps, statut):
+    donnees = json.dumps(corps).encode()
+    await send({'type': 'http.response.start', 'status': statut, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(donnees)).encode()),
+        (b'access-control-allow-origin', b'*'),
+    ]})
+    await send({'type': 'http.response.body', 'body': donnees})
+
+
+async def _cycle_de_vie(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await serveur.demarrer()
+            except Exception as e:
+                print(f"⚠️ Client Supabase asynchrone: {e}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await serveur.arreter()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _cycle_de_vie(receive, send)
+    route = ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope.get('method') == 'POST' else None
+    # Le pré-vol CORS (OPTIONS) et tout le reste : application Flask
+    if route is None or await serveur.demarrer() is None:
+        return await flask_asgi(scope, receive, send)
+    debut = time.perf_counter()
+    corps = await _lire_corps(receive)
+    if corps is None:
+        return
+    try:
+        data = json.loads(corps or b'null')
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        reponse, statut = await route(data)
+    else:
+        reponse, statut = {"error": "Corps JSON attendu"}, 400
+    await _repondre(send, reponse, statut)
+    A.metriques.observer_requete(scope['path'], 'POST', statut, time.perf_counter() - debut)
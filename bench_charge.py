@@ -0,0 +1,279 @@
+"""
+Banc de charge : des centaines de chauffeurs et des milliers de voyageurs contre app.py, en local.
+
+L'application tourne dans ce processus (client de test Flask), branchée sur un
+Supabase en mémoire (supabase_local.SupabaseLocal, `--latence-ms` par appel)
+et sur des tracés synthétiques (aucun appel OSRM ni Overpass).
+- chaque chauffeur rejoue le tracé de sa ligne (simulateur.ParcoursBus) et
+  envoie un ping /api/update-position toutes les `--intervalle-ping` secondes ;
+- chaque voyageur, posé près d'une ligne, interroge /api/trouver-bus toutes
+  les `--intervalle-sondage` secondes.
+Les requêtes partent à heure fixe (charge ouverte) depuis `--threads` threads :
+si le serveur ne suit pas, le retard apparaît dans `retard_p95_ms`.
+
+Pour chaque endpoint : débit, latences p50/p95/p99, erreurs et appels Supabase
+par requête (par table et opération) ; les écritures par lots des threads de
+fond sont comptées à part. `--sortie` écrit le rapport JSON, `--comparer`
+le compare à un rapport de référence et sort en erreur en cas de régression.
+
+Usage : python bench_charge.py [--chauffeurs 200] [--voyageurs 2000] [--duree 30]
+          [--sortie bench.json] [--comparer reference.json --tolerance 0.25]
+"""
+import argparse
+import atexit
+import heapq
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Caches de l'application dans un dossier temporaire (avant l'import d'app.py)
+_DOSSIER = tempfile.mkdtemp(prefix='bench_finaltrans_')
+atexit.register(shutil.rmtree, _DOSSIER, True)
+for _var, _fichier in (("ROUTE_CACHE_PATH", "routes.db"), ("STOP_TILES_PATH", "arrets.db"),
+                       ("FLEET_SQLITE_PATH", "flotte.db"), ("HISTORY_PATH", "historique")):
+    os.environ.setdefault(_var, os.path.join(_DOSSIER, _fichier))
+os.environ.setdefault("NEWS_FEEDS", "file:///dev/null")
+
+from simulateur import ParcoursBus, trace_synthetique  # noqa: E402
+from supabase_local import ARRIERE_PLAN, SupabaseLocal  # noqa: E402
+
+# Lignes du banc (noms du répertoire lieux_dz)
+LIGNES = [
+    ("tizi ouzou", "azazga"), ("tizi ouzou", "draa ben khedda"), ("tizi ouzou", "boghni"),
+    ("tizi ouzou", "tigzirt"), ("tizi ouzou", "larbaa nath irathen"), ("azazga", "yakouren"),
+    ("tizi ouzou", "maatkas"), ("tizi ouzou", "ouadhia"), ("draa ben khedda", "tadmait"),
+    ("tizi ouzou", "makouda"),
+]
+PING = '/api/update-position'
+SONDAGE = '/api/trouver-bus'
+CHARGE = ('chauffeurs', 'voyageurs', 'intervalle_ping', 'intervalle_sondage', 'threads', 'latence_ms')
+
+
+def preparer(A, nb_chauffeurs, latence_s, rnd):
+    """Branche app.py sur le stand-in ; retourne (stand-in, lignes [(dep, arr, points)], chauffeurs)."""
+    from arrets import TuilesArrets
+    from depot import DepotSupabase
+    from itineraires import CacheRoutes
+    from metriques import ClientInstrumente
+
+    sb = SupabaseLocal(latence_s=latence_s)
+    # Même enveloppe qu'en production : le coût des métriques est compris dans les mesures
+    client = ClientInstrumente(sb, A.metriques)
+    A.supabase = client
+    A.depot = DepotSupabase(client, cache=A.cache_chauffeurs)
+    A.ecrivain_trajets.client = client
+    A.ecrivain_demandes.client = client
+    A.routes = CacheRoutes(os.environ["ROUTE_CACHE_PATH"], calculer=trace_synthetique)
+    A.tuiles_arrets = TuilesArrets(os.environ["STOP_TILES_PATH"], telecharger=lambda *zone: [])
+
+    lignes = []
+    for dep, arr in LIGNES:
+        a, b = A.lieux.resoudre(dep), A.lieux.resoudre(arr)
+        if a and b:
+            lignes.append((dep, arr, trace_synthetique(a['lat'], a['lon'], b['lat'], b['lon'])))
+    chauffeurs = []
+    for i in range(nb_chauffeurs):
+        dep, arr, points = lignes[i % len(lignes)]
+        ident = f"bench-{i}"
+        sb.tables.setdefault('drivers', []).append({
+            'id': ident, 'nom_complet': f"Chauffeur {i}", 'modele_vehicule': 'Sprinter',
+            'matricule_vehicule': f"{10000 + i}-115-15", 'ville_depart': dep, 'ville_arrivee': arr,
+            'dep_lat': points[0][0], 'dep_lon': points[0][1], 'arr_lat': points[-1][0], 'arr_lon': points[-1][1],
+            'ticket_actif': True, 'tarifs': [{'dest': arr, 'prix': 50, 'type': 'normal'}],
+        })
+        # Bus répartis sur l'aller-retour, en évitant les terminus (arrivée = fin de service)
+        longueur = ParcoursBus(points).longueur_km
+        chauffeurs.append((ident, ParcoursBus(points, rnd.uniform(30, 50), rnd.uniform(0.05, 0.9) * longueur)))
+    return sb, lignes, chauffeurs
+
+
+def _voyageur(i, lignes, rnd):
+    dep, arr, points = lignes[i % len(lignes)]
+    lat, lon = points[rnd.randrange(len(points))]
+    return {'user_lat': lat + rnd.gauss(0, 0.002), 'user_lon': lon + rnd.gauss(0, 0.002),
+            'depart_text': dep, 'arrivee_text': arr if rnd.random() < 0.8 else '',
+            'visible': rnd.random() < 0.5, 'passenger_id': f"bench-p{i}"}
+
+
+class _Mesures:
+    def __init__(self):
+        self.latences = {PING: [], SONDAGE: []}
+        self.retards = {PING: [], SONDAGE: []}
+        self.erreurs = {PING: 0, SONDAGE: 0}
+        self.verrou = threading.Lock()
+
+
+def _travailleur(A, sb, acteurs, debut, fin, debut_mesure, mesures):
+    client = A.app.test_client()
+    file = [(debut + decalage, k) for k, (_, _, decalage, _) in enumerate(acteurs)]
+    heapq.heapify(file)
+    latences = {PING: [], SONDAGE: []}
+    retards = {PING: [], SONDAGE: []}
+    erreurs = {PING: 0, SONDAGE: 0}
+    while file:
+        echeance, k = heapq.heappop(file)
+        if echeance >= fin:
+            break
+        attente = echeance - time.time()
+        if attente > 0:
+            time.sleep(attente)
+        endpoint, corps, _, intervalle = acteurs[k]
+        depart = time.time()
+        t0 = time.perf_counter()
+        with sb.etiquette(endpoint if depart >= debut_mesure else 'chauffe'):
+            reponse = client.post(endpoint, json=corps(depart - debut))
+        duree = time.perf_counter() - t0
+        if depart >= debut_mesure:
+            latences[endpoint].append(duree)
+            retards[endpoint].append(max(0.0, depart - echeance))
+            if reponse.status_code >= 400:
+                erreurs[endpoint] += 1
+        heapq.heappush(file, (echeance + intervalle, k))
+    with mesures.verrou:
+        for e in latences:
+            mesures.latences[e].extend(latences[e])
+            mesures.retards[e].extend(retards[e])
+            mesures.erreurs[e] += erreurs[e]
+
+
+def _appels(compteur):
+    return {f"{table}.{op}": n for (table, op), n in sorted(compteur.items())}
+
+
+def lancer(args):
+    import app as A
+
+    rnd = random.Random(args.graine)
+    sb, lignes, chauffeurs = preparer(A, args.chauffeurs, args.latence_ms / 1000.0, rnd)
+    acteurs = []
+    for ident, parcours in chauffeurs:
+        acteurs.append((PING, lambda t, ident=ident, p=parcours: dict(zip(('lat', 'lon'), p.position(t)), id=ident),
+                        rnd.uniform(0, args.intervalle_ping), args.intervalle_ping))
+    for i in range(args.voyageurs):
+        corps = _voyageur(i, lignes, rnd)
+        acteurs.append((SONDAGE, lambda t, corps=corps: corps,
+                        rnd.uniform(0, args.intervalle_sondage), args.intervalle_sondage))
+    rnd.shuffle(acteurs)
+
+    mesures = _Mesures()
+    debut = time.time() + 0.5
+    debut_mesure = debut + args.chauffe
+    fin = debut_mesure + args.duree
+    threads = [threading.Thread(target=_travailleur, daemon=True,
+                                args=(A, sb, acteurs[k::args.threads], debut, fin, debut_mesure, mesures))
+               for k in range(args.threads)]
+    for t in threads:
+        t.start()
+    # Appels de fond comptés sur la fenêtre de mesure seulement
+    time.sleep(max(0.0, debut_mesure - time.time()))
+    fond_avant = sb.compter(ARRIERE_PLAN)
+    for t in threads:
+        t.join()
+    fond = sb.compter(ARRIERE_PLAN) - fond_avant
+    duree = time.time() - debut_mesure
+
+    rapport = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('sortie', 'comparer', 'json')},
+        'environnement': {'python': platform.python_version(), 'machine': platform.machine(),
+                          'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'duree_s': round(duree, 2),
+        'endpoints': {},
+        'arriere_plan': {'appels': _appels(fond), 'appels_par_s': round(sum(fond.values()) / duree, 2)},
+        'flotte': len(A.flotte),
+    }
+    for endpoint, lat in mesures.latences.items():
+        n = len(lat)
+        appels = sb.compter(endpoint)
+        ms = np.array(lat) * 1000 if n else np.zeros(1)
+        rapport['endpoints'][endpoint] = {
+            'requetes': n,
+            'debit_rps': round(n / duree, 1),
+            'erreurs': mesures.erreurs[endpoint],
+            'latence_ms': {'p50': round(float(np.percentile(ms, 50)), 2),
+                           'p95': round(float(np.percentile(ms, 95)), 2),
+                           'p99': round(float(np.percentile(ms, 99)), 2),
+                           'max': round(float(ms.max()), 2),
+                           'moyenne': round(float(ms.mean()), 2)},
+            'retard_p95_ms': round(float(np.percentile(mesures.retards[endpoint] or [0], 95)) * 1000, 1),
+            'appels_backend_par_requete': round(sum(appels.values()) / max(1, n), 3),
+            'appels': _appels(appels),
+        }
+    return rapport
+
+
+def comparer(rapport, reference, tolerance):
+    """Régressions de `rapport` par rapport à `reference` (liste de messages, vide si aucune)."""
+    regressions = []
+    # Le débit dépend de la charge demandée : comparé seulement à configuration égale
+    meme_charge = all(rapport['config'].get(k) == reference.get('config', {}).get(k) for k in CHARGE)
+    for endpoint, ref in reference.get('endpoints', {}).items():
+        cur = rapport['endpoints'].get(endpoint)
+        if cur is None or not ref['requetes']:
+            continue
+        for cle in ('p95', 'p99'):
+            avant, apres = ref['latence_ms'][cle], cur['latence_ms'][cle]
+            if apres > avant * (1 + tolerance) and apres - avant > 1.0:
+                regressions.append(f"{endpoint} latence {cle} : {avant} -> {apres} ms")
+        avant, apres = ref['appels_backend_par_requete'], cur['appels_backend_par_requete']
+        if apres > avant * (1 + tolerance) + 0.01:
+            regressions.append(f"{endpoint} appels Supabase par requête : {avant} -> {apres}")
+        avant, apres = ref['debit_rps'], cur['debit_rps']
+        if meme_charge and apres < avant * (1 - tolerance):
+            regressions.append(f"{endpoint} débit : {avant} -> {apres} req/s")
+        if cur['erreurs'] > ref['erreurs']:
+            regressions.append(f"{endpoint} erreurs : {ref['erreurs']} -> {cur['erreurs']}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--chauffeurs', type=int, default=200)
+    ap.add_argument('--voyageurs', type=int, default=2000)
+    ap.add_argument('--duree', type=float, default=30.0, help="secondes mesurées")
+    ap.add_argument('--chauffe', type=float, default=5.0, help="secondes de chauffe (non mesurées)")
+    ap.add_argument('--intervalle-ping', type=float, default=2.0, help="secondes entre deux pings d'un chauffeur")
+    ap.add_argument('--intervalle-sondage', type=float, default=5.0, help="secondes entre deux recherches d'un voyageur")
+    ap.add_argument('--threads', type=int, default=32)
+    ap.add_argument('--latence-ms', type=float, default=20.0, help="aller-retour simulé vers Supabase")
+    ap.add_argument('--graine', type=int, default=1)
+    ap.add_argument('--sortie', help="fichier JSON du rapport")
+    ap.add_argument('--comparer', help="rapport JSON de référence")
+    ap.add_argument('--tolerance', type=float, default=0.25, help="dégradation tolérée (0.25 = 25 %%)")
+    ap.add_argument('--json', action='store_true', help="rapport JSON sur la sortie standard")
+    args = ap.parse_args()
+
+    rapport = lancer(args)
+    if args.comparer:
+        with open(args.comparer) as f:
+            rapport['regressions'] = comparer(rapport, json.load(f), args.tolerance)
+    if args.sortie:
+        with open(args.sortie, 'w') as f:
+            json.dump(rapport, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(rapport, indent=2, ensure_ascii=False))
+    else:
+        print(f"{args.chauffeurs} chauffeurs, {args.voyageurs} voyageurs, {rapport['duree_s']} s mesurées, "
+              f"flotte {rapport['flotte']} bus")
+        print(f"{'endpoint':>22} | {'req/s':>7} | {'p50':>7} | {'p95':>7} | {'p99':>7} | {'retard p95':>10} | "
+              f"{'appels/req':>10} | {'erreurs':>7}")
+        for endpoint, m in rapport['endpoints'].items():
+            l = m['latence_ms']
+            print(f"{endpoint:>22} | {m['debit_rps']:>7} | {l['p50']:>7} | {l['p95']:>7} | {l['p99']:>7} | "
+                  f"{m['retard_p95_ms']:>10} | {m['appels_backend_par_requete']:>10} | {m['erreurs']:>7}")
+        print(f"{'arrière-plan':>22} | {rapport['arriere_plan']['appels_par_s']} appels/s {rapport['arriere_plan']['appels']}")
+        for r in rapport.get('regressions', []):
+            print(f"⚠️ Régression : {r}")
+    if rapport.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
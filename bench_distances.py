@@ -0,0 +1,47 @@
+"""
+Micro-benchmark : haversine scalaire (boucle Python) contre distances.py (NumPy).
+
+Usage : python bench_distances.py [--repetitions 5]
+"""
+import argparse
+import random
+import time
+
+from distances import distances_1_n, haversine_km
+
+TAILLES = (10, 1_000, 100_000)
+
+
+def _flotte(n, graine=42):
+    rnd = random.Random(graine)
+    # Bus dispersés autour de Tizi Ouzou (~50 km)
+    lats = [36.71 + rnd.uniform(-0.4, 0.4) for _ in range(n)]
+    lons = [4.05 + rnd.uniform(-0.5, 0.5) for _ in range(n)]
+    return lats, lons
+
+
+def _meilleur_temps(fn, repetitions):
+    meilleur = float('inf')
+    for _ in range(repetitions):
+        t0 = time.perf_counter()
+        fn()
+        meilleur = min(meilleur, time.perf_counter() - t0)
+    return meilleur
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--repetitions', type=int, default=5)
+    args = ap.parse_args()
+
+    lat, lon = 36.7118, 4.0505
+    print(f"{'bus':>8} | {'scalaire (ms)':>14} | {'numpy (ms)':>11} | {'gain':>6}")
+    for n in TAILLES:
+        lats, lons = _flotte(n)
+        t_scal = _meilleur_temps(lambda: [haversine_km(lat, lon, a, b) for a, b in zip(lats, lons)], args.repetitions)
+        t_vect = _meilleur_temps(lambda: distances_1_n(lat, lon, lats, lons), args.repetitions)
+        print(f"{n:>8} | {t_scal * 1000:>14.3f} | {t_vect * 1000:>11.3f} | {t_scal / t_vect:>5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Cache mémoire borné (LRU + durée de vie) utilisé pour les profils chauffeurs.
+
+Chaque worker gunicorn a son propre cache : l'invalidation faite par
+/api/update-driver-profile ne touche que le worker qui a reçu la requête,
+les autres voient le nouveau profil au plus tard après `ttl` secondes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    def __init__(self, taille_max=1024, ttl=300.0, horloge=time.monotonic):
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self.horloge = horloge
+        self._donnees = OrderedDict()  # cle -> (expire_a, valeur)
+        self._verrou = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cle):
+        """Retourne la valeur en cache ou None (compte un hit ou un miss)."""
+        with self._verrou:
+            entree = self._donnees.get(cle)
+            if entree is None or entree[0] <= self.horloge():
+                if entree is not None:
+                    del self._donnees[cle]
+                self.misses += 1
+                return None
+            self._donnees.move_to_end(cle)
+            self.hits += 1
+            return entree[1]
+
+    def put(self, cle, valeur):
+        with self._verrou:
+            self._donnees[cle] = (self.horloge() + self.ttl, valeur)
+            self._donnees.move_to_end(cle)
+            while len(self._donnees) > self.taille_max:
+                self._donnees.popitem(last=False)
+
+    def invalider(self, cle):
+        with self._verrou:
+            self._donnees.pop(cle, None)
+
+    def vider(self):
+        with self._verrou:
+            self._donnees.clear()
+
+    def stats(self):
+        with self._verrou:
+            total = self.hits + self.misses
+            return {
+                'taille': len(self._donnees),
+                'taille_max': self.taille_max,
+                'hits': self.hits,
+                'misses': self.misses,
+                'ratio': round(self.hits / total, 3) if total else 0.0,
+            }
@@ -0,0 +1,236 @@
+"""
+Demande voyageurs en mémoire, indexée par destination.
+
+Chaque recherche voyageur visible dépose un point (position + destination
+normalisée). Les points sont rangés dans des seaux d'une minute : l'expiration
+consiste à vider les seaux trop vieux, sans parcourir toute la demande.
+Un chauffeur ne reçoit que les voyageurs dont la destination correspond à sa
+direction, et éventuellement à moins de `rayon_km` de lui.
+
+La table `passenger_requests` reste la source partagée entre workers. Elle a
+une ligne par voyageur (colonne unique `passenger_id`, horodatée par
+`updated_at`) : `SessionsDemande` ne la réécrit que si le voyageur a bougé, a
+changé sa recherche, ou pour un battement de cœur. `synchroniser` y relit, au
+plus toutes les `sync_s` secondes, les lignes modifiées depuis la dernière
+lecture, et supprime de temps en temps celles qui ont expiré. `updated_at` est
+posé par le worker qui écrit, et la ligne n'arrive en base qu'au flush suivant
+de son EcrivainLots : la relecture repart donc `chevauchement_s` secondes avant
+le dernier `updated_at` vu, et les lignes relues deux fois sont ignorées (même
+voyageur, même horodatage).
+
+Ces colonnes viennent de migrations/001_passenger_requests_sessions.sql. Tant
+qu'elle n'est pas appliquée, les écritures retombent sur l'ancienne insertion
+simple (EcrivainLots) et la relecture se fait par `created_at`, sans purge.
+"""
+import datetime
+import threading
+import time
+from collections import deque
+
+from distances import distances_1_n, haversine_km
+from flotte import _iso_utc, epoch_depuis_iso, erreur_de_schema
+from index_lignes import normaliser
+
+
+class IndexDemande:
+    def __init__(self, correspond, duree_vie=15 * 60, pas=60, sync_s=5.0, purge_s=60.0, chevauchement_s=10.0,
+                 horloge=time.time):
+        """`correspond(dest_voyageur, direction_bus)` décide si une demande concerne un bus."""
+        self.correspond = correspond
+        self.duree_vie = duree_vie
+        self.pas = pas
+        self.sync_s = sync_s
+        self.purge_s = purge_s
+        self.chevauchement_s = chevauchement_s
+        self.horloge = horloge
+        self._par_dest = {}     # destination -> {cle_voyageur: (lat, lon, ts)}
+        self._dest_de = {}      # cle_voyageur -> destination actuelle
+        self._seaux = deque()   # (debut_seau, {(destination, cle_voyageur)})
+        self._verrou = threading.Lock()
+        self._derniere_sync = 0.0
+        self._derniere_purge = 0.0
+        self._curseur = None    # updated_at de la dernière ligne relue
+        # Table sans passenger_id/updated_at (migrations/001 non appliquée) : relecture des
+        # insertions par created_at, voyageurs identifiés par leur position, pas de purge
+        self.colonne_sync = 'updated_at'
+        self.cle_sync = 'passenger_id'
+
+    def __len__(self):
+        with self._verrou:
+            self._purger()
+            return sum(len(v) for v in self._par_dest.values())
+
+    def ajouter(self, arrivee_text, lat, lon, cle=None, ts=None):
+        """Enregistre un voyageur. `cle` identifie le voyageur (par défaut : sa position arrondie)."""
+        dest = normaliser(arrivee_text)
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            return
+        if not dest:
+            return
+        ts = self.horloge() if ts is None else ts
+        cle = cle or (round(lat, 4), round(lon, 4))
+        debut = ts - ts % self.pas
+        with self._verrou:
+            voyageurs = self._par_dest.setdefault(dest, {})
+            # Plus ancien que l'état connu, ou même ligne relue par le recouvrement de la synchronisation
+            if cle in voyageurs and (voyageurs[cle][2] > ts or voyageurs[cle] == (lat, lon, ts)):
+                return
+            ancienne = self._dest_de.get(cle)
+            if ancienne is not None and ancienne != dest:
+                # Le voyageur a changé de destination : il ne compte plus pour l'ancienne
+                anciens = self._par_dest.get(ancienne, {})
+                if cle in anciens and anciens[cle][2] > ts:
+                    return
+                anciens.pop(cle, None)
+                if not anciens:
+                    self._par_dest.pop(ancienne, None)
+            voyageurs[cle] = (lat, lon, ts)
+            self._dest_de[cle] = dest
+            if not self._seaux or self._seaux[-1][0] < debut:
+                self._seaux.append((debut, set()))
+            # Un ts plus ancien que le dernier seau (ligne relue) est rangé dans le dernier seau
+            self._seaux[-1][1].add((dest, cle))
+
+    def voyageurs_vers(self, direction, lat=None, lon=None, rayon_km=None):
+        """Positions des voyageurs dont la destination correspond à `direction`."""
+        limite = self.horloge() - self.duree_vie
+        with self._verrou:
+            self._purger()
+            points = [p for dest, voyageurs in self._par_dest.items()
+                      if self.correspond(dest, direction) for p in voyageurs.values() if p[2] > limite]
+        if not points:
+            return []
+        if rayon_km and lat is not None and lon is not None:
+            dists = distances_1_n(lat, lon, [p[0] for p in points], [p[1] for p in points])
+            points = [p for p, d in zip(points, dists) if d <= rayon_km]
+        return [{'lat': p[0], 'lon': p[1]} for p in points]
+
+    def synchroniser(self, client, force=False):
+        """Relit les demandes modifiées depuis la dernière synchronisation (autres workers)."""
+        curseur = self.debut_synchro(force) if client is not None else None
+        if curseur is None:
+            return
+        try:
+            rows = (client.table('passenger_requests').select('*')
+                    .gt(self.colonne_sync, curseur).order(self.colonne_sync).execute().data)
+        except Exception as e:
+            self.echec_synchro(e)
+            return
+        self.fusionner(rows)
+        limite = self.debut_purge()
+        if limite is not None:
+            # Expiration côté serveur : la table ne garde que les voyageurs encore actifs
+            try:
+                client.table('passenger_requests').delete().lt('updated_at', limite).execute()
+            except Exception as e:
+                print(f"⚠️ Purge demande: {e}")
+
+    # Étapes de `synchroniser`, pour faire les lectures ailleurs (client asynchrone, voir asgi.py)
+    def debut_synchro(self, force=False):
+        """`updated_at` à partir duquel relire si une synchronisation est due (marquée faite), sinon None."""
+        maintenant = self.horloge()
+        if not force and maintenant - self._derniere_sync < self.sync_s:
+            return None
+        self._derniere_sync = maintenant
+        depuis = maintenant - self.duree_vie
+        if self._curseur:
+            # Lignes horodatées avant le curseur mais écrites après la dernière lecture (flush en retard)
+            depuis = max(depuis, (epoch_depuis_iso(self._curseur) or depuis) - self.chevauchement_s)
+        return _iso_utc(depuis)
+
+    def echec_synchro(self, e):
+        """Journalise l'échec d'une relecture ; passe en mode ancien schéma si les colonnes manquent."""
+        if erreur_de_schema(e) and self.colonne_sync != 'created_at':
+            print(f"⚠️ passenger_requests sans passenger_id/updated_at ({e}) : relecture par created_at, voir migrations/")
+            self.colonne_sync, self.cle_sync, self._curseur = 'created_at', None, None
+            self._derniere_sync = 0.0
+        else:
+            print(f"⚠️ Sync demande: {e}")
+
+    def fusionner(self, rows):
+        for row in rows or []:
+            self.ajouter(row.get('arrivee_text'), row.get('user_lat'), row.get('user_lon'),
+                         cle=row.get(self.cle_sync) if self.cle_sync else None,
+                         ts=epoch_depuis_iso(row.get(self.colonne_sync)))
+            if row.get(self.colonne_sync):
+                self._curseur = max(self._curseur or '', row[self.colonne_sync])
+
+    def debut_purge(self):
+        """Limite `updated_at` des lignes expirées à supprimer si une purge est due, sinon None."""
+        maintenant = self.horloge()
+        if self.cle_sync is None or maintenant - self._derniere_purge < self.purge_s:
+            return None
+        self._derniere_purge = maintenant
+        return datetime.datetime.utcfromtimestamp(maintenant - self.duree_vie).isoformat()
+
+    def _purger(self):
+        limite = self.horloge() - self.duree_vie
+        while self._seaux and self._seaux[0][0] + self.pas <= limite:
+            _, entrees = self._seaux.popleft()
+            for dest, cle in entrees:
+                voyageurs = self._par_dest.get(dest)
+                if not voyageurs:
+                    continue
+                p = voyageurs.get(cle)
+                # Le voyageur a pu se manifester depuis : il est alors aussi dans un seau plus récent
+                if p is not None and p[2] <= limite:
+                    del voyageurs[cle]
+                    if self._dest_de.get(cle) == dest:
+                        del self._dest_de[cle]
+                    if not voyageurs:
+                        del self._par_dest[dest]
+
+
+class SessionsDemande:
+    """
+    Écritures de `passenger_requests` limitées à une par changement utile.
+
+    index.html relance la recherche à chaque seconde (ou à chaque position) :
+    on n'écrit la ligne du voyageur (upsert sur `passenger_id`, via un
+    EcrivainLots) que s'il a bougé de plus de `distance_min_m`, si sa recherche
+    a changé, ou toutes les `battement_s` secondes pour rester "vivant" tant
+    qu'il attend. Le volume d'écriture suit le nombre de voyageurs, pas la
+    fréquence des requêtes.
+    """
+
+    def __init__(self, ecrivain, distance_min_m=50.0, battement_s=60.0, horloge=time.time):
+        self.ecrivain = ecrivain
+        self.distance_min_km = distance_min_m / 1000.0
+        self.battement_s = battement_s
+        self.horloge = horloge
+        self._dernieres = {}  # passenger_id -> (lat, lon, depart_text, arrivee_text, ts)
+        self._verrou = threading.Lock()
+        self.ecritures = 0
+        self.ignorees = 0
+
+    def signaler(self, passenger_id, lat, lon, depart_text, arrivee_text):
+        """Vrai si la demande a été (ré)écrite, faux si elle n'apportait rien de nouveau."""
+        maintenant = self.horloge()
+        with self._verrou:
+            d = self._dernieres.get(passenger_id)
+            if (d is not None and d[2] == depart_text and d[3] == arrivee_text
+                    and maintenant - d[4] < self.battement_s
+                    and haversine_km(d[0], d[1], lat, lon) < self.distance_min_km):
+                self.ignorees += 1
+                return False
+            self._dernieres[passenger_id] = (lat, lon, depart_text, arrivee_text, maintenant)
+            if len(self._dernieres) > 100000:
+                self._oublier_anciennes(maintenant)
+            self.ecritures += 1
+        self.ecrivain.upsert({
+            'passenger_id': passenger_id,
+            'user_lat': lat, 'user_lon': lon,
+            'depart_text': depart_text, 'arrivee_text': arrivee_text,
+            'updated_at': datetime.datetime.utcfromtimestamp(maintenant).isoformat()
+        })
+        return True
+
+    def stats(self):
+        return {'sessions': len(self._dernieres), 'ecritures': self.ecritures, 'ignorees': self.ignorees}
+
+    def _oublier_anciennes(self, maintenant):
+        limite = maintenant - self.battement_s
+        for pid in [p for p, d in self._dernieres.items() if d[4] < limite]:
+            del self._dernieres[pid]
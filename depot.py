@@ -0,0 +1,131 @@
+"""
+Couche d'accès aux données.
+
+Les routes de app.py passent par un "dépôt" plutôt que d'appeler Supabase
+directement : on peut ainsi regrouper les lectures (une seule requête in_()
+pour N chauffeurs) et brancher une autre source (vue jointe, stand-in local)
+sans toucher aux routes.
+"""
+import asyncio
+from abc import ABC, abstractmethod
+
+
+class DepotDonnees(ABC):
+    """Interface minimale attendue par les routes de app.py."""
+
+    def chauffeur(self, driver_id):
+        """Retourne la ligne `drivers` d'un chauffeur, ou None."""
+        found = self.chauffeurs([driver_id])
+        return found.get(driver_id)
+
+    @abstractmethod
+    def chauffeurs(self, driver_ids):
+        """Retourne {id: ligne drivers} pour tous les ids demandés (ids inconnus absents)."""
+
+    @abstractmethod
+    def trajets_actifs(self, depuis_iso):
+        """Retourne les lignes `active_trips` mises à jour après `depuis_iso`."""
+
+    def invalider_chauffeur(self, driver_id):
+        """À appeler après toute écriture sur la ligne `drivers` d'un chauffeur."""
+
+    def rafraichir_chauffeur(self, driver_id, profil):
+        """À appeler quand on connaît déjà la nouvelle ligne `drivers` (ex : inscription)."""
+
+
+class DepotSupabase(DepotDonnees):
+    """
+    Dépôt branché sur un client Supabase : un aller-retour par lecture, quel que soit N.
+    Si un `cache` (cache.CacheTTL) est fourni, seuls les profils absents du cache
+    sont demandés à Supabase.
+    """
+
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache
+
+    def chauffeurs(self, driver_ids):
+        found, ids = self._depuis_cache(driver_ids)
+        if not ids:
+            return found
+        rows = self.client.table('drivers').select('*').in_('id', ids).execute().data or []
+        return self._memoriser(rows, found)
+
+    def _depuis_cache(self, driver_ids):
+        """({id: profil} trouvés en cache, [ids à demander à Supabase])."""
+        ids = list({i for i in driver_ids if i})
+        found = {}
+        if self.cache is not None:
+            for i in ids:
+                profil = self.cache.get(i)
+                if profil is not None:
+                    found[i] = profil
+            ids = [i for i in ids if i not in found]
+        return found, ids
+
+    def _memoriser(self, rows, found):
+        for row in rows:
+            found[row['id']] = row
+            if self.cache is not None:
+                self.cache.put(row['id'], row)
+        return found
+
+    def invalider_chauffeur(self, driver_id):
+        if self.cache is not None:
+            self.cache.invalider(driver_id)
+
+    def rafraichir_chauffeur(self, driver_id, profil):
+        if self.cache is not None:
+            self.cache.put(driver_id, profil)
+
+    def trajets_actifs(self, depuis_iso):
+        return self.client.table('active_trips').select('*').gt('last_update', depuis_iso).execute().data or []
+
+
+
+class DepotSupabaseAsync(DepotSupabase):
+    """
+    Même dépôt pour un client Supabase asynchrone (acreate_client, voir asgi.py) :
+    les lectures sont des coroutines. Le cache peut être partagé avec le dépôt
+    synchrone : un profil lu par l'un sert à l'autre. Des requêtes simultanées
+    qui demandent le même profil absent du cache attendent la même lecture.
+    """
+
+    def __init__(self, client, cache=None):
+        super().__init__(client, cache)
+        self._en_cours = {}   # id -> Future de la lecture en cours
+
+    async def chauffeur(self, driver_id):
+        found = await self.chauffeurs([driver_id])
+        return found.get(driver_id)
+
+    async def chauffeurs(self, driver_ids):
+        found, ids = self._depuis_cache(driver_ids)
+        attendus = {i: self._en_cours[i] for i in ids if i in self._en_cours}
+        ids = [i for i in ids if i not in attendus]
+        if ids:
+            lecture = asyncio.get_running_loop().create_future()
+            for i in ids:
+                self._en_cours[i] = lecture
+            rows = None
+            try:
+                rows = (await self.client.table('drivers').select('*').in_('id', ids).execute()).data or []
+            finally:
+                for i in ids:
+                    self._en_cours.pop(i, None)
+                # None : lecture en échec, chaque requête en attente refait la sienne
+                lecture.set_result(None if rows is None else {row['id']: row for row in rows})
+            self._memoriser(rows, found)
+        a_relire = []
+        for i, lecture in attendus.items():
+            profils = await asyncio.shield(lecture)
+            if profils is None:
+                a_relire.append(i)
+            elif profils.get(i) is not None:
+                found[i] = profils[i]
+        if a_relire:
+            found.update(await self.chauffeurs(a_relire))
+        return found
+
+    async def trajets_actifs(self, depuis_iso):
+        return (await self.client.table('active_trips').select('*').gt('last_update', depuis_iso).execute()).data or []
@@ -0,0 +1,115 @@
+"""
+Diffusion des positions de bus aux voyageurs abonnés (Server-Sent Events).
+
+Chaque voyageur ouvre un flux avec sa recherche ; /api/update-position
+appelle `Diffuseur.publier(driver_id)` et seuls les abonnés qui affichent ce
+bus sont réveillés, avec la liste des bus qui ont bougé depuis leur dernier
+envoi. Un bus qui entre dans la recherche d'un abonné apparaît au recalcul
+périodique du flux. Les notifications s'accumulent dans un ensemble : un
+abonné lent reçoit un seul réveil pour plusieurs pings du même bus.
+
+Chaque flux ouvert occupe un thread du serveur : `max_abonnes` les plafonne
+pour en laisser aux pings et aux autres routes (`abonner` retourne alors None).
+
+Les abonnements vivent dans le worker qui sert le flux. Un worker ne voit
+donc les pings reçus par ses voisins qu'à la resynchronisation périodique
+de la flotte.
+"""
+import json
+import threading
+import uuid
+
+
+def evenement_sse(nom, donnees):
+    """Formate un évènement SSE (`event:` + `data:` JSON)."""
+    return f"event: {nom}\ndata: {json.dumps(donnees, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def calculer_delta(envoyes, nouveaux, ids):
+    """
+    Compare l'état envoyé au voyageur avec l'état courant pour les bus `ids`.
+    Met `envoyes` à jour et retourne {'maj': [...], 'retires': [...]} ou None si rien n'a changé.
+    """
+    maj, retires = [], []
+    for bus_id in ids:
+        avant, apres = envoyes.get(bus_id), nouveaux.get(bus_id)
+        if apres is None:
+            if avant is not None:
+                del envoyes[bus_id]
+                retires.append(bus_id)
+        elif apres != avant:
+            envoyes[bus_id] = apres
+            maj.append(apres)
+    if not maj and not retires:
+        return None
+    return {'maj': maj, 'retires': retires}
+
+
+class Abonnement:
+    def __init__(self, recherche):
+        self.id = uuid.uuid4().hex
+        self.recherche = recherche
+        self.envoyes = {}  # bus_id -> dernière fiche envoyée
+        self._en_attente = set()
+        self._reset = False
+        self._verrou = threading.Lock()
+        self._reveil = threading.Event()
+
+    def notifier(self, driver_id):
+        with self._verrou:
+            self._en_attente.add(driver_id)
+        self._reveil.set()
+
+    def modifier(self, recherche):
+        """Nouvelle position ou nouvelle recherche : tout sera recalculé au prochain réveil."""
+        with self._verrou:
+            self.recherche = recherche
+            self._reset = True
+        self._reveil.set()
+
+    def attendre(self, timeout):
+        """
+        Bloque jusqu'à une notification ou `timeout` secondes.
+        Retourne (ids_modifies, tout_recalculer).
+        """
+        self._reveil.wait(timeout)
+        with self._verrou:
+            self._reveil.clear()
+            ids, self._en_attente = self._en_attente, set()
+            reset, self._reset = self._reset, False
+        return ids, reset
+
+
+class Diffuseur:
+    def __init__(self, max_abonnes=None):
+        self.max_abonnes = max_abonnes
+        self.refuses = 0
+        self._abonnes = {}
+        self._verrou = threading.Lock()
+
+    def __len__(self):
+        return len(self._abonnes)
+
+    def abonner(self, recherche):
+        """Nouvel abonnement, ou None si `max_abonnes` flux sont déjà ouverts."""
+        ab = Abonnement(recherche)
+        with self._verrou:
+            if self.max_abonnes and len(self._abonnes) >= self.max_abonnes:
+                self.refuses += 1
+                return None
+            self._abonnes[ab.id] = ab
+        return ab
+
+    def desabonner(self, ab):
+        with self._verrou:
+            self._abonnes.pop(ab.id, None)
+
+    def abonnement(self, ab_id):
+        return self._abonnes.get(ab_id)
+
+    def publier(self, driver_id):
+        """Un bus a changé (position, profil, fin de service) : réveille les abonnés qui l'affichent."""
+        with self._verrou:
+            abonnes = [ab for ab in self._abonnes.values() if driver_id in ab.envoyes]
+        for ab in abonnes:
+            ab.notifier(driver_id)
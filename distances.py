@@ -0,0 +1,63 @@
+"""
+Calcul de distances (haversine) en lot avec NumPy.
+
+- haversine_km : un couple de points (scalaire, sans NumPy : plus rapide pour un seul calcul)
+- distances_1_n : un point vers N points -> vecteur de N distances
+- distances_paires : N points vers N points, élément par élément
+- matrice_distances : N points vers M points -> matrice N x M
+
+Les coordonnées manquantes ou invalides (None, texte...) donnent
+DISTANCE_INCONNUE au lieu d'une exception, comme l'ancien `haversine` d'app.py.
+"""
+import math
+
+import numpy as np
+
+RAYON_TERRE_KM = 6371.0
+DISTANCE_INCONNUE = 999999
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distance en km entre deux points (floats)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlon / 2) ** 2
+    return 2 * RAYON_TERRE_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def en_tableau(valeurs):
+    """Convertit une séquence de coordonnées en float64, NaN pour les valeurs invalides."""
+    try:
+        return np.asarray(valeurs, dtype=np.float64)
+    except (TypeError, ValueError):
+        def _f(v):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return np.nan
+        return np.fromiter((_f(v) for v in valeurs), dtype=np.float64, count=len(valeurs))
+
+
+def _haversine_np(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    d = 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return np.where(np.isnan(d), DISTANCE_INCONNUE, d)
+
+
+def distances_1_n(lat, lon, lats, lons):
+    """Vecteur des distances (km) entre (lat, lon) et chacun des points (lats[i], lons[i])."""
+    return _haversine_np(en_tableau(lat), en_tableau(lon), en_tableau(lats), en_tableau(lons))
+
+
+def distances_paires(lats1, lons1, lats2, lons2):
+    """Vecteur des distances (km) entre (lats1[i], lons1[i]) et (lats2[i], lons2[i])."""
+    return _haversine_np(en_tableau(lats1), en_tableau(lons1), en_tableau(lats2), en_tableau(lons2))
+
+
+def matrice_distances(lats1, lons1, lats2, lons2):
+    """Matrice N x M des distances (km) entre deux ensembles de points."""
+    lats1, lons1 = en_tableau(lats1)[:, None], en_tableau(lons1)[:, None]
+    lats2, lons2 = en_tableau(lats2)[None, :], en_tableau(lons2)[None, :]
+    return _haversine_np(lats1, lons1, lats2, lons2)
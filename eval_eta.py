@@ -0,0 +1,201 @@
+"""
+Évaluation hors ligne de l'ETA : rejoue des pings et compare les prédictions au réel.
+
+Les pings sont rejoués dans l'ordre chronologique. À chaque ping (un sur
+`--echantillon`), on prédit le temps que mettra le bus pour atteindre des
+points situés 2, 5 et 10 km plus loin sur sa ligne, *avant* de connaître la
+suite ; le réel est lu plus tard dans le même parcours. On compare :
+- vitesses : le modèle appris (vitesses.ModeleVitesses) ;
+- ligne_25 : distance le long de la ligne à 25 km/h ;
+- direct_25 : distance à vol d'oiseau à 25 km/h (ancien calcul d'app.py).
+
+Sans fichier, un jeu synthétique est généré (centre-ville lent, heures de pointe).
+
+Usage : python eval_eta.py [--pings pings.jsonl --ligne ligne.json] [--json]
+  pings.jsonl : une ligne {"driver_id", "lat", "lon", "ts"} par ping
+  ligne.json  : [[lat, lon], ...] tracé de la ligne, du départ vers l'arrivée
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+import numpy as np
+
+from distances import haversine_km
+from index_arrets import LigneTracee
+from vitesses import ModeleVitesses
+
+HORIZONS_KM = (2.0, 5.0, 10.0)
+VITESSE_FIXE = 25.0
+
+
+def _ligne_synthetique():
+    # ~40 km de Tizi Ouzou vers l'est, légèrement sinueux
+    return [[36.7118 + 0.03 * math.sin(i / 60) + i * 0.00002, 4.0505 + i * 0.00045] for i in range(800)]
+
+
+def _pings_synthetiques(ligne, nb_bus=10, jours=2, pas_s=10, graine=7):
+    """Allers-retours de `nb_bus` bus : 12 km/h en ville, 45 km/h hors ville, -40 % aux heures de pointe."""
+    rnd = random.Random(graine)
+    longueur = ligne.longueur_km
+
+    def vitesse(a, ts):
+        heure = ((ts + 3600) % 86400) / 3600
+        base = 12.0 if a < 6 or a > longueur - 4 else 45.0
+        pointe = 0.6 if 7 <= heure < 9 or 16 <= heure < 18.5 else 1.0
+        return base * pointe * rnd.uniform(0.85, 1.15)
+
+    pings = []
+    debut = 1_700_000_000 - 1_700_000_000 % 86400
+    for b in range(nb_bus):
+        ts = debut + rnd.uniform(5, 8) * 3600 + b * 600
+        for _ in range(jours):
+            fin_journee = ts - ts % 86400 + 20 * 3600
+            a, sens = (0.0, 1) if b % 2 == 0 else (longueur, -1)
+            while ts < fin_journee:
+                lat, lon = ligne.position(a)
+                pings.append({'driver_id': f'bus{b}', 'lat': lat + rnd.gauss(0, 0.00003),
+                              'lon': lon + rnd.gauss(0, 0.00003), 'ts': ts})
+                ts += pas_s
+                a += sens * vitesse(a, ts) * pas_s / 3600
+                if not 0 <= a <= longueur:
+                    a = min(max(a, 0.0), longueur)
+                    sens = -sens
+                    ts += rnd.uniform(300, 900)  # pause au terminus
+            ts = fin_journee - 20 * 3600 + 86400 + rnd.uniform(5, 8) * 3600
+    pings.sort(key=lambda p: p['ts'])
+    return pings
+
+
+def _parcours(pings, projections):
+    """Découpe les pings de chaque bus en parcours à sens constant : {driver: [[(ts, abscisse, index du ping)]]}."""
+    par_bus = {}
+    for i, (p, proj) in enumerate(zip(pings, projections)):
+        if proj is not None:
+            par_bus.setdefault(p['driver_id'], []).append((p['ts'], proj[0], i))
+    parcours = {}
+    for bus, obs in par_bus.items():
+        courant, sens = [obs[0]], 0
+        for o in obs[1:]:
+            d = o[1] - courant[-1][1]
+            s = (d > 0.02) - (d < -0.02)
+            if o[0] - courant[-1][0] > 600 or (s and sens and s != sens):
+                parcours.setdefault(bus, []).append(courant)
+                courant, sens = [], 0
+            elif s and not sens:
+                sens = s
+            courant.append(o)
+        parcours.setdefault(bus, []).append(courant)
+    return parcours
+
+
+def _verites(parcours):
+    """ping -> [(abscisse_cible, secondes_reelles)] pour chaque horizon atteint plus loin dans le parcours."""
+    cibles = {}
+    for liste in parcours.values():
+        for p in liste:
+            if len(p) < 2:
+                continue
+            ts = np.array([o[0] for o in p])
+            ab = np.array([o[1] for o in p])
+            sens = 1.0 if ab[-1] >= ab[0] else -1.0
+            # Abscisse rendue monotone (le bruit GPS peut la faire reculer de quelques mètres)
+            mono = np.maximum.accumulate(ab * sens)
+            for k, (t0, a0, idx) in enumerate(p):
+                res = []
+                for h in HORIZONS_KM:
+                    cible = a0 * sens + h
+                    if cible > mono[-1]:
+                        break
+                    t = float(np.interp(cible, mono[k:], ts[k:]))
+                    res.append((cible * sens, t - t0))
+                if res:
+                    cibles[idx] = res
+    return cibles
+
+
+def evaluer(pings, ligne, echantillon=5):
+    modele = ModeleVitesses()
+    projections = [ligne.projeter(p['lat'], p['lon']) for p in pings]
+    cibles = _verites(_parcours(pings, projections))
+    erreurs = {'vitesses': [], 'ligne_25': [], 'direct_25': []}
+    reels = []
+    cout_requetes, nb_requetes = 0.0, 0
+    for i, (p, proj) in enumerate(zip(pings, projections)):
+        if proj is None:
+            continue
+        if i in cibles and i % echantillon == 0:
+            for cible, reel in cibles[i]:
+                t0 = time.perf_counter()
+                predit = modele.duree_s('ligne', proj[0], cible, p['ts'])
+                cout_requetes += time.perf_counter() - t0
+                nb_requetes += 1
+                lat_c, lon_c = ligne.position(cible)
+                direct = haversine_km(p['lat'], p['lon'], lat_c, lon_c)
+                erreurs['vitesses'].append(predit - reel)
+                erreurs['ligne_25'].append(abs(cible - proj[0]) / VITESSE_FIXE * 3600 - reel)
+                erreurs['direct_25'].append(direct / VITESSE_FIXE * 3600 - reel)
+                reels.append(reel)
+        modele.observer('ligne', ligne.longueur_km, p['driver_id'], proj[0], p['ts'])
+
+    reels = np.array(reels)
+    rapport = {'pings': len(pings), 'predictions': len(reels), 'methodes': {}}
+    for nom, e in erreurs.items():
+        e = np.array(e)
+        rapport['methodes'][nom] = {
+            'mae_min': round(float(np.mean(np.abs(e))) / 60, 2),
+            'p90_min': round(float(np.percentile(np.abs(e), 90)) / 60, 2),
+            'biais_min': round(float(np.mean(e)) / 60, 2),
+            'mape_pct': round(float(np.mean(np.abs(e) / np.maximum(reels, 60))) * 100, 1),
+        }
+    rapport['cout_requete_us'] = round(cout_requetes / max(1, nb_requetes) * 1e6, 2)
+    rapport['modele'] = modele.stats()
+    return rapport
+
+
+class _LigneEval(LigneTracee):
+    """LigneTracee qui sait aussi retrouver un point à partir de son abscisse."""
+
+    def __init__(self, points):
+        super().__init__(points)
+        self._pts = np.asarray(points, dtype=np.float64)
+
+    def position(self, abscisse):
+        return (float(np.interp(abscisse, self.cumul, self._pts[:, 0])),
+                float(np.interp(abscisse, self.cumul, self._pts[:, 1])))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--pings', help="fichier JSONL de pings (sinon jeu synthétique)")
+    ap.add_argument('--ligne', help="tracé JSON [[lat, lon], ...] de la ligne")
+    ap.add_argument('--echantillon', type=int, default=5, help="une prédiction tous les N pings")
+    ap.add_argument('--json', action='store_true', help="rapport JSON sur la sortie standard")
+    args = ap.parse_args()
+
+    if args.pings:
+        if not args.ligne:
+            ap.error("--ligne est obligatoire avec --pings")
+        with open(args.ligne) as f:
+            ligne = _LigneEval(json.load(f))
+        with open(args.pings) as f:
+            pings = sorted((json.loads(l) for l in f if l.strip()), key=lambda p: p['ts'])
+    else:
+        ligne = _LigneEval(_ligne_synthetique())
+        pings = _pings_synthetiques(ligne)
+
+    rapport = evaluer(pings, ligne, args.echantillon)
+    if args.json:
+        print(json.dumps(rapport, indent=2))
+        return
+    print(f"{rapport['pings']} pings, {rapport['predictions']} prédictions (horizons {HORIZONS_KM} km)")
+    print(f"{'méthode':>10} | {'MAE (min)':>9} | {'p90 (min)':>9} | {'biais (min)':>11} | {'MAPE':>6}")
+    for nom, m in rapport['methodes'].items():
+        print(f"{nom:>10} | {m['mae_min']:>9} | {m['p90_min']:>9} | {m['biais_min']:>11} | {m['mape_pct']:>5}%")
+    print(f"coût d'une requête ETA : {rapport['cout_requete_us']} µs")
+
+
+if __name__ == '__main__':
+    main()
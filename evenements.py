@@ -0,0 +1,229 @@
+"""
+Signalements routiers (bouchon, accident, travaux...) en mémoire, par grille.
+
+Les signalements proches (moins de `rayon_fusion_m`) d'un même type sont
+regroupés en un seul événement, qui compte ses confirmations et dont la
+position est la moyenne des signalements. Un événement expire `duree_vie`
+secondes après sa dernière confirmation (tas d'expiration, sans parcours).
+
+Chaque changement (création, confirmation, expiration) reçoit un numéro de
+révision croissant. Un client renvoie le dernier curseur reçu (`since`) et ne
+reçoit que les événements modifiés depuis, plus les identifiants retirés ; sans
+curseur (ou avec celui d'un autre worker), il reçoit tous les événements de sa
+fenêtre (`bbox`).
+
+`road_events` reste la source partagée entre workers : `synchroniser` y relit
+les lignes créées depuis la dernière lecture, en repartant `chevauchement_s`
+secondes avant le dernier `created_at` vu (une insertion validée après une
+ligne plus récente n'est pas perdue). Chaque ligne n'est comptée qu'une fois,
+qu'elle vienne de ce worker ou d'un autre, ou qu'elle soit relue.
+"""
+import heapq
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from distances import haversine_km
+from flotte import _iso_utc, epoch_depuis_iso
+
+
+class GrilleEvenements:
+    def __init__(self, duree_vie=2 * 3600, pas_deg=0.01, rayon_fusion_m=150.0, sync_s=30.0,
+                 retraits_max=10000, chevauchement_s=10.0, horloge=time.time):
+        self.duree_vie = duree_vie
+        self.pas = pas_deg
+        self.rayon_fusion_km = rayon_fusion_m / 1000.0
+        self.sync_s = sync_s
+        self.chevauchement_s = chevauchement_s
+        self.horloge = horloge
+        self._evenements = OrderedDict()   # id -> événement, du moins au plus récemment modifié
+        self._cellules = {}                # (i, j) -> {id}
+        self._expirations = []             # tas (expire_a, id)
+        self._retraits = deque(maxlen=retraits_max)  # (revision, id)
+        self._rev_oubliee = 0              # révisions plus anciennes : retraits oubliés -> liste complète
+        self._lignes_vues = {}             # id de ligne road_events -> expire_a
+        self._revision = 0
+        self._instance = os.urandom(4).hex()  # les révisions ne valent que pour ce worker
+        self._suivant = 0
+        self._verrou = threading.Lock()
+        self._derniere_sync = 0.0
+        self._curseur = None               # created_at de la dernière ligne relue
+
+    def __len__(self):
+        with self._verrou:
+            self._purger()
+            return len(self._evenements)
+
+    def revision(self):
+        return self._revision
+
+    def _cle(self, lat, lon):
+        return (int(math.floor(lat / self.pas)), int(math.floor(lon / self.pas)))
+
+    def signaler(self, type_, lat, lon, ts=None, ligne_id=None):
+        """Ajoute un signalement ; retourne l'événement (nouveau ou confirmé), None si déjà compté ou périmé."""
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            return None
+        maintenant = self.horloge()
+        ts = maintenant if ts is None else ts
+        expire_a = ts + self.duree_vie
+        if expire_a <= maintenant:
+            return None
+        with self._verrou:
+            self._purger()
+            if ligne_id is not None:
+                if ligne_id in self._lignes_vues:
+                    return None
+                self._lignes_vues[ligne_id] = expire_a
+            evt = self._voisin(type_, lat, lon)
+            if evt is None:
+                self._suivant += 1
+                evt = {'id': f"e{self._suivant}", 'type': type_, 'lat': lat, 'lon': lon,
+                       'signalements': 0, 'cree': ts, 'maj': ts}
+                self._cellules.setdefault(self._cle(lat, lon), set()).add(evt['id'])
+            else:
+                n = evt['signalements']
+                ancienne = self._cle(evt['lat'], evt['lon'])
+                evt['lat'] = (evt['lat'] * n + lat) / (n + 1)
+                evt['lon'] = (evt['lon'] * n + lon) / (n + 1)
+                nouvelle = self._cle(evt['lat'], evt['lon'])
+                if nouvelle != ancienne:
+                    self._retirer_de(ancienne, evt['id'])
+                    self._cellules.setdefault(nouvelle, set()).add(evt['id'])
+                evt['maj'] = max(evt['maj'], ts)
+            evt['signalements'] += 1
+            self._revision += 1
+            evt['rev'] = self._revision
+            self._evenements[evt['id']] = evt
+            self._evenements.move_to_end(evt['id'])
+            heapq.heappush(self._expirations, (evt['maj'] + self.duree_vie, evt['id']))
+            return self._public(evt)
+
+    def _voisin(self, type_, lat, lon):
+        i, j = self._cle(lat, lon)
+        meilleur, d_min = None, self.rayon_fusion_km
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for ident in self._cellules.get((i + di, j + dj), ()):
+                    evt = self._evenements[ident]
+                    if evt['type'] != type_:
+                        continue
+                    d = haversine_km(lat, lon, evt['lat'], evt['lon'])
+                    if d <= d_min:
+                        meilleur, d_min = evt, d
+        return meilleur
+
+    def _revision_de(self, curseur):
+        """Révision d'un curseur 'instance.revision' émis par ce worker, None sinon."""
+        instance, _, rev = str(curseur or '').partition('.')
+        if instance != self._instance or not rev.isdigit():
+            return None
+        return int(rev)
+
+    def depuis(self, curseur=None, bbox=None):
+        """
+        {'curseur', 'complet', 'evenements', 'retires'} : changements depuis `curseur`
+        (tout s'il est absent, trop ancien ou d'un autre worker) dans `bbox` = (lat_min, lon_min, lat_max, lon_max).
+        """
+        since = self._revision_de(curseur)
+        with self._verrou:
+            self._purger()
+            complet = since is None or since < self._rev_oubliee or since > self._revision
+            if complet:
+                evenements = self._dans(bbox) if bbox else list(self._evenements.values())
+                retires = []
+            else:
+                evenements = []
+                for evt in reversed(self._evenements.values()):
+                    if evt['rev'] <= since:
+                        break
+                    evenements.append(evt)
+                if bbox:
+                    evenements = [e for e in evenements if self._contient(bbox, e)]
+                # Les retraits sont dans l'ordre des révisions : on s'arrête au premier déjà vu
+                retires = []
+                for rev, ident in reversed(self._retraits):
+                    if rev <= since:
+                        break
+                    retires.append(ident)
+            return {'curseur': f"{self._instance}.{self._revision}", 'complet': complet,
+                    'evenements': [self._public(e) for e in evenements], 'retires': retires}
+
+    def _dans(self, bbox):
+        lat_min, lon_min, lat_max, lon_max = bbox
+        (i0, j0), (i1, j1) = self._cle(lat_min, lon_min), self._cle(lat_max, lon_max)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cellules):
+            # Grande fenêtre : plus rapide de filtrer les cellules occupées
+            cellules = [c for c in self._cellules if i0 <= c[0] <= i1 and j0 <= c[1] <= j1]
+        else:
+            cellules = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        res = []
+        for c in cellules:
+            for ident in self._cellules.get(c, ()):
+                evt = self._evenements[ident]
+                if self._contient(bbox, evt):
+                    res.append(evt)
+        return res
+
+    @staticmethod
+    def _contient(bbox, evt):
+        return bbox[0] <= evt['lat'] <= bbox[2] and bbox[1] <= evt['lon'] <= bbox[3]
+
+    def _public(self, evt):
+        return {'id': evt['id'], 'type': evt['type'], 'lat': round(evt['lat'], 6), 'lon': round(evt['lon'], 6),
+                'signalements': evt['signalements'], 'created_at': _iso_utc(evt['cree']),
+                'updated_at': _iso_utc(evt['maj'])}
+
+    def _retirer_de(self, cle, ident):
+        cellule = self._cellules.get(cle)
+        if cellule is not None:
+            cellule.discard(ident)
+            if not cellule:
+                del self._cellules[cle]
+
+    def _purger(self):
+        maintenant = self.horloge()
+        while self._expirations and self._expirations[0][0] <= maintenant:
+            expire_a, ident = heapq.heappop(self._expirations)
+            evt = self._evenements.get(ident)
+            # Entrée périmée : l'événement a été confirmé depuis
+            if evt is None or evt['maj'] + self.duree_vie > expire_a:
+                continue
+            del self._evenements[ident]
+            self._retirer_de(self._cle(evt['lat'], evt['lon']), ident)
+            self._revision += 1
+            if len(self._retraits) == self._retraits.maxlen:
+                self._rev_oubliee = self._retraits[0][0]
+            self._retraits.append((self._revision, ident))
+        if len(self._lignes_vues) > 2 * len(self._evenements) + 1000:
+            self._lignes_vues = {k: v for k, v in self._lignes_vues.items() if v > maintenant}
+
+    def synchroniser(self, client, force=False):
+        """Relit les signalements créés depuis la dernière synchronisation (autres workers)."""
+        maintenant = self.horloge()
+        if client is None or (not force and maintenant - self._derniere_sync < self.sync_s):
+            return
+        self._derniere_sync = maintenant
+        depuis = maintenant - self.duree_vie
+        if self._curseur:
+            # Recouvrement : les lignes déjà vues sont écartées par `_lignes_vues`
+            depuis = max(depuis, (epoch_depuis_iso(self._curseur) or depuis) - self.chevauchement_s)
+        curseur = _iso_utc(depuis)
+        try:
+            rows = client.table('road_events').select('*').gt('created_at', curseur).order('created_at').execute().data
+        except Exception as e:
+            print(f"⚠️ Sync signalements: {e}")
+            return
+        for row in rows or []:
+            self.ajouter_ligne(row)
+            if row.get('created_at'):
+                self._curseur = max(self._curseur or '', row['created_at'])
+
+    def ajouter_ligne(self, row):
+        """Intègre une ligne de road_events (celle qu'on vient d'insérer ou une relue)."""
+        ts = epoch_depuis_iso(row.get('created_at')) if row.get('created_at') else None
+        return self.signaler(row.get('type'), row.get('lat'), row.get('lon'), ts=ts, ligne_id=row.get('id'))
@@ -0,0 +1,389 @@
+"""
+État en direct de la flotte (positions des bus en ligne).
+
+Les pings GPS des chauffeurs mettent à jour ce store en mémoire ; les
+recherches voyageurs le lisent sans aller-retour Supabase. La table
+`active_trips` reste alimentée, mais en différé et par lots (EcrivainLots).
+
+Deux implémentations :
+- FlotteMemoire : dictionnaire + tas d'expiration, propre à un worker. Elle se
+  resynchronise depuis Supabase au plus toutes les `sync_s` secondes pour voir
+  les bus dont les pings arrivent sur un autre worker.
+- FlotteSQLite : fichier SQLite local partagé par tous les workers gunicorn
+  d'une même machine (FLEET_BACKEND=sqlite).
+"""
+import datetime
+import heapq
+import os
+import sqlite3
+import threading
+import time
+
+from dateutil import parser as date_parser
+
+from distances import distances_1_n
+from index_spatial import GrilleSpatiale, boite_englobante, iter_par_anneaux
+
+
+def _iso_utc(ts):
+    return datetime.datetime.utcfromtimestamp(ts).isoformat()
+
+
+def _coord(trajet):
+    try:
+        return float(trajet['current_lat']), float(trajet['current_lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+# Codes PostgREST / Postgres d'un schéma en retard : colonne inconnue, pas de contrainte unique pour l'upsert
+CODES_SCHEMA = {'42703', 'PGRST204', '42P10'}
+
+
+def erreur_de_schema(e):
+    """Vrai si l'erreur Supabase vient d'une colonne ou d'une contrainte absente (migration non appliquée)."""
+    return str(getattr(e, 'code', '') or '') in CODES_SCHEMA
+
+
+def epoch_depuis_iso(valeur):
+    """Convertit un `last_update` Supabase (ISO, avec ou sans fuseau) en timestamp."""
+    try:
+        dt = date_parser.parse(valeur)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class FlotteMemoire:
+    def __init__(self, duree_vie=45.0, sync_s=5.0, horloge=time.time):
+        self.duree_vie = duree_vie
+        self.sync_s = sync_s
+        self.horloge = horloge
+        self._trajets = {}      # chauffeur_id -> ligne façon active_trips (+ '_ts', '_local')
+        self._expirations = []  # tas (expire_a, chauffeur_id) ; entrées périmées ignorées à la purge
+        self._grille = GrilleSpatiale()
+        self._verrou = threading.Lock()
+        self._derniere_sync = 0.0
+        self._revision = 0
+
+    def revision(self):
+        """Compteur incrémenté à chaque changement visible de la flotte (expirations comprises)."""
+        with self._verrou:
+            self._purger()
+            return self._revision
+
+    def mettre_a_jour(self, driver_id, lat, lon, direction, ts=None):
+        ts = self.horloge() if ts is None else ts
+        trajet = {
+            'chauffeur_id': driver_id,
+            'current_lat': lat,
+            'current_lon': lon,
+            'direction_actuelle': direction,
+            'last_update': _iso_utc(ts),
+        }
+        with self._verrou:
+            self._poser(dict(trajet), ts, local=True)
+        # Copie sans '_ts' / '_local' : c'est elle que l'EcrivainLots envoie à active_trips
+        return trajet
+
+    def retirer(self, driver_id):
+        with self._verrou:
+            self._supprimer(driver_id)
+
+    def trajet(self, driver_id):
+        with self._verrou:
+            self._purger()
+            t = self._trajets.get(driver_id)
+            return self._publique(t) if t else None
+
+    def trajets_actifs(self):
+        with self._verrou:
+            self._purger()
+            return [self._publique(t) for t in self._trajets.values()]
+
+    def __len__(self):
+        with self._verrou:
+            self._purger()
+            return len(self._trajets)
+
+    def iter_proches(self, lat, lon, rayon_max_km=None):
+        """
+        (distance_km, trajet) par distance croissante autour de (lat, lon).
+        Le verrou n'est tenu que pendant chaque requête de disque : l'appelant
+        peut consommer le générateur aussi lentement qu'il veut.
+        """
+        def disque(rayon):
+            with self._verrou:
+                self._purger()
+                return [(d, self._publique(self._trajets[i])) for d, i in self._grille.dans_rayon(lat, lon, rayon)]
+        return iter_par_anneaux(disque, self._grille.__len__, rayon_initial=1.0, rayon_max=rayon_max_km)
+
+    def synchroniser(self, depot, force=False):
+        """
+        Fusionne les trajets récents de Supabase (pings reçus par d'autres workers).
+        Au plus un appel toutes les `sync_s` secondes ; les erreurs réseau sont ignorées,
+        la flotte locale reste servie telle quelle.
+        """
+        depuis = self.debut_synchro(force) if depot is not None else None
+        if depuis is None:
+            return
+        try:
+            rows = depot.trajets_actifs(depuis)
+        except Exception as e:
+            print(f"⚠️ Sync flotte: {e}")
+            return
+        self.fusionner(rows)
+
+    def debut_synchro(self, force=False):
+        """
+        Date ISO à partir de laquelle relire `active_trips` si une synchronisation
+        est due (et la marque comme faite), sinon None. Avec `fusionner`, permet
+        de faire la lecture ailleurs (client asynchrone, voir asgi.py).
+        """
+        maintenant = self.horloge()
+        if not force and maintenant - self._derniere_sync < self.sync_s:
+            return None
+        self._derniere_sync = maintenant
+        return _iso_utc(maintenant - self.duree_vie)
+
+    def fusionner(self, rows):
+        """Intègre les lignes `active_trips` relues par une synchronisation."""
+        with self._verrou:
+            distants = set()
+            for row in rows:
+                ts = epoch_depuis_iso(row.get('last_update'))
+                driver_id = row.get('chauffeur_id')
+                if ts is None or not driver_id:
+                    continue
+                distants.add(driver_id)
+                actuel = self._trajets.get(driver_id)
+                if actuel is None or actuel['_ts'] < ts:
+                    self._poser(dict(row), ts, local=False)
+            # Un bus connu seulement par la sync et absent de Supabase a été arrêté ailleurs
+            for driver_id in [i for i, t in self._trajets.items() if not t['_local'] and i not in distants]:
+                self._supprimer(driver_id)
+
+    # --- interne (verrou déjà pris) ---
+    def _poser(self, trajet, ts, local):
+        trajet['_ts'] = ts
+        trajet['_local'] = local
+        self._trajets[trajet['chauffeur_id']] = trajet
+        coord = _coord(trajet)
+        if coord:
+            self._grille.placer(trajet['chauffeur_id'], *coord)
+        else:
+            self._grille.retirer(trajet['chauffeur_id'])
+        heapq.heappush(self._expirations, (ts + self.duree_vie, trajet['chauffeur_id']))
+        self._revision += 1
+
+    def _supprimer(self, driver_id):
+        if self._trajets.pop(driver_id, None) is not None:
+            self._grille.retirer(driver_id)
+            self._revision += 1
+
+    def _purger(self):
+        maintenant = self.horloge()
+        while self._expirations and self._expirations[0][0] <= maintenant:
+            expire_a, driver_id = heapq.heappop(self._expirations)
+            t = self._trajets.get(driver_id)
+            # Le bus a pu pinger depuis : seule l'entrée la plus récente fait foi
+            if t is not None and t['_ts'] + self.duree_vie <= maintenant:
+                self._supprimer(driver_id)
+
+    @staticmethod
+    def _publique(t):
+        return {k: v for k, v in t.items() if not k.startswith('_')}
+
+
+class FlotteSQLite:
+    """
+    Même interface que FlotteMemoire, stockée dans un fichier SQLite (mode WAL)
+    pour être partagée par les workers d'une même machine. L'index sur
+    `expire_a` joue le rôle du tas d'expiration.
+    """
+
+    def __init__(self, chemin, duree_vie=45.0, horloge=time.time):
+        self.chemin = chemin
+        self.duree_vie = duree_vie
+        self.horloge = horloge
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""create table if not exists trajets (
+                chauffeur_id text primary key, current_lat real, current_lon real,
+                direction_actuelle text, ts real, expire_a real)""")
+            conn.execute("create index if not exists trajets_expire on trajets(expire_a)")
+            conn.execute("create index if not exists trajets_position on trajets(current_lat, current_lon)")
+            conn.execute("create table if not exists meta (cle text primary key, valeur integer)")
+            conn.execute("insert or ignore into meta values ('revision', 0)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.chemin, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _incrementer(self, conn):
+        conn.execute("update meta set valeur = valeur + 1 where cle = 'revision'")
+
+    def revision(self):
+        conn = self._conn()
+        self._expirer(conn)
+        return conn.execute("select valeur from meta where cle = 'revision'").fetchone()[0]
+
+    def _expirer(self, conn):
+        with conn:
+            conn.execute("begin immediate")
+            if conn.execute("delete from trajets where expire_a <= ?", (self.horloge(),)).rowcount:
+                self._incrementer(conn)
+
+    def mettre_a_jour(self, driver_id, lat, lon, direction, ts=None):
+        ts = self.horloge() if ts is None else ts
+        conn = self._conn()
+        with conn:
+            conn.execute("begin immediate")
+            conn.execute("insert or replace into trajets values (?, ?, ?, ?, ?, ?)",
+                         (driver_id, lat, lon, direction, ts, ts + self.duree_vie))
+            self._incrementer(conn)
+        return {
+            'chauffeur_id': driver_id, 'current_lat': lat, 'current_lon': lon,
+            'direction_actuelle': direction, 'last_update': _iso_utc(ts),
+        }
+
+    def retirer(self, driver_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("begin immediate")
+            if conn.execute("delete from trajets where chauffeur_id = ?", (driver_id,)).rowcount:
+                self._incrementer(conn)
+
+    def _lignes(self, where="", params=()):
+        conn = self._conn()
+        self._expirer(conn)
+        rows = conn.execute("select chauffeur_id, current_lat, current_lon, direction_actuelle, ts from trajets " + where, params).fetchall()
+        return [{
+            'chauffeur_id': r[0], 'current_lat': r[1], 'current_lon': r[2],
+            'direction_actuelle': r[3], 'last_update': _iso_utc(r[4]),
+        } for r in rows]
+
+    def trajet(self, driver_id):
+        rows = self._lignes("where chauffeur_id = ?", (driver_id,))
+        return rows[0] if rows else None
+
+    def trajets_actifs(self):
+        return self._lignes()
+
+    def __len__(self):
+        return len(self._lignes())
+
+    def iter_proches(self, lat, lon, rayon_max_km=None):
+        def disque(rayon):
+            lat_min, lat_max, lon_min, lon_max = boite_englobante(lat, lon, rayon)
+            rows = self._lignes("where current_lat between ? and ? and current_lon between ? and ?",
+                                (lat_min, lat_max, lon_min, lon_max))
+            if not rows:
+                return []
+            dists = distances_1_n(lat, lon, [t['current_lat'] for t in rows], [t['current_lon'] for t in rows])
+            return [(float(d), t) for d, t in zip(dists, rows) if d <= rayon]
+
+        def taille():
+            return self._conn().execute("select count(*) from trajets").fetchone()[0]
+        return iter_par_anneaux(disque, taille, rayon_initial=1.0, rayon_max=rayon_max_km)
+
+    def synchroniser(self, depot, force=False):
+        # Le fichier est déjà partagé entre workers : rien à fusionner
+        return
+
+    def debut_synchro(self, force=False):
+        return None
+
+    def fusionner(self, rows):
+        return
+
+
+class EcrivainLots:
+    """
+    Recopie la flotte vers `active_trips` en tâche de fond, par lots.
+    Plusieurs pings d'un même chauffeur entre deux flushs ne donnent qu'une écriture.
+    `cle` est la colonne unique des lignes (la cible de l'upsert).
+    Si la table n'a pas (encore) cette contrainte et que `colonnes_repli` est
+    donné, l'écrivain passe en insertion simple de ces colonnes seulement.
+    """
+
+    def __init__(self, client, intervalle=2.0, table='active_trips', cle='chauffeur_id', colonnes_repli=None):
+        self.client = client
+        self.intervalle = intervalle
+        self.table = table
+        self.cle = cle
+        self.colonnes_repli = colonnes_repli
+        self.insertion = False
+        self._upserts = {}
+        self._suppressions = set()
+        self._verrou = threading.Lock()
+        self._reveil = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def upsert(self, trajet):
+        with self._verrou:
+            self._suppressions.discard(trajet[self.cle])
+            self._upserts[trajet[self.cle]] = trajet
+        self._demarrer()
+
+    def supprimer(self, ident):
+        with self._verrou:
+            self._upserts.pop(ident, None)
+            self._suppressions.add(ident)
+        self._demarrer()
+
+    def flush(self):
+        with self._verrou:
+            upserts, self._upserts = list(self._upserts.values()), {}
+            suppressions, self._suppressions = list(self._suppressions), set()
+        if self.client is None:
+            return
+        try:
+            if upserts and not self.insertion:
+                try:
+                    self.client.table(self.table).upsert(upserts, on_conflict=self.cle).execute()
+                except Exception as e:
+                    if not (self.colonnes_repli and erreur_de_schema(e)):
+                        raise
+                    print(f"⚠️ {self.table} sans contrainte unique sur {self.cle} ({e}) : insertion simple, voir migrations/")
+                    self.insertion = True
+            if upserts and self.insertion:
+                self.client.table(self.table).insert(
+                    [{k: t.get(k) for k in self.colonnes_repli} for t in upserts]).execute()
+            if suppressions and not self.insertion:
+                self.client.table(self.table).delete().in_(self.cle, suppressions).execute()
+        except Exception as e:
+            print(f"⚠️ Ecriture {self.table}: {e}")
+            # On remet le lot en attente sans écraser des données plus récentes
+            with self._verrou:
+                for t in upserts:
+                    if t[self.cle] not in self._suppressions:
+                        self._upserts.setdefault(t[self.cle], t)
+                for i in suppressions:
+                    if i not in self._upserts:
+                        self._suppressions.add(i)
+
+    def _demarrer(self):
+        # Thread lancé à la demande (et relancé après un fork gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._verrou:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._boucle, name=f'ecrivain-{self.table}', daemon=True)
+            self._thread.start()
+
+    def _boucle(self):
+        while True:
+            self._reveil.wait(self.intervalle)
+            self._reveil.clear()
+            self.flush()
@@ -0,0 +1,15 @@
+# Configuration gunicorn (chargée automatiquement quand on lance `gunicorn app:app` depuis ce dossier)
+import os
+
+# Les flux SSE (/api/flux-bus) gardent une connexion ouverte par voyageur :
+# il faut des workers à threads, sinon un seul flux bloquerait tout le worker.
+# Ils sont plafonnés à STREAM_MAX_CLIENTS (48 par défaut) par worker : garder
+# GUNICORN_THREADS au-dessus pour que les pings des chauffeurs trouvent un thread.
+# Pour beaucoup de voyageurs, préférer le mode asynchrone ci-dessous (les pings
+# n'y passent pas par les threads Flask) et monter FLASK_THREADS avec STREAM_MAX_CLIENTS.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+# Mode asynchrone : GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn asgi:application
+# (threads est alors ignoré : un worker garde des centaines de requêtes en cours, voir asgi.py)
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+threads = int(os.getenv("GUNICORN_THREADS", 64))
+timeout = 120
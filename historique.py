@@ -0,0 +1,336 @@
+"""
+Historique des trajets : les pings GPS retenus, gardés en fichiers locaux.
+
+`active_trips` ne garde que la dernière position et STOP l'efface ; ici chaque
+ping retenu par l'ingestion est ajouté à l'historique du chauffeur :
+- Filtre à l'estime (dead reckoning) à l'écriture : un point que la vitesse
+  des deux derniers points gardés prédit à moins de `tolerance_m` près n'est
+  pas gardé. Un bus qui roule droit ou qui attend à l'arrêt ne coûte presque
+  rien ; le dernier point prédit est gardé quand la trajectoire change, la
+  durée d'un arrêt reste donc visible.
+- Les points gardés sont écrits par blocs en colonnes : horodatages (ms) et
+  positions (microdegrés) en entiers int32 codés en delta, compressés (zlib).
+  Quelques octets par point, contre une ligne Supabase par ping.
+- Les blocs sont ajoutés à la fin de fichiers segments d'un jour (UTC),
+  `AAAAMMJJ.seg` dans `dossier` ; chaque worker y écrit ses blocs (écriture
+  en une fois, sous verrou de fichier) et les segments plus vieux que
+  `retention_jours` sont supprimés.
+- `points(chauffeur, debut, fin)` relit un intervalle (blocs des segments +
+  points pas encore écrits par ce worker), `position_a` rejoue une position.
+
+Un bloc est écrit quand il atteint `taille_bloc` points, à la fin du service
+(`clore`), ou par le thread de fond au plus tard `flush_s` secondes après son
+premier point.
+"""
+import datetime
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:   # Windows : pas de verrou de fichier, l'ajout en une écriture reste la règle
+    fcntl = None
+
+MAGIE = b'FTH1'
+# magie, taille de l'id, nb de points, t0 et t_fin (ms), lat0 et lon0 (microdegrés), taille des données, crc32
+ENTETE = struct.Struct('<4sHIqqiiII')
+M_PAR_DEGRE = 111320.0
+
+
+def _jour(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime('%Y%m%d')
+
+
+def encoder_bloc(driver_id, points):
+    """Bloc binaire des points [(ts, lat, lon), ...] (triés par ts) d'un chauffeur."""
+    arr = np.asarray(points, dtype=np.float64)
+    ms = np.round(arr[:, 0] * 1000).astype(np.int64)
+    micro = np.round(arr[:, 1:] * 1e6).astype(np.int64)
+    colonnes = [np.diff(ms), np.diff(micro[:, 0]), np.diff(micro[:, 1])]
+    donnees = zlib.compress(b''.join(c.astype('<i4').tobytes() for c in colonnes))
+    ident = str(driver_id).encode()
+    return ENTETE.pack(MAGIE, len(ident), len(arr), int(ms[0]), int(ms[-1]), int(micro[0, 0]), int(micro[0, 1]),
+                       len(donnees), zlib.crc32(ident + donnees)) + ident + donnees
+
+
+def decoder_bloc(entete, donnees):
+    """[(ts, lat, lon), ...] d'un bloc (entête déjà dépaquetée)."""
+    _, _, n, t0, _, lat0, lon0, _, _ = entete
+    cols = np.frombuffer(zlib.decompress(donnees), dtype='<i4').astype(np.int64).reshape(3, n - 1)
+    ms = np.concatenate(([t0], t0 + np.cumsum(cols[0])))
+    lats = np.concatenate(([lat0], lat0 + np.cumsum(cols[1])))
+    lons = np.concatenate(([lon0], lon0 + np.cumsum(cols[2])))
+    return list(zip((ms / 1000.0).tolist(), (lats / 1e6).tolist(), (lons / 1e6).tolist()))
+
+
+def _lire_bloc(tampon, pos, complet=True):
+    """
+    (entete, driver_id, début des données, fin) du bloc à `pos`, None s'il est invalide.
+    Avec complet=False : vrai aussi pour un bloc plausible mais pas encore entièrement écrit.
+    """
+    if pos + ENTETE.size > len(tampon):
+        return None if complet else True
+    entete = ENTETE.unpack_from(tampon, pos)
+    debut = pos + ENTETE.size + entete[1]
+    fin = debut + entete[7]
+    if entete[0] != MAGIE or entete[2] < 1:
+        return None
+    if fin > len(tampon):
+        return None if complet else True
+    if zlib.crc32(tampon[pos + ENTETE.size:fin]) != entete[8]:
+        return None
+    return entete, tampon[pos + ENTETE.size:debut].decode(errors='replace'), debut, fin
+
+
+class _Trace:
+    """État du filtre à l'estime d'un chauffeur."""
+
+    def __init__(self):
+        self.dernier = None     # dernier point gardé (écrit ou non)
+        self.vitesse = None     # (dlat/s, dlon/s) entre les deux derniers points gardés
+        self.attente = None     # dernier point écarté : gardé si la trajectoire change
+        self.a_ecrire = []
+        self.activite = 0.0
+
+    def ecart_m(self, p):
+        t, lat, lon = self.dernier
+        dt = p[0] - t
+        plat, plon = lat + self.vitesse[0] * dt, lon + self.vitesse[1] * dt
+        return math.hypot(p[1] - plat, (p[2] - plon) * math.cos(math.radians(lat))) * M_PAR_DEGRE
+
+    def garder(self, p):
+        if self.dernier is not None and p[0] > self.dernier[0]:
+            dt = p[0] - self.dernier[0]
+            self.vitesse = ((p[1] - self.dernier[1]) / dt, (p[2] - self.dernier[2]) / dt)
+        self.dernier, self.attente = p, None
+        self.a_ecrire.append(p)
+
+
+class HistoriqueTrajets:
+    def __init__(self, dossier, tolerance_m=10.0, taille_bloc=512, flush_s=60.0, inactif_s=600.0,
+                 retention_jours=90, horloge=time.time):
+        self.dossier = dossier
+        self.tolerance_m = tolerance_m
+        self.taille_bloc = taille_bloc
+        self.flush_s = flush_s
+        self.inactif_s = inactif_s
+        self.retention_jours = retention_jours
+        self.horloge = horloge
+        os.makedirs(dossier, exist_ok=True)
+        self._traces = {}      # driver_id -> _Trace
+        self._index = {}       # chemin -> (octets indexés, [(driver_id, t0, t_fin, entete, position des données)])
+        self._verrou = threading.Lock()
+        self._verrou_index = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.recus = 0
+        self.gardes = 0
+        self.blocs = 0
+        self.octets = 0
+
+    # --- ÉCRITURE ---
+    def ajouter(self, driver_id, lat, lon, ts=None):
+        """Ajoute un ping retenu ; vrai s'il est gardé tel quel par le filtre."""
+        try:
+            p = (self.horloge() if ts is None else float(ts), float(lat), float(lon))
+        except (TypeError, ValueError):
+            return False
+        self._demarrer()
+        a_ecrire = None
+        with self._verrou:
+            self.recus += 1
+            trace = self._traces.get(driver_id)
+            if trace is None:
+                trace = self._traces[driver_id] = _Trace()
+            trace.activite = p[0]
+            garde = self._filtrer(trace, p)
+            if len(trace.a_ecrire) >= self.taille_bloc:
+                a_ecrire, trace.a_ecrire = trace.a_ecrire, []
+        if a_ecrire:
+            self._ecrire(driver_id, a_ecrire)
+        return garde
+
+    def _filtrer(self, trace, p):
+        precedent = trace.attente or trace.dernier
+        if precedent is not None and p[0] <= precedent[0]:
+            return False    # ping plus ancien que le dernier reçu
+        if trace.vitesse is not None and trace.ecart_m(p) <= self.tolerance_m:
+            trace.attente = p
+            return False
+        if trace.attente is not None:
+            # La trajectoire change : le dernier point prédit devient un point gardé
+            self.gardes += 1
+            trace.garder(trace.attente)
+            if trace.ecart_m(p) <= self.tolerance_m:
+                trace.attente = p
+                return False
+        self.gardes += 1
+        trace.garder(p)
+        return True
+
+    def clore(self, driver_id):
+        """Fin de service : le trajet en cours est écrit en entier."""
+        with self._verrou:
+            trace = self._traces.pop(driver_id, None)
+            if trace is None:
+                return
+            if trace.attente is not None:
+                self.gardes += 1
+                trace.garder(trace.attente)
+        if trace.a_ecrire:
+            self._ecrire(driver_id, trace.a_ecrire)
+
+    def flush(self, tout=False):
+        """Écrit les blocs en attente depuis plus de `flush_s` (tous si `tout`) ; clôt les traces inactives."""
+        maintenant = self.horloge()
+        with self._verrou:
+            inactifs = [i for i, t in self._traces.items() if tout or maintenant - t.activite >= self.inactif_s]
+            blocs = []
+            for driver_id, trace in self._traces.items():
+                if driver_id not in inactifs and trace.a_ecrire and maintenant - trace.a_ecrire[0][0] >= self.flush_s:
+                    blocs.append((driver_id, trace.a_ecrire))
+                    trace.a_ecrire = []
+        for driver_id, points in blocs:
+            self._ecrire(driver_id, points)
+        for driver_id in inactifs:
+            self.clore(driver_id)
+
+    def _ecrire(self, driver_id, points):
+        if not points:
+            return
+        bloc = encoder_bloc(driver_id, points)
+        chemin = os.path.join(self.dossier, _jour(points[0][0]) + '.seg')
+        try:
+            # Ajout en une seule écriture : les blocs des différents workers ne se mélangent pas
+            with open(chemin, 'ab') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(bloc)
+        except OSError as e:
+            print(f"⚠️ Historique {driver_id}: {e}")
+            return
+        with self._verrou:
+            self.blocs += 1
+            self.octets += len(bloc)
+
+    def purger(self):
+        """Supprime les segments plus vieux que `retention_jours`."""
+        limite = _jour(self.horloge() - self.retention_jours * 86400)
+        for nom in os.listdir(self.dossier):
+            if nom.endswith('.seg') and nom[:-4] < limite:
+                try:
+                    os.remove(os.path.join(self.dossier, nom))
+                except OSError:
+                    pass
+                with self._verrou_index:
+                    self._index.pop(os.path.join(self.dossier, nom), None)
+
+    def _demarrer(self):
+        # Thread lancé à la demande (et relancé après un fork gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._verrou:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._boucle, name='historique', daemon=True)
+            self._thread.start()
+
+    def _boucle(self):
+        while True:
+            time.sleep(min(self.flush_s, 60.0))
+            try:
+                self.flush()
+                self.purger()
+            except Exception as e:
+                print(f"⚠️ Historique: {e}")
+
+    # --- LECTURE ---
+    def _blocs(self, chemin):
+        """Entrées d'index d'un segment, complétées avec les blocs ajoutés depuis la dernière lecture."""
+        with self._verrou_index:
+            lus, entrees = self._index.get(chemin, (0, []))
+            try:
+                with open(chemin, 'rb') as f:
+                    f.seek(lus)
+                    nouveau = f.read()
+            except OSError:
+                return []
+            pos = 0
+            while pos + ENTETE.size <= len(nouveau):
+                bloc = _lire_bloc(nouveau, pos)
+                if bloc is None:
+                    # Bloc tronqué ou abîmé (worker arrêté en pleine écriture) : on repart au bloc valide suivant
+                    suivant = nouveau.find(MAGIE, pos + 1)
+                    while suivant >= 0 and _lire_bloc(nouveau, suivant) is None:
+                        suivant = nouveau.find(MAGIE, suivant + 1)
+                    if suivant < 0:
+                        if _lire_bloc(nouveau, pos, complet=False) is None:
+                            pos = len(nouveau)
+                        break   # sinon : bloc en cours d'écriture, relu la prochaine fois
+                    pos = suivant
+                    continue
+                entete, ident, debut_donnees, fin = bloc
+                entrees.append((ident, entete[3] / 1000.0, entete[4] / 1000.0, entete, lus + debut_donnees))
+                pos = fin
+            self._index[chemin] = (lus + pos, entrees)
+            return list(entrees)
+
+    def points(self, driver_id, debut, fin):
+        """Points gardés [(ts, lat, lon), ...] du chauffeur entre `debut` et `fin` (timestamps), triés."""
+        resultat = []
+        # Un bloc est rangé au jour de son premier point : celui de la veille peut déborder sur `debut`
+        jour = datetime.datetime.utcfromtimestamp(debut).date() - datetime.timedelta(days=1)
+        dernier_jour = datetime.datetime.utcfromtimestamp(fin).date()
+        while jour <= dernier_jour:
+            chemin = os.path.join(self.dossier, jour.strftime('%Y%m%d') + '.seg')
+            jour += datetime.timedelta(days=1)
+            if not os.path.exists(chemin):
+                continue
+            choisis = [e for e in self._blocs(chemin) if e[0] == str(driver_id) and e[2] >= debut and e[1] <= fin]
+            if not choisis:
+                continue
+            with open(chemin, 'rb') as f:
+                for _, _, _, entete, position in choisis:
+                    f.seek(position)
+                    resultat += decoder_bloc(entete, f.read(entete[7]))
+        with self._verrou:
+            trace = self._traces.get(driver_id)
+            if trace is not None:
+                resultat += trace.a_ecrire + ([trace.attente] if trace.attente else [])
+        # Un chauffeur servi par plusieurs workers a des blocs entrelacés : tri et dédoublonnage
+        uniques = {}
+        for p in resultat:
+            if debut <= p[0] <= fin:
+                uniques[p[0]] = p
+        return [uniques[t] for t in sorted(uniques)]
+
+    def position_a(self, driver_id, ts, marge_s=300.0):
+        """Position rejouée (interpolée entre les points gardés) à l'instant `ts`, None si inconnue."""
+        pts = self.points(driver_id, ts - marge_s, ts + marge_s)
+        avant = [p for p in pts if p[0] <= ts]
+        apres = [p for p in pts if p[0] >= ts]
+        if not avant or not apres:
+            return None
+        a, b = avant[-1], apres[0]
+        if b[0] == a[0]:
+            return {'ts': ts, 'lat': a[1], 'lon': a[2]}
+        k = (ts - a[0]) / (b[0] - a[0])
+        return {'ts': ts, 'lat': a[1] + k * (b[1] - a[1]), 'lon': a[2] + k * (b[2] - a[2])}
+
+    def stats(self):
+        with self._verrou:
+            return {
+                'pings': self.recus,
+                'gardes': self.gardes,
+                'ratio': round(self.gardes / self.recus, 3) if self.recus else 0.0,
+                'blocs': self.blocs,
+                'octets': self.octets,
+                'en_cours': len(self._traces),
+            }
@@ -0,0 +1,197 @@
+"""
+Index des lignes tracées : position d'un point *le long* d'une ligne.
+
+Une ligne est sa polyline (ordonnée du départ vers l'arrivée) et ses arrêts.
+À la construction on précalcule :
+- les distances cumulées le long de la polyline (abscisse de chaque sommet) ;
+- une grille de cellules de `pas_km` -> segments qui la traversent ;
+- l'abscisse de chaque arrêt, triée.
+
+Projeter un point GPS ne regarde que les segments des cellules voisines
+(anneaux croissants), puis l'arrêt précédent s'obtient par bisect sur les
+abscisses des arrêts. Bus et voyageurs ont ainsi une abscisse comparable :
+"bus déjà passé" et distance restante deviennent des soustractions.
+
+Les lignes sont construites une fois et partagées par toutes les requêtes.
+`IndexArrets` peut les construire en tâche de fond (par ex. depuis le cache
+d'itinéraires) : tant qu'une ligne n'est pas prête, `ligne()` renvoie None et
+l'appelant garde son calcul approché.
+"""
+import math
+import os
+import queue
+import threading
+import time
+from bisect import bisect_right
+
+import numpy as np
+
+from distances import distances_paires
+from index_spatial import KM_PAR_DEGRE
+
+
+class LigneTracee:
+    def __init__(self, points, arrets=None, pas_km=0.5):
+        """`points` : [[lat, lon], ...] ; `arrets` : [(nom, lat, lon), ...] (par défaut les deux extrémités)."""
+        if len(points) < 2:
+            raise ValueError("Une ligne doit avoir au moins deux points")
+        pts = np.asarray(points, dtype=np.float64)
+        self.pas_km = pas_km
+        # Plan local (km) : suffisant à l'échelle d'une ligne de bus
+        self._kx = KM_PAR_DEGRE * math.cos(math.radians(float(pts[:, 0].mean())))
+        self._ky = KM_PAR_DEGRE
+        xy = np.column_stack((pts[:, 1] * self._kx, pts[:, 0] * self._ky))
+        self._a, self._b = xy[:-1], xy[1:]
+        self._ab = self._b - self._a
+        self._l2 = np.einsum('ij,ij->i', self._ab, self._ab)
+        longueurs = distances_paires(pts[:-1, 0], pts[:-1, 1], pts[1:, 0], pts[1:, 1])
+        self.cumul = np.concatenate(([0.0], np.cumsum(longueurs)))
+        self.longueur_km = float(self.cumul[-1])
+
+        self._grille = {}
+        for i, (a, b) in enumerate(zip(self._a, self._b)):
+            (i0, j0), (i1, j1) = self._cellule(*np.minimum(a, b)), self._cellule(*np.maximum(a, b))
+            for ci in range(i0, i1 + 1):
+                for cj in range(j0, j1 + 1):
+                    self._grille.setdefault((ci, cj), []).append(i)
+
+        if arrets is None:
+            arrets = [('depart', *points[0]), ('arrivee', *points[-1])]
+        projetes = []
+        for nom, lat, lon in arrets:
+            p = self.projeter(lat, lon, ecart_max_km=None)
+            projetes.append((p[0], nom, lat, lon))
+        projetes.sort(key=lambda a: a[0])
+        self.arrets = [(nom, lat, lon) for _, nom, lat, lon in projetes]
+        self.abscisses_arrets = [a for a, _, _, _ in projetes]
+
+    def _cellule(self, x, y):
+        return int(math.floor(x / self.pas_km)), int(math.floor(y / self.pas_km))
+
+    def projeter(self, lat, lon, ecart_max_km=2.0):
+        """
+        (abscisse_km, ecart_km) du point de la ligne le plus proche de (lat, lon),
+        ou None si la ligne est à plus de `ecart_max_km` (None : pas de limite).
+        """
+        p = np.array((float(lon) * self._kx, float(lat) * self._ky))
+        if ecart_max_km is None:
+            return self._projeter_sur(p, np.arange(len(self._l2)))
+        ci, cj = self._cellule(*p)
+        vus = set()
+        meilleur = None
+        for r in range(int(ecart_max_km / self.pas_km) + 2):
+            segments = []
+            for di in range(-r, r + 1):
+                for dj in range(-r, r + 1):
+                    if max(abs(di), abs(dj)) == r:
+                        segments.extend(s for s in self._grille.get((ci + di, cj + dj), ()) if s not in vus)
+            if segments:
+                vus.update(segments)
+                proj = self._projeter_sur(p, np.fromiter(segments, dtype=np.intp, count=len(segments)))
+                if meilleur is None or proj[1] < meilleur[1]:
+                    meilleur = proj
+            # Tout segment plus proche que r * pas_km traverse une cellule déjà visitée
+            if meilleur is not None and meilleur[1] <= r * self.pas_km:
+                break
+        if meilleur is None or meilleur[1] > ecart_max_km:
+            return None
+        return meilleur
+
+    def _projeter_sur(self, p, segments):
+        ab, l2 = self._ab[segments], self._l2[segments]
+        ap = p - self._a[segments]
+        t = np.clip(np.einsum('ij,ij->i', ap, ab) / np.where(l2 > 0, l2, 1.0), 0.0, 1.0)
+        ecarts = np.hypot(*(ap - t[:, None] * ab).T)
+        k = int(np.argmin(ecarts))
+        s = segments[k]
+        abscisse = self.cumul[s] + t[k] * (self.cumul[s + 1] - self.cumul[s])
+        return float(abscisse), float(ecarts[k])
+
+    def abscisses(self, lats, lons, ecart_max_km=2.0):
+        """Abscisses (km) d'un lot de points, NaN pour ceux trop loin de la ligne."""
+        res = np.full(len(lats), np.nan)
+        for k, (lat, lon) in enumerate(zip(lats, lons)):
+            p = self.projeter(lat, lon, ecart_max_km)
+            if p is not None:
+                res[k] = p[0]
+        return res
+
+    def index_arret(self, abscisse):
+        """Index du dernier arrêt atteint à l'abscisse donnée (-1 avant le premier)."""
+        return bisect_right(self.abscisses_arrets, abscisse) - 1
+
+    def arret_plus_proche(self, lat, lon, ecart_max_km=2.0):
+        """Index de l'arrêt le plus proche le long de la ligne, None si le point est hors ligne."""
+        p = self.projeter(lat, lon, ecart_max_km)
+        if p is None:
+            return None
+        i = bisect_right(self.abscisses_arrets, p[0])
+        voisins = [k for k in (i - 1, i) if 0 <= k < len(self.arrets)]
+        return min(voisins, key=lambda k: abs(self.abscisses_arrets[k] - p[0]))
+
+
+class IndexArrets:
+    """Lignes tracées par identifiant, construites une fois (à la demande, en tâche de fond)."""
+
+    def __init__(self, construire=None, pas_km=0.5, reessai_s=600.0, horloge=time.time):
+        """`construire(cle)` -> points ou (points, arrets) ; appelé hors requête."""
+        self.construire = construire
+        self.pas_km = pas_km
+        self.reessai_s = reessai_s
+        self.horloge = horloge
+        self._lignes = {}
+        self._echecs = {}      # cle -> date du dernier échec de construction
+        self._en_cours = set()
+        self._file = queue.Queue()
+        self._verrou = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._lignes)
+
+    def ajouter(self, cle, points, arrets=None):
+        ligne = LigneTracee(points, arrets, pas_km=self.pas_km)
+        with self._verrou:
+            self._lignes[cle] = ligne
+        return ligne
+
+    def ligne(self, cle):
+        """LigneTracee de `cle`, ou None (sa construction est alors lancée si possible)."""
+        ligne = self._lignes.get(cle)
+        if ligne is not None or self.construire is None:
+            return ligne
+        with self._verrou:
+            echec = self._echecs.get(cle)
+            if cle in self._en_cours or (echec is not None and self.horloge() - echec < self.reessai_s):
+                return None
+            self._en_cours.add(cle)
+        self._demarrer()
+        self._file.put(cle)
+        return None
+
+    def _demarrer(self):
+        # Thread lancé à la demande (et relancé après un fork gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._verrou:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._boucle, name='index-arrets', daemon=True)
+            self._thread.start()
+
+    def _boucle(self):
+        while True:
+            cle = self._file.get()
+            try:
+                resultat = self.construire(cle)
+                points, arrets = resultat if isinstance(resultat, tuple) else (resultat, None)
+                self.ajouter(cle, points, arrets)
+            except Exception as e:
+                print(f"⚠️ Tracé de ligne {cle}: {e}")
+                with self._verrou:
+                    self._echecs[cle] = self.horloge()
+            finally:
+                with self._verrou:
+                    self._en_cours.discard(cle)
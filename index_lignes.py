@@ -0,0 +1,140 @@
+"""
+Index des lignes de bus pour la recherche voyageur.
+
+Au lieu de refaire des tests de sous-chaînes (`txt in ville`) pour chaque
+bus à chaque requête, on précalcule :
+- pour chaque texte saisi, l'ensemble des noms de villes qu'il désigne
+  (sous-chaîne + alias de CITIES_DB comme "tizi" / "dbk"), mémorisé ;
+- pour chaque chauffeur, sa ligne (terminus normalisés, coordonnées,
+  tarifs déjà filtrés par sens), reconstruite seulement quand son profil change.
+
+Une requête se réduit alors à des tests d'appartenance à un ensemble.
+"""
+import threading
+import unicodedata
+
+# Bits d'un masque de correspondance : le texte désigne le terminus 1 (ville_depart) et/ou 2 (ville_arrivee)
+TERMINUS_DEPART = 1
+TERMINUS_ARRIVEE = 2
+LES_DEUX = TERMINUS_DEPART | TERMINUS_ARRIVEE
+
+
+def normaliser(texte):
+    """Minuscules, sans accents, tirets remplacés par des espaces, espaces compactés."""
+    if not texte:
+        return ""
+    texte = unicodedata.normalize('NFKD', str(texte).lower())
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return ' '.join(texte.replace('-', ' ').replace('_', ' ').split())
+
+
+def _filtrer_tarifs(tarifs, direction):
+    filtres = [t for t in tarifs
+               if (dest := normaliser(t.get('dest', ''))) and (dest in direction or direction in dest)]
+    return filtres or tarifs
+
+
+class LigneChauffeur:
+    """Ligne précalculée d'un chauffeur (terminus, coordonnées, tarifs par sens)."""
+
+    def __init__(self, driver, villes):
+        self.v1 = normaliser(driver.get('ville_depart', ''))
+        self.v2 = normaliser(driver.get('ville_arrivee', ''))
+        if driver.get('dep_lat') and driver.get('dep_lon'):
+            self.coord_dep = {'lat': driver['dep_lat'], 'lon': driver['dep_lon']}
+        else:
+            self.coord_dep = villes.get(self.v1)
+        if driver.get('arr_lat') and driver.get('arr_lon'):
+            self.coord_arr = {'lat': driver['arr_lat'], 'lon': driver['arr_lon']}
+        else:
+            self.coord_arr = villes.get(self.v2)
+        self.tarifs = driver.get('tarifs') or []
+        self._tarifs_par_sens = {
+            TERMINUS_DEPART: _filtrer_tarifs(self.tarifs, self.v1) if self.v1 else self.tarifs,
+            TERMINUS_ARRIVEE: _filtrer_tarifs(self.tarifs, self.v2) if self.v2 else self.tarifs,
+        }
+
+    def sens(self, direction):
+        """Terminus vers lequel roule le bus (1 ou 2), 0 si la direction ne correspond à aucun."""
+        if direction == self.v1:
+            return TERMINUS_DEPART
+        if direction == self.v2:
+            return TERMINUS_ARRIVEE
+        return 0
+
+    def tarifs_vers(self, direction):
+        if not direction:
+            return self.tarifs
+        sens = self.sens(direction)
+        if sens:
+            return self._tarifs_par_sens[sens]
+        return _filtrer_tarifs(self.tarifs, direction)
+
+
+class IndexLignes:
+    def __init__(self, villes):
+        # Noms de CITIES_DB qui partagent les mêmes coordonnées = alias ("tizi" / "tizi ouzou")
+        self._villes = {normaliser(nom): coord for nom, coord in villes.items()}
+        groupes = {}
+        for nom, coord in self._villes.items():
+            groupes.setdefault((coord['lat'], coord['lon']), set()).add(nom)
+        self._alias = {nom: frozenset(g) for g in groupes.values() for nom in g}
+        self._noms = set(self._villes)       # tous les terminus connus
+        self._memo = {}                      # texte -> frozenset des noms désignés
+        self._lignes = {}                    # driver_id -> (signature du profil, LigneChauffeur)
+        self._verrou = threading.Lock()
+
+    def coord_ville(self, nom):
+        return self._villes.get(normaliser(nom))
+
+    def ligne(self, driver):
+        """LigneChauffeur du profil `driver`, reconstruite seulement si le profil a changé."""
+        signature = (driver.get('ville_depart'), driver.get('ville_arrivee'),
+                     driver.get('dep_lat'), driver.get('dep_lon'), driver.get('arr_lat'), driver.get('arr_lon'),
+                     repr(driver.get('tarifs')))
+        entree = self._lignes.get(driver['id'])
+        if entree is not None and entree[0] == signature:
+            return entree[1]
+        ligne = LigneChauffeur(driver, self._villes)
+        with self._verrou:
+            self._lignes[driver['id']] = (signature, ligne)
+            nouveaux = {n for n in (ligne.v1, ligne.v2) if n and n not in self._noms}
+            if nouveaux:
+                # Un terminus inconnu jusque-là peut être désigné par des textes déjà mémorisés
+                self._noms |= nouveaux
+                self._memo.clear()
+        return ligne
+
+    def oublier(self, driver_id):
+        with self._verrou:
+            self._lignes.pop(driver_id, None)
+
+    def noms_designes(self, texte):
+        """Noms de terminus désignés par un texte saisi (sous-chaîne d'un nom ou d'un alias)."""
+        texte = normaliser(texte)
+        noms = self._memo.get(texte)
+        if noms is None:
+            with self._verrou:
+                variantes = self._alias.get(texte, frozenset()) | {texte}
+                directs = {n for n in self._noms if any(v in n for v in variantes)}
+                noms = frozenset(directs.union(*(self._alias.get(n, ()) for n in directs)))
+                if len(self._memo) > 10000:
+                    self._memo.clear()
+                self._memo[texte] = noms
+        return noms
+
+    def masque(self, texte, ligne):
+        """Bits TERMINUS_DEPART / TERMINUS_ARRIVEE des terminus de `ligne` désignés par `texte` (tous si vide)."""
+        if not texte:
+            return LES_DEUX
+        noms = self.noms_designes(texte)
+        return (TERMINUS_DEPART if ligne.v1 in noms else 0) | (TERMINUS_ARRIVEE if ligne.v2 in noms else 0)
+
+    def correspond(self, texte_a, texte_b):
+        """Vrai si les deux textes désignent un même terminus (ou sont sous-chaîne l'un de l'autre)."""
+        a, b = normaliser(texte_a), normaliser(texte_b)
+        if not a or not b:
+            return False
+        if a in b or b in a:
+            return True
+        return bool(self.noms_designes(a) & self.noms_designes(b))
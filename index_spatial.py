@@ -0,0 +1,115 @@
+"""
+Index spatial par grille pour les positions des bus.
+
+Les positions sont rangées dans des cellules de `pas_deg` degrés ; une requête
+par rayon ne visite que les cellules qui recoupent le disque. Les k plus
+proches s'obtiennent en élargissant le rayon par doublement (`iter_par_anneaux`),
+ce qui permet au filtre de ligne de s'arrêter dès qu'il a assez de bus.
+"""
+import math
+
+from distances import distances_1_n
+
+KM_PAR_DEGRE = 111.32
+
+
+def boite_englobante(lat, lon, rayon_km):
+    """(lat_min, lat_max, lon_min, lon_max) du carré qui contient le disque."""
+    dlat = rayon_km / KM_PAR_DEGRE
+    dlon = rayon_km / (KM_PAR_DEGRE * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def iter_par_anneaux(requete_disque, taille, rayon_initial=1.0, rayon_max=None):
+    """
+    Produit des (distance_km, element) par distance croissante.
+
+    `requete_disque(r)` doit renvoyer tous les (distance, element) à moins de r km
+    et `taille()` le nombre total d'éléments indexés. Le rayon double à chaque
+    tour ; on s'arrête quand le disque contient tout l'index ou que `rayon_max`
+    est atteint.
+    """
+    deja = None
+    rayon = rayon_initial
+    while True:
+        if rayon_max is not None:
+            rayon = min(rayon, rayon_max)
+        disque = requete_disque(rayon)
+        anneau = disque if deja is None else [r for r in disque if r[0] > deja]
+        anneau.sort(key=lambda r: r[0])
+        for r in anneau:
+            yield r
+        if len(disque) >= taille() or (rayon_max is not None and rayon >= rayon_max):
+            return
+        deja = rayon
+        rayon *= 2
+
+
+class GrilleSpatiale:
+    def __init__(self, pas_deg=0.01):
+        self.pas = pas_deg
+        self._cellules = {}   # (i, j) -> {id: (lat, lon)}
+        self._positions = {}  # id -> (i, j)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cle(self, lat, lon):
+        return (int(math.floor(lat / self.pas)), int(math.floor(lon / self.pas)))
+
+    def placer(self, ident, lat, lon):
+        cle = self._cle(lat, lon)
+        ancienne = self._positions.get(ident)
+        if ancienne is not None and ancienne != cle:
+            self._retirer_de(ancienne, ident)
+        self._cellules.setdefault(cle, {})[ident] = (lat, lon)
+        self._positions[ident] = cle
+
+    def retirer(self, ident):
+        cle = self._positions.pop(ident, None)
+        if cle is not None:
+            self._retirer_de(cle, ident)
+
+    def _retirer_de(self, cle, ident):
+        cellule = self._cellules.get(cle)
+        if cellule is not None:
+            cellule.pop(ident, None)
+            if not cellule:
+                del self._cellules[cle]
+
+    def dans_rayon(self, lat, lon, rayon_km):
+        """Liste non triée des (distance_km, id) à moins de `rayon_km`."""
+        lat_min, lat_max, lon_min, lon_max = boite_englobante(lat, lon, rayon_km)
+        i0, j0 = self._cle(lat_min, lon_min)
+        i1, j1 = self._cle(lat_max, lon_max)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cellules):
+            # Disque plus grand que la zone occupée : on parcourt les cellules non vides
+            cellules = (c for (i, j), c in self._cellules.items() if i0 <= i <= i1 and j0 <= j <= j1)
+        else:
+            cellules = (self._cellules[(i, j)] for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+                        if (i, j) in self._cellules)
+        idents, lats, lons = [], [], []
+        for cellule in cellules:
+            for ident, (blat, blon) in cellule.items():
+                idents.append(ident)
+                lats.append(blat)
+                lons.append(blon)
+        if not idents:
+            return []
+        # Toutes les distances des cellules visitées en un seul calcul vectorisé
+        dists = distances_1_n(lat, lon, lats, lons)
+        return [(float(d), ident) for d, ident in zip(dists, idents) if d <= rayon_km]
+
+    def iter_proches(self, lat, lon, rayon_max_km=None):
+        """(distance_km, id) par distance croissante, éventuellement bornés à `rayon_max_km`."""
+        rayon_initial = self.pas * KM_PAR_DEGRE
+        return iter_par_anneaux(lambda r: self.dans_rayon(lat, lon, r), self.__len__,
+                                rayon_initial=rayon_initial, rayon_max=rayon_max_km)
+
+    def plus_proches(self, lat, lon, k, rayon_max_km=None):
+        resultats = []
+        for r in self.iter_proches(lat, lon, rayon_max_km):
+            if len(resultats) >= k:
+                break
+            resultats.append(r)
+        return resultats
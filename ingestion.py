@@ -0,0 +1,103 @@
+"""
+Ingestion des pings GPS des chauffeurs.
+
+chauffeur.html envoie une position à chaque callback de watchPosition, souvent
+plusieurs par seconde et au même endroit (bus à l'arrêt). Le filtre écarte :
+- les pings périmés (horodatage client plus ancien que le dernier retenu) ;
+- les doublons (moins de `distance_min_m` parcourus, ou moins de
+  `intervalle_min_s` écoulées), sauf toutes les `entretien_s` secondes pour
+  garder le bus "frais" dans la flotte.
+
+Un ping retenu met à jour la flotte en mémoire, est mis en file pour
+l'écriture par lots dans `active_trips` (flotte.EcrivainLots), est ajouté à
+l'historique des trajets (historique.HistoriqueTrajets) et réveille les flux
+voyageurs. La requête HTTP ne fait donc aucun aller-retour base de données.
+"""
+import threading
+import time
+
+from distances import haversine_km
+
+
+class FiltrePings:
+    def __init__(self, distance_min_m=15.0, intervalle_min_s=0.5, entretien_s=15.0, horloge=time.time):
+        self.distance_min_km = distance_min_m / 1000.0
+        self.intervalle_min_s = intervalle_min_s
+        self.entretien_s = entretien_s
+        self.horloge = horloge
+        self._derniers = {}  # driver_id -> (lat, lon, ts_serveur, ts_client)
+        self._verrou = threading.Lock()
+        self.acceptes = 0
+        self.doublons = 0
+        self.perimes = 0
+
+    def accepter(self, driver_id, lat, lon, ts_client=None):
+        """Vrai si le ping doit être traité (il devient alors la référence du chauffeur)."""
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            return True  # position invalide : on laisse la route répondre comme avant
+        maintenant = self.horloge()
+        with self._verrou:
+            dernier = self._derniers.get(driver_id)
+            if dernier is not None:
+                if ts_client is not None and dernier[3] is not None and ts_client <= dernier[3]:
+                    self.perimes += 1
+                    return False
+                ecoule = maintenant - dernier[2]
+                if ecoule < self.entretien_s:
+                    deplacement = haversine_km(dernier[0], dernier[1], lat, lon)
+                    if ecoule < self.intervalle_min_s or deplacement < self.distance_min_km:
+                        self.doublons += 1
+                        return False
+            self._derniers[driver_id] = (lat, lon, maintenant, ts_client)
+            self.acceptes += 1
+            return True
+
+    def oublier(self, driver_id):
+        with self._verrou:
+            self._derniers.pop(driver_id, None)
+
+    def stats(self):
+        return {'acceptes': self.acceptes, 'doublons': self.doublons, 'perimes': self.perimes}
+
+
+class Ingestion:
+    """Enchaîne filtre -> flotte en mémoire -> écriture différée -> historique -> notification des flux."""
+
+    def __init__(self, flotte, ecrivain, filtre, publier=None, historique=None):
+        self.flotte = flotte
+        self.ecrivain = ecrivain
+        self.filtre = filtre
+        self.publier = publier or (lambda driver_id: None)
+        self.historique = historique
+
+    def trajet_si_doublon(self, driver_id, lat, lon, ts_client=None):
+        """
+        Trajet déjà en mémoire si ce ping peut être ignoré, sinon None
+        (le ping est alors retenu et doit être enregistré).
+        """
+        trajet = self.flotte.trajet(driver_id)
+        if trajet is None:
+            # Bus absent de la flotte (premier ping, expiré...) : toujours traité
+            self.filtre.oublier(driver_id)
+            self.filtre.accepter(driver_id, lat, lon, ts_client)
+            return None
+        return None if self.filtre.accepter(driver_id, lat, lon, ts_client) else trajet
+
+    def enregistrer(self, driver_id, lat, lon, direction):
+        trajet = self.flotte.mettre_a_jour(driver_id, lat, lon, direction)
+        self.ecrivain.upsert(trajet)
+        if self.historique is not None:
+            self.historique.ajouter(driver_id, lat, lon)
+        self.publier(driver_id)
+        return trajet
+
+    def terminer(self, driver_id):
+        """Fin de service (terminus atteint ou bouton STOP)."""
+        self.filtre.oublier(driver_id)
+        self.flotte.retirer(driver_id)
+        self.ecrivain.supprimer(driver_id)
+        if self.historique is not None:
+            self.historique.clore(driver_id)
+        self.publier(driver_id)
@@ -0,0 +1,177 @@
+"""
+Tracés routiers (OSRM) mis en cache côté serveur pour /api/route.
+
+Les lignes des chauffeurs sont toujours les mêmes quelques trajets : on ne
+veut interroger OSRM qu'une fois par couple départ/arrivée.
+- Les extrémités sont arrondies sur une grille de `pas_deg` (~110 m par défaut) :
+  c'est la clé du cache, et c'est ce couple arrondi qui est demandé à OSRM.
+- Le tracé complet est stocké sur disque (SQLite) en polyline encodée
+  (format Google, précision 1e-5), bien plus compacte que le GeoJSON.
+- Les versions simplifiées par niveau de zoom (Douglas-Peucker, tolérance
+  d'un demi-pixel) sont gardées dans un cache mémoire LRU (cache.CacheTTL).
+- Deux requêtes simultanées sur la même clé ne font qu'un appel OSRM.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from cache import CacheTTL
+from routeauto import obtenir_route_precise
+
+ZOOM_MAX = 18
+
+
+# --- POLYLINE ENCODÉE ---
+def encoder_polyline(points, precision=5):
+    """[[lat, lon], ...] -> texte au format "encoded polyline" (lisible par Leaflet / OSRM)."""
+    facteur = 10 ** precision
+    morceaux = []
+    prec_lat = prec_lon = 0
+    for lat, lon in points:
+        ilat, ilon = int(round(lat * facteur)), int(round(lon * facteur))
+        for delta in (ilat - prec_lat, ilon - prec_lon):
+            v = ~(delta << 1) if delta < 0 else delta << 1
+            while v >= 0x20:
+                morceaux.append(chr((0x20 | (v & 0x1f)) + 63))
+                v >>= 5
+            morceaux.append(chr(v + 63))
+        prec_lat, prec_lon = ilat, ilon
+    return ''.join(morceaux)
+
+
+def decoder_polyline(texte, precision=5):
+    facteur = 10 ** precision
+    points, valeurs = [], []
+    courant = decalage = 0
+    lat = lon = 0
+    for c in texte:
+        b = ord(c) - 63
+        courant |= (b & 0x1f) << decalage
+        decalage += 5
+        if b >= 0x20:
+            continue
+        valeurs.append(~(courant >> 1) if courant & 1 else courant >> 1)
+        courant = decalage = 0
+        if len(valeurs) == 2:
+            lat += valeurs[0]
+            lon += valeurs[1]
+            points.append([lat / facteur, lon / facteur])
+            valeurs = []
+    return points
+
+
+# --- SIMPLIFICATION ---
+def tolerance_zoom(zoom):
+    """Demi-pixel (tuiles 256 px) exprimé en degrés au niveau `zoom`."""
+    return 360.0 / (256 * 2 ** zoom) / 2
+
+
+def simplifier(points, tolerance):
+    """Douglas-Peucker (itératif, distances en degrés) ; garde toujours les extrémités."""
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return list(points)
+    pts = np.asarray(points, dtype=np.float64)
+    garder = np.zeros(n, dtype=bool)
+    garder[0] = garder[-1] = True
+    pile = [(0, n - 1)]
+    while pile:
+        debut, fin = pile.pop()
+        if fin - debut < 2:
+            continue
+        a, b = pts[debut], pts[fin]
+        ab = b - a
+        ap = pts[debut + 1:fin] - a
+        longueur2 = ab @ ab
+        if longueur2 == 0:
+            dists = np.hypot(ap[:, 0], ap[:, 1])
+        else:
+            dists = np.abs(ab[0] * ap[:, 1] - ab[1] * ap[:, 0]) / np.sqrt(longueur2)
+        i = int(np.argmax(dists))
+        if dists[i] > tolerance:
+            milieu = debut + 1 + i
+            garder[milieu] = True
+            pile.append((debut, milieu))
+            pile.append((milieu, fin))
+    return pts[garder].tolist()
+
+
+# --- CACHE ---
+class CacheRoutes:
+    def __init__(self, chemin, calculer=obtenir_route_precise, pas_deg=0.001,
+                 taille_memoire=512, duree_vie_disque=30 * 86400, horloge=time.time):
+        """`calculer(dep_lat, dep_lon, arr_lat, arr_lon)` -> [[lat, lon], ...] (OSRM)."""
+        self.chemin = chemin
+        self.calculer = calculer
+        self.pas_deg = pas_deg
+        self.duree_vie_disque = duree_vie_disque
+        self.horloge = horloge
+        self.memoire = CacheTTL(taille_max=taille_memoire, ttl=duree_vie_disque)
+        self._local = threading.local()
+        self._verrous = {}
+        self._verrou = threading.Lock()
+        self.appels_osrm = 0
+        with self._conn() as conn:
+            conn.execute("""create table if not exists routes (
+                cle text primary key, polyline text, nb_points integer, cree real)""")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.chemin, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def arrondir(self, valeur):
+        return round(round(float(valeur) / self.pas_deg) * self.pas_deg, 6)
+
+    def route(self, dep_lat, dep_lon, arr_lat, arr_lon, zoom=None):
+        """
+        {'polyline', 'points', 'source'} du trajet, simplifié pour `zoom` (complet si None).
+        `source` vaut 'memoire', 'disque' ou 'osrm'. Lève l'erreur d'OSRM si le calcul échoue.
+        """
+        extremites = tuple(self.arrondir(v) for v in (dep_lat, dep_lon, arr_lat, arr_lon))
+        cle = '%.6f,%.6f;%.6f,%.6f' % extremites
+        zoom = None if zoom is None else max(0, min(ZOOM_MAX, int(zoom)))
+        if zoom == ZOOM_MAX:
+            zoom = None
+        en_memoire = self.memoire.get((cle, zoom))
+        if en_memoire is not None:
+            return dict(en_memoire, source='memoire')
+
+        points, source = self._complete(cle, extremites)
+        if zoom is not None:
+            points = simplifier(points, tolerance_zoom(zoom))
+        resultat = {'polyline': encoder_polyline(points), 'points': len(points)}
+        self.memoire.put((cle, zoom), resultat)
+        return dict(resultat, source=source)
+
+    def _complete(self, cle, extremites):
+        """Tracé complet : disque, sinon OSRM (un seul appel par clé à la fois)."""
+        with self._verrou:
+            if len(self._verrous) > 10000:
+                self._verrous.clear()
+            verrou = self._verrous.setdefault(cle, threading.Lock())
+        with verrou:
+            row = self._conn().execute("select polyline, cree from routes where cle = ?", (cle,)).fetchone()
+            if row and self.horloge() - row[1] < self.duree_vie_disque:
+                return decoder_polyline(row[0]), 'disque'
+            self.appels_osrm += 1
+            points = self.calculer(*extremites)
+            if not points:
+                raise ValueError("Itinéraire vide")
+            self._conn().execute("insert or replace into routes values (?, ?, ?, ?)",
+                                 (cle, encoder_polyline(points), len(points), self.horloge()))
+            # On relit la version encodée (arrondie à 1e-5) pour servir la même chose qu'après un redémarrage
+            return decoder_polyline(encoder_polyline(points)), 'osrm'
+
+    def stats(self):
+        stats = self.memoire.stats()
+        stats['appels_osrm'] = self.appels_osrm
+        stats['disque'] = self._conn().execute("select count(*) from routes").fetchone()[0]
+        return stats
@@ -0,0 +1,277 @@
+"""
+Répertoire local des lieux d'Algérie (géocodage et autocomplétion sans Nominatim).
+
+Le répertoire est un fichier binaire compact (lieux_dz.bin), ouvert en mmap :
+- en-tête : MAGIE, nombre de lieux, nombre de noms, décalage des chaînes ;
+- lieux : lat / lon en microdegrés (int32), population, nom affiché, wilaya ;
+- noms : un enregistrement par nom ou alias normalisé, trié, -> index du lieu ;
+- chaînes UTF-8.
+
+Au chargement, on construit un trie des noms normalisés (minuscules, sans
+accents ni tirets, cf. index_lignes.normaliser), indexé aussi à chaque début de
+mot ("khedda" trouve "draa ben khedda"). Chaque nœud garde ses meilleurs lieux
+(population) : une autocomplétion coûte la longueur du préfixe. Sans résultat
+exact, un classement approché (distance d'édition sur le préfixe) rattrape les
+fautes de frappe.
+
+Construire le fichier : python lieux.py lieux_dz.tsv lieux_dz.bin
+(accepte aussi un extrait GeoNames DZ.txt).
+"""
+import mmap
+import struct
+import sys
+import threading
+
+from index_lignes import normaliser
+
+MAGIE = b'LIEUX1\0\0'
+_ENTETE = struct.Struct('<8sIII')      # magie, nb_lieux, nb_noms, décalage des chaînes
+_LIEU = struct.Struct('<iiIIHBx')      # lat_e6, lon_e6, population, décalage nom, longueur nom, wilaya
+_NOM = struct.Struct('<IIHxx')         # décalage nom normalisé, index du lieu, longueur
+
+PROFONDEUR_MAX = 8   # au-delà, les candidats du nœud sont filtrés par startswith
+MEILLEURS_PAR_NOEUD = 10
+
+WILAYAS = {
+    1: "Adrar", 2: "Chlef", 3: "Laghouat", 4: "Oum El Bouaghi", 5: "Batna", 6: "Béjaïa", 7: "Biskra",
+    8: "Béchar", 9: "Blida", 10: "Bouira", 11: "Tamanrasset", 12: "Tébessa", 13: "Tlemcen", 14: "Tiaret",
+    15: "Tizi Ouzou", 16: "Alger", 17: "Djelfa", 18: "Jijel", 19: "Sétif", 20: "Saïda", 21: "Skikda",
+    22: "Sidi Bel Abbès", 23: "Annaba", 24: "Guelma", 25: "Constantine", 26: "Médéa", 27: "Mostaganem",
+    28: "M'Sila", 29: "Mascara", 30: "Ouargla", 31: "Oran", 32: "El Bayadh", 33: "Illizi",
+    34: "Bordj Bou Arréridj", 35: "Boumerdès", 36: "El Tarf", 37: "Tindouf", 38: "Tissemsilt",
+    39: "El Oued", 40: "Khenchela", 41: "Souk Ahras", 42: "Tipaza", 43: "Mila", 44: "Aïn Defla",
+    45: "Naâma", 46: "Aïn Témouchent", 47: "Ghardaïa", 48: "Relizane", 49: "Timimoun",
+    50: "Bordj Badji Mokhtar", 51: "Ouled Djellal", 52: "Béni Abbès", 53: "In Salah", 54: "In Guezzam",
+    55: "Touggourt", 56: "Djanet", 57: "El M'Ghair", 58: "El Meniaa",
+}
+
+
+# --- CONSTRUCTION DU FICHIER ---
+def lire_source(chemin):
+    """[(nom, [alias], lat, lon, wilaya, population)] depuis le TSV du dépôt ou un extrait GeoNames."""
+    lieux = []
+    with open(chemin, encoding='utf-8') as f:
+        for ligne in f:
+            if not ligne.strip() or ligne.startswith('#'):
+                continue
+            c = ligne.rstrip('\r\n').split('\t')
+            if len(c) >= 15:
+                # GeoNames : seuls les lieux habités (classe P)
+                if c[6] != 'P':
+                    continue
+                alias = [a for a in c[3].split(',') if a][:20]
+                lieux.append((c[1], alias, float(c[4]), float(c[5]), 0, int(c[14] or 0)))
+            else:
+                alias = [a for a in c[1].split('|') if a]
+                lieux.append((c[0], alias, float(c[2]), float(c[3]), int(c[4] or 0), int(c[5] or 0)))
+    return lieux
+
+
+def construire_fichier(lieux, sortie):
+    chaines = bytearray()
+    enregistrements_lieux, noms = [], {}
+    for i, (nom, alias, lat, lon, wilaya, population) in enumerate(lieux):
+        brut = nom.encode('utf-8')
+        enregistrements_lieux.append((int(round(lat * 1e6)), int(round(lon * 1e6)), population,
+                                      len(chaines), len(brut), wilaya))
+        chaines += brut
+        for n in [nom] + alias:
+            cle = normaliser(n)
+            # Un nom partagé par plusieurs lieux désigne le plus peuplé
+            if cle and (cle not in noms or lieux[noms[cle]][5] < population):
+                noms[cle] = i
+    enregistrements_noms = []
+    for cle in sorted(noms):
+        brut = cle.encode('utf-8')
+        enregistrements_noms.append((len(chaines), noms[cle], len(brut)))
+        chaines += brut
+    debut_chaines = _ENTETE.size + _LIEU.size * len(enregistrements_lieux) + _NOM.size * len(enregistrements_noms)
+    with open(sortie, 'wb') as f:
+        f.write(_ENTETE.pack(MAGIE, len(enregistrements_lieux), len(enregistrements_noms), debut_chaines))
+        for e in enregistrements_lieux:
+            f.write(_LIEU.pack(*e))
+        for e in enregistrements_noms:
+            f.write(_NOM.pack(*e))
+        f.write(chaines)
+    return len(enregistrements_lieux), len(enregistrements_noms)
+
+
+# --- RECHERCHE ---
+def _distance_prefixe(requete, nom, maximum):
+    """Plus petite distance d'édition entre `requete` et un préfixe de `nom` (None si > maximum)."""
+    precedente = list(range(len(nom) + 1))
+    for i, c in enumerate(requete, 1):
+        courante = [i]
+        for j, d in enumerate(nom, 1):
+            courante.append(min(precedente[j] + 1, courante[j - 1] + 1, precedente[j - 1] + (c != d)))
+        if min(courante) > maximum:
+            return None
+        precedente = courante
+    meilleure = min(precedente)
+    return meilleure if meilleure <= maximum else None
+
+
+class RepertoireLieux:
+    def __init__(self, chemin):
+        with open(chemin, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magie, self.nb_lieux, self.nb_noms, self._chaines = _ENTETE.unpack_from(self._mm, 0)
+        if magie != MAGIE:
+            raise ValueError(f"{chemin} n'est pas un répertoire de lieux")
+        self._debut_noms = _ENTETE.size + _LIEU.size * self.nb_lieux
+        self._index = {}     # nom normalisé -> index du lieu
+        self._racine = {}    # trie : caractère -> nœud ; nœud = {'': [meilleurs lieux], car: nœud...}
+        self._par_initiale = {}  # première lettre -> [(début de mot, nom, lieu)] pour la recherche approchée
+        self._memo = {}
+        self._verrou = threading.Lock()
+        for k in range(self.nb_noms):
+            off, lieu, longueur = _NOM.unpack_from(self._mm, self._debut_noms + k * _NOM.size)
+            self._index[self._chaine(off, longueur)] = lieu
+        self._construire_trie()
+
+    def __len__(self):
+        return self.nb_lieux
+
+    def _construire_trie(self):
+        par_lieu_pop = lambda i: -self._population(i)
+        for nom, lieu in self._index.items():
+            mots = nom.split(' ')
+            for k in range(len(mots)):
+                suffixe = ' '.join(mots[k:])
+                self._par_initiale.setdefault(suffixe[0], []).append((suffixe, nom, lieu))
+                noeud = self._racine
+                for c in suffixe[:PROFONDEUR_MAX]:
+                    noeud = noeud.setdefault(c, {'': []})
+                    noeud[''].append((nom, lieu))
+        # Chaque nœud garde ses meilleurs lieux ; ceux de profondeur maximale gardent tout (filtrage ensuite)
+        pile = [(self._racine, 0)]
+        while pile:
+            noeud, profondeur = pile.pop()
+            for c, enfant in noeud.items():
+                if c == '':
+                    continue
+                entrees = sorted(set(enfant['']), key=lambda e: (par_lieu_pop(e[1]), len(e[0])))
+                if profondeur + 1 < PROFONDEUR_MAX:
+                    vus, meilleurs = set(), []
+                    for e in entrees:
+                        if e[1] not in vus:
+                            vus.add(e[1])
+                            meilleurs.append(e)
+                        if len(meilleurs) >= MEILLEURS_PAR_NOEUD:
+                            break
+                    entrees = meilleurs
+                enfant[''] = entrees
+                pile.append((enfant, profondeur + 1))
+
+    def _chaine(self, off, longueur):
+        debut = self._chaines + off
+        return self._mm[debut:debut + longueur].decode('utf-8')
+
+    def _population(self, i):
+        return _LIEU.unpack_from(self._mm, _ENTETE.size + i * _LIEU.size)[2]
+
+    def lieu(self, i):
+        lat, lon, population, off, longueur, wilaya = _LIEU.unpack_from(self._mm, _ENTETE.size + i * _LIEU.size)
+        return {
+            'nom': self._chaine(off, longueur),
+            'lat': lat / 1e6, 'lon': lon / 1e6,
+            'wilaya': WILAYAS.get(wilaya, "Algérie"),
+            'population': population,
+        }
+
+    def coordonnees(self):
+        """{nom normalisé (alias compris): {'lat', 'lon'}} : remplace l'ancien CITIES_DB."""
+        res = {}
+        for nom, i in self._index.items():
+            l = self.lieu(i)
+            res[nom] = {'lat': l['lat'], 'lon': l['lon']}
+        return res
+
+    def resoudre(self, texte):
+        """Lieu dont le nom (ou un alias) est exactement `texte` une fois normalisé, sinon None."""
+        i = self._index.get(normaliser(texte))
+        return None if i is None else self.lieu(i)
+
+    def trouver_dans(self, texte, mots_max=4):
+        """Lieu nommé dans un texte libre ("gare routière d'Azazga"), le nom le plus long l'emportant."""
+        mots = normaliser(texte).replace("'", ' ').split()
+        for n in range(min(mots_max, len(mots)), 0, -1):
+            for k in range(len(mots) - n + 1):
+                i = self._index.get(' '.join(mots[k:k + n]))
+                if i is not None:
+                    return self.lieu(i)
+        return None
+
+    def rechercher(self, texte, limite=5):
+        """Autocomplétion : lieux par préfixe (début de nom ou de mot), sinon approchés ; les plus peuplés d'abord."""
+        q = normaliser(texte).replace("'", ' ')
+        if not q:
+            return []
+        cle = (q, limite)
+        resultat = self._memo.get(cle)
+        if resultat is None:
+            # Fautes de frappe : recherche approchée seulement si aucun nom ne commence ainsi
+            indices = self._par_prefixe(q, limite) or self._approches(q, limite)
+            resultat = [self.lieu(i) for i in indices]
+            with self._verrou:
+                if len(self._memo) > 10000:
+                    self._memo.clear()
+                self._memo[cle] = resultat
+        return resultat
+
+    def _noeud(self, q):
+        noeud = self._racine
+        for c in q[:PROFONDEUR_MAX]:
+            noeud = noeud.get(c)
+            if noeud is None:
+                return None
+        return noeud
+
+    def _par_prefixe(self, q, limite):
+        noeud = self._noeud(q)
+        if noeud is None:
+            return []
+        entrees = noeud['']
+        if len(q) > PROFONDEUR_MAX:
+            entrees = [e for e in entrees if any(s.startswith(q) for s in self._suffixes(e[0]))]
+        # Nom exact en tête, puis population (déjà l'ordre du nœud)
+        exact = self._index.get(q)
+        indices = [] if exact is None else [exact]
+        for _, i in entrees:
+            if i not in indices:
+                indices.append(i)
+            if len(indices) >= limite:
+                break
+        return indices
+
+    @staticmethod
+    def _suffixes(nom):
+        mots = nom.split(' ')
+        return [' '.join(mots[k:]) for k in range(len(mots))]
+
+    def _approches(self, q, limite):
+        """Noms à une ou deux fautes près (sur le préfixe tapé), parmi ceux qui commencent par la même lettre."""
+        if len(q) < 3:
+            return []
+        maximum = 1 if len(q) < 6 else 2
+        scores = []
+        for debut, nom, i in self._par_initiale.get(q[0], ()):
+            d = _distance_prefixe(q, debut, maximum)
+            if d is not None:
+                scores.append((d, -self._population(i), len(nom), i))
+        scores.sort()
+        vus, res = set(), []
+        for _, _, _, i in scores:
+            if i not in vus:
+                vus.add(i)
+                res.append(i)
+            if len(res) >= limite:
+                break
+        return res
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("Usage : python lieux.py source.tsv|DZ.txt sortie.bin")
+    nb_lieux, nb_noms = construire_fichier(lire_source(sys.argv[1]), sys.argv[2])
+    print(f"✅ {nb_lieux} lieux, {nb_noms} noms -> {sys.argv[2]}")
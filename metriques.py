@@ -0,0 +1,281 @@
+"""
+Métriques de l'application au format texte Prometheus (/metrics).
+
+- `instrumenter(app, metriques)` chronomètre chaque requête Flask :
+  histogramme de latence par route (la règle, ex. /api/flux-bus/<ab_id>,
+  pas l'URL) et compteur par code de statut.
+- `ClientInstrumente` enveloppe le client Supabase (synchrone ou asynchrone) :
+  chaque execute() est compté et chronométré par table et opération.
+- `Metriques.collecter(...)` branche des valeurs lues au moment du scrape
+  (taille de la flotte, hits / misses des caches...).
+- `ProfileurEchantillons` (optionnel) échantillonne la pile des requêtes en
+  cours ; celles qui dépassent le seuil sont gardées (et affichées) avec leurs
+  piles les plus fréquentes.
+
+Chaque worker gunicorn a ses propres compteurs (comme les caches) : le scrape
+voit le worker qui répond.
+"""
+import inspect
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+
+from flask import g, request
+
+BORNES_REQUETE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BORNES_SUPABASE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _echapper(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquettes(noms, valeurs, extra=''):
+    paires = [f'{n}="{_echapper(v)}"' for n, v in zip(noms, valeurs)]
+    if extra:
+        paires.append(extra)
+    return '{' + ','.join(paires) + '}' if paires else ''
+
+
+class _Histogramme:
+    def __init__(self, bornes):
+        self.comptes = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+
+    def observer(self, bornes, valeur):
+        self.comptes[bisect_left(bornes, valeur)] += 1
+        self.somme += valeur
+
+
+class Metriques:
+    def __init__(self, prefixe='finaltrans'):
+        self.prefixe = prefixe
+        self._familles = {}    # nom -> (type, aide, noms d'étiquettes, bornes, {valeurs: compteur ou histogramme})
+        self._collecteurs = []
+        self._verrou = threading.Lock()
+
+    def _famille(self, nom, type_, aide, etiquettes, bornes=None):
+        famille = self._familles.get(nom)
+        if famille is None:
+            famille = self._familles[nom] = (type_, aide, tuple(etiquettes), bornes, {})
+        return famille
+
+    def incrementer(self, nom, aide, etiquettes=(), valeurs=(), n=1):
+        with self._verrou:
+            series = self._famille(nom, 'counter', aide, etiquettes)[4]
+            series[tuple(valeurs)] = series.get(tuple(valeurs), 0) + n
+
+    def observer(self, nom, aide, bornes, etiquettes=(), valeurs=(), valeur=0.0):
+        with self._verrou:
+            series = self._famille(nom, 'histogram', aide, etiquettes, bornes)[4]
+            h = series.get(tuple(valeurs))
+            if h is None:
+                h = series[tuple(valeurs)] = _Histogramme(bornes)
+            h.observer(bornes, valeur)
+
+    def collecter(self, nom, type_, aide, fonction, etiquettes=()):
+        """`fonction()` -> nombre, ou {(valeurs d'étiquettes): nombre} ; appelée à chaque scrape."""
+        self._collecteurs.append((nom, type_, aide, tuple(etiquettes), fonction))
+
+    # --- RACCOURCIS ---
+    def observer_requete(self, route, methode, statut, duree_s):
+        self.observer('requete_duree_secondes', "Durée des requêtes HTTP par route", BORNES_REQUETE,
+                      ('route', 'methode'), (route, methode), duree_s)
+        self.incrementer('requetes_total', "Requêtes HTTP par route et statut",
+                         ('route', 'methode', 'statut'), (route, methode, str(statut)))
+
+    def observer_appel(self, table, operation, duree_s, erreur=False):
+        self.observer('supabase_duree_secondes', "Durée des appels Supabase par table et opération",
+                      BORNES_SUPABASE, ('table', 'operation'), (table, operation), duree_s)
+        if erreur:
+            self.incrementer('supabase_erreurs_total', "Appels Supabase en erreur",
+                             ('table', 'operation'), (table, operation))
+
+    def exposer(self):
+        """Texte au format d'exposition Prometheus 0.0.4."""
+        lignes = []
+        with self._verrou:
+            familles = [(nom, f[0], f[1], f[2], f[3], dict(f[4])) for nom, f in self._familles.items()]
+            copies = {}
+            for nom, type_, _, _, _, series in familles:
+                if type_ == 'histogram':
+                    copies[nom] = {k: (list(h.comptes), h.somme) for k, h in series.items()}
+        for nom, type_, aide, etiquettes, bornes, series in familles:
+            complet = f"{self.prefixe}_{nom}"
+            lignes += [f"# HELP {complet} {aide}", f"# TYPE {complet} {type_}"]
+            for valeurs, v in sorted(series.items()):
+                if type_ == 'counter':
+                    lignes.append(f"{complet}{_etiquettes(etiquettes, valeurs)} {v}")
+                    continue
+                comptes, somme = copies[nom][valeurs]
+                cumul = 0
+                for borne, n in zip(list(bornes) + ['+Inf'], comptes):
+                    cumul += n
+                    le = 'le="%s"' % borne
+                    lignes.append(f"{complet}_bucket{_etiquettes(etiquettes, valeurs, le)} {cumul}")
+                lignes.append(f"{complet}_sum{_etiquettes(etiquettes, valeurs)} {round(somme, 6)}")
+                lignes.append(f"{complet}_count{_etiquettes(etiquettes, valeurs)} {cumul}")
+        for nom, type_, aide, etiquettes, fonction in self._collecteurs:
+            complet = f"{self.prefixe}_{nom}"
+            try:
+                valeur = fonction()
+            except Exception as e:
+                print(f"⚠️ Métrique {complet}: {e}")
+                continue
+            lignes += [f"# HELP {complet} {aide}", f"# TYPE {complet} {type_}"]
+            series = valeur if isinstance(valeur, dict) else {(): valeur}
+            for valeurs, v in sorted(series.items()):
+                valeurs = valeurs if isinstance(valeurs, tuple) else (valeurs,)
+                lignes.append(f"{complet}{_etiquettes(etiquettes, valeurs)} {v}")
+        return '\n'.join(lignes) + '\n'
+
+
+# --- CLIENT SUPABASE INSTRUMENTÉ ---
+class _RequeteInstrumentee:
+    """Enveloppe un constructeur de requête postgrest : retient l'opération, chronomètre execute()."""
+
+    OPERATIONS = ('select', 'insert', 'upsert', 'update', 'delete')
+
+    def __init__(self, requete, table, metriques, operation='select'):
+        self._requete = requete
+        self._table = table
+        self._metriques = metriques
+        self._operation = operation
+
+    def __getattr__(self, nom):
+        attribut = getattr(self._requete, nom)
+        if not callable(attribut):
+            return attribut
+        operation = nom if nom in self.OPERATIONS else self._operation
+
+        def appel(*args, **kwargs):
+            resultat = attribut(*args, **kwargs)
+            if hasattr(resultat, 'execute'):
+                return _RequeteInstrumentee(resultat, self._table, self._metriques, operation)
+            return resultat
+        return appel
+
+    def execute(self):
+        t0 = time.perf_counter()
+        try:
+            resultat = self._requete.execute()
+        except Exception:
+            self._metriques.observer_appel(self._table, self._operation, time.perf_counter() - t0, erreur=True)
+            raise
+        if inspect.isawaitable(resultat):
+            # Client asynchrone : l'appel n'a lieu qu'à l'await
+            return self._attendre(resultat, t0)
+        self._metriques.observer_appel(self._table, self._operation, time.perf_counter() - t0)
+        return resultat
+
+    async def _attendre(self, resultat, t0):
+        try:
+            resultat = await resultat
+        except Exception:
+            self._metriques.observer_appel(self._table, self._operation, time.perf_counter() - t0, erreur=True)
+            raise
+        self._metriques.observer_appel(self._table, self._operation, time.perf_counter() - t0)
+        return resultat
+
+
+class ClientInstrumente:
+    """Client Supabase dont chaque table() est instrumentée ; le reste (auth...) est transmis tel quel."""
+
+    def __init__(self, client, metriques):
+        self._client = client
+        self._metriques = metriques
+
+    def table(self, nom):
+        return _RequeteInstrumentee(self._client.table(nom), nom, self._metriques)
+
+    def __getattr__(self, nom):
+        return getattr(self._client, nom)
+
+
+# --- PROFILEUR DES REQUÊTES LENTES ---
+class ProfileurEchantillons:
+    """Échantillonne toutes les `intervalle_s` la pile des threads qui servent une requête."""
+
+    def __init__(self, seuil_s=0.5, intervalle_s=0.005, profondeur=12, garder=20):
+        self.seuil_s = seuil_s
+        self.intervalle_s = intervalle_s
+        self.profondeur = profondeur
+        self.lentes = deque(maxlen=garder)
+        self._en_cours = {}    # ident du thread -> Counter des piles
+        self._verrou = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def debut(self):
+        self._demarrer()
+        with self._verrou:
+            self._en_cours[threading.get_ident()] = Counter()
+
+    def fin(self, route, duree_s):
+        with self._verrou:
+            piles = self._en_cours.pop(threading.get_ident(), None)
+        if piles is None or duree_s < self.seuil_s:
+            return
+        total = sum(piles.values())
+        profil = {
+            'route': route, 'duree_ms': round(duree_s * 1000, 1), 'echantillons': total,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'piles': [{'pile': pile, 'part': round(n / total, 3)} for pile, n in piles.most_common(10)],
+        }
+        self.lentes.append(profil)
+        haut = profil['piles'][0]['pile'].rsplit(';', 1)[-1] if total else '?'
+        print(f"🐢 Requête lente {route} : {profil['duree_ms']} ms ({total} échantillons, surtout {haut})")
+
+    def _demarrer(self):
+        # Thread lancé à la demande (et relancé après un fork gunicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._verrou:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._boucle, name='profileur', daemon=True)
+            self._thread.start()
+
+    def _boucle(self):
+        while True:
+            time.sleep(self.intervalle_s)
+            with self._verrou:
+                suivis = list(self._en_cours.items())
+            if not suivis:
+                continue
+            cadres = sys._current_frames()
+            for ident, piles in suivis:
+                cadre = cadres.get(ident)
+                pile = []
+                while cadre is not None and len(pile) < self.profondeur:
+                    code = cadre.f_code
+                    pile.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{cadre.f_lineno}")
+                    cadre = cadre.f_back
+                if pile:
+                    piles[';'.join(reversed(pile))] += 1
+
+
+# --- MIDDLEWARE FLASK ---
+def instrumenter(app, metriques, profileur=None):
+    """Chronomètre chaque requête (et la profile si un profileur est fourni)."""
+
+    @app.before_request
+    def _debut_requete():
+        g.debut_requete = time.perf_counter()
+        if profileur is not None:
+            profileur.debut()
+
+    @app.after_request
+    def _fin_requete(reponse):
+        debut = g.pop('debut_requete', None)
+        if debut is not None:
+            duree = time.perf_counter() - debut
+            route = request.url_rule.rule if request.url_rule is not None else 'inconnue'
+            metriques.observer_requete(route, request.method, reponse.status_code, duree)
+            if profileur is not None:
+                profileur.fin(route, duree)
+        return reponse
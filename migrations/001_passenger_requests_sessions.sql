@@ -0,0 +1,12 @@
+-- Une ligne passenger_requests par voyageur (upsert sur passenger_id, relecture par updated_at).
+-- À appliquer une fois (éditeur SQL Supabase) avant ou après le déploiement : sans elle,
+-- l'application retombe sur l'insertion simple et relit la table par created_at.
+
+alter table passenger_requests add column if not exists passenger_id text;
+alter table passenger_requests add column if not exists updated_at timestamptz not null default now();
+
+-- Les anciennes lignes (une par recherche, sans voyageur) ne peuvent pas être fusionnées
+delete from passenger_requests where passenger_id is null;
+
+create unique index if not exists passenger_requests_passenger_id_key on passenger_requests (passenger_id);
+create index if not exists passenger_requests_updated_at_idx on passenger_requests (updated_at);
@@ -0,0 +1,67 @@
+"""
+Réponses compactes et conditionnelles pour le sondage de /api/trouver-bus.
+
+- Une fiche de bus se sépare en partie dynamique (position, ETA, distance),
+  envoyée à chaque sondage, et partie statique (chauffeur, véhicule, terminus,
+  tarifs du sens), servie à part par /api/fiches-bus et gardée par le client.
+  Chaque ligne compacte porte la `version` de la fiche statique : le client
+  ne la redemande que si elle a changé.
+- `etag_contenu` dérive un ETag (faible) du contenu de la réponse : tant que
+  la liste (positions, ETA et distances arrondies, fiches) ne change pas, un
+  sondage GET reçoit un 304, même si le voyageur bouge un peu ou si le sondage
+  arrive sur un autre worker. Un profil ou des tarifs modifiés changent la
+  fiche, donc l'ETag.
+- `compresser(app)` gzip les réponses JSON assez grosses si le client l'accepte.
+"""
+import gzip
+import json
+import zlib
+
+from flask import request
+
+CHAMPS_COMPACTS = ('bus_id', 'current_lat', 'current_lon', 'eta', 'distance_km')
+
+
+def _crc(valeur):
+    return format(zlib.crc32(json.dumps(valeur, sort_keys=True, ensure_ascii=False).encode()), '08x')
+
+
+def version_fiche(fiche):
+    """Empreinte courte de la partie statique d'une fiche de bus."""
+    return _crc(fiche)
+
+
+def compacter(bus_proches):
+    """
+    {'revision', 'champs', 'bus': [[bus_id, lat, lon, eta, distance_km, version], ...]}
+    à partir des fiches complètes de rechercher_bus ; `revision` est l'empreinte des lignes.
+    """
+    lignes = []
+    for bus in bus_proches:
+        statique = {k: v for k, v in bus.items() if k not in CHAMPS_COMPACTS}
+        lignes.append([bus[c] for c in CHAMPS_COMPACTS] + [version_fiche(statique)])
+    return {'revision': _crc(lignes), 'champs': list(CHAMPS_COMPACTS) + ['fiche'], 'bus': lignes}
+
+
+def etag_contenu(corps):
+    """ETag d'une réponse JSON : empreinte de son contenu."""
+    return corps['revision'] if 'revision' in corps else _crc(corps)
+
+
+# --- COMPRESSION ---
+def compresser(app, seuil=1024, niveau=6):
+    """Compresse (gzip) les réponses JSON de plus de `seuil` octets pour les clients qui l'acceptent."""
+
+    @app.after_request
+    def _gzip(reponse):
+        if (reponse.status_code != 200 or reponse.direct_passthrough or reponse.is_streamed
+                or reponse.mimetype != 'application/json' or 'Content-Encoding' in reponse.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+            return reponse
+        donnees = reponse.get_data()
+        if len(donnees) < seuil:
+            return reponse
+        reponse.set_data(gzip.compress(donnees, niveau))
+        reponse.headers['Content-Encoding'] = 'gzip'
+        reponse.vary.add('Accept-Encoding')
+        return reponse
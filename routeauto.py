@@ -1,11 +1,17 @@
+import os
 import requests
 import json
 
-def obtenir_route_precise(depart_lat, depart_lon, arrivee_lat, arrivee_lon):
+# Serveur OSRM (surchargeable pour un OSRM local ou un faux serveur de test)
+OSRM_URL = os.getenv("OSRM_URL", "http://router.project-osrm.org").rstrip('/')
+
+_session = requests.Session()
+
+def obtenir_route_precise(depart_lat, depart_lon, arrivee_lat, arrivee_lon, timeout=10):
     # On interroge le service OSRM (gratuit)
-    url = f"http://router.project-osrm.org/route/v1/driving/{depart_lon},{depart_lat};{arrivee_lon},{arrivee_lat}?overview=full&geometries=geojson"
+    url = f"{OSRM_URL}/route/v1/driving/{depart_lon},{depart_lat};{arrivee_lon},{arrivee_lat}?overview=full&geometries=geojson"
     
-    response = requests.get(url)
+    response = _session.get(url, timeout=timeout)
     data = response.json()
     
     # OSRM nous renvoie la ligne parfaite qui suit la route
@@ -17,10 +23,11 @@ def obtenir_route_precise(depart_lat, depart_lon, arrivee_lat, arrivee_lon):
     return route_propre
 
 # --- TEST ---
-# Exemple : De la Gare de Tizi Ouzou vers l'Hôpital
-print("Calcul de la route en cours...")
-route = obtenir_route_precise(36.7118, 4.0505, 36.7035, 4.0360)
+if __name__ == "__main__":
+    # Exemple : De la Gare de Tizi Ouzou vers l'Hôpital
+    print("Calcul de la route en cours...")
+    route = obtenir_route_precise(36.7118, 4.0505, 36.7035, 4.0360)
 
-print(f"✅ Route trouvée ! Elle contient {len(route)} points précis.")
-print("Voici les 3 premiers points pour vérifier :")
-print(route[:3])
\ No newline at end of file
+    print(f"✅ Route trouvée ! Elle contient {len(route)} points précis.")
+    print("Voici les 3 premiers points pour vérifier :")
+    print(route[:3])
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Stand-in Supabase en mémoire, pour les bancs d'essai (bench_charge.py).
+
+Reproduit le sous-ensemble du client postgrest utilisé par l'application :
+table().select/insert/upsert/update/delete, filtres eq/neq/in_/gt/gte/lt/lte,
+order, limit puis execute() -> objet avec `.data`.
+
+Chaque execute() est compté par (étiquette, table, opération) : l'étiquette est
+posée par le banc d'essai autour de chaque requête (`etiquette(nom)`), les
+appels faits par les threads de fond (écritures par lots) sont comptés sous
+'arriere-plan'. `latence_s` simule l'aller-retour réseau vers Supabase.
+"""
+import copy
+import datetime
+import itertools
+import operator
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+ARRIERE_PLAN = 'arriere-plan'
+
+
+class _Reponse:
+    def __init__(self, data):
+        self.data = data
+
+
+def _comparable(a, b):
+    # PostgREST compare des nombres ou des dates ISO : on compare en texte si les types diffèrent
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a, b
+    return str(a), str(b)
+
+
+class _Requete:
+    def __init__(self, base, table):
+        self.base = base
+        self.table = table
+        self.op = 'select'
+        self.valeurs = None
+        self.on_conflict = None
+        self.filtres = []
+        self.tri = None
+        self.nb_max = None
+
+    # --- OPÉRATIONS ---
+    def select(self, *colonnes, **options):
+        self.op = 'select'
+        return self
+
+    def insert(self, valeurs, **options):
+        self.op, self.valeurs = 'insert', valeurs
+        return self
+
+    def upsert(self, valeurs, on_conflict=None, **options):
+        self.op, self.valeurs, self.on_conflict = 'upsert', valeurs, on_conflict
+        return self
+
+    def update(self, valeurs, **options):
+        self.op, self.valeurs = 'update', valeurs
+        return self
+
+    def delete(self, **options):
+        self.op = 'delete'
+        return self
+
+    # --- FILTRES ---
+    def _filtre(self, colonne, test):
+        self.filtres.append(lambda r: r.get(colonne) is not None and test(r.get(colonne)))
+        return self
+
+    def _comparer(self, colonne, valeur, op):
+        return self._filtre(colonne, lambda v: op(*_comparable(v, valeur)))
+
+    def eq(self, colonne, valeur):
+        return self._filtre(colonne, lambda v: v == valeur)
+
+    def neq(self, colonne, valeur):
+        return self._filtre(colonne, lambda v: v != valeur)
+
+    def in_(self, colonne, valeurs):
+        valeurs = set(valeurs)
+        return self._filtre(colonne, lambda v: v in valeurs)
+
+    def gt(self, colonne, valeur):
+        return self._comparer(colonne, valeur, operator.gt)
+
+    def gte(self, colonne, valeur):
+        return self._comparer(colonne, valeur, operator.ge)
+
+    def lt(self, colonne, valeur):
+        return self._comparer(colonne, valeur, operator.lt)
+
+    def lte(self, colonne, valeur):
+        return self._comparer(colonne, valeur, operator.le)
+
+    def order(self, colonne, desc=False, **options):
+        self.tri = (colonne, desc)
+        return self
+
+    def limit(self, n, **options):
+        self.nb_max = n
+        return self
+
+    def execute(self):
+        return self.base._executer(self)
+
+
+class SupabaseLocal:
+    def __init__(self, tables=None, latence_s=0.0, horloge=time.time):
+        self.latence_s = latence_s
+        self.horloge = horloge
+        self.tables = {nom: [dict(r) for r in lignes] for nom, lignes in (tables or {}).items()}
+        self.appels = Counter()     # (etiquette, table, op) -> nombre
+        self._ids = itertools.count(1)
+        self._verrou = threading.Lock()
+        self._local = threading.local()
+
+    def table(self, nom):
+        return _Requete(self, nom)
+
+    @contextmanager
+    def etiquette(self, nom):
+        """Compte les appels faits par ce thread sous `nom` (ex : l'endpoint en cours)."""
+        precedente = getattr(self._local, 'etiquette', None)
+        self._local.etiquette = nom
+        try:
+            yield
+        finally:
+            self._local.etiquette = precedente
+
+    def _executer(self, q):
+        if self.latence_s:
+            time.sleep(self.latence_s)
+        maintenant = datetime.datetime.utcfromtimestamp(self.horloge()).isoformat()
+        with self._verrou:
+            self.appels[(getattr(self._local, 'etiquette', None) or ARRIERE_PLAN, q.table, q.op)] += 1
+            lignes = self.tables.setdefault(q.table, [])
+            if q.op in ('insert', 'upsert'):
+                valeurs = q.valeurs if isinstance(q.valeurs, list) else [q.valeurs]
+                cle = q.on_conflict or 'id'
+                index = {r.get(cle): r for r in lignes} if q.op == 'upsert' else {}
+                res = []
+                for v in valeurs:
+                    v = dict(v)
+                    existante = index.get(v.get(cle)) if v.get(cle) is not None else None
+                    if existante is not None:
+                        existante.update(v)
+                        res.append(copy.deepcopy(existante))
+                        continue
+                    v.setdefault('id', next(self._ids))
+                    v.setdefault('created_at', maintenant)
+                    lignes.append(v)
+                    index[v.get(cle)] = v
+                    res.append(copy.deepcopy(v))
+                return _Reponse(res)
+            choisies = [r for r in lignes if all(f(r) for f in q.filtres)]
+            if q.op == 'update':
+                for r in choisies:
+                    r.update(q.valeurs)
+                return _Reponse(copy.deepcopy(choisies))
+            if q.op == 'delete':
+                ids = {id(r) for r in choisies}
+                self.tables[q.table] = [r for r in lignes if id(r) not in ids]
+                return _Reponse(copy.deepcopy(choisies))
+            if q.tri is not None:
+                colonne, desc = q.tri
+                choisies.sort(key=lambda r: str(r.get(colonne) or ''), reverse=desc)
+            if q.nb_max is not None:
+                choisies = choisies[:q.nb_max]
+            return _Reponse(copy.deepcopy(choisies))
+
+    def compter(self, etiquette=None):
+        """{(table, op): nombre} des appels de `etiquette` (toutes si None)."""
+        res = Counter()
+        with self._verrou:
+            for (e, table, op), n in self.appels.items():
+                if etiquette is None or e == etiquette:
+                    res[(table, op)] += n
+        return res
@@ -1,35 +1,71 @@
-import math
+import numpy as np
 
-def trouver_bus_pertinents(voyageur_lat, voyageur_lon, line_id, tous_les_bus_actifs):
+from distances import distances_1_n, haversine_km
+from index_arrets import IndexArrets
+from vitesses import ModeleVitesses
+
+# Lignes tracées (polyline + arrêts ordonnés), construites une fois puis partagées :
+# tracer_ligne(line_id, points, tuiles_arrets) ou index_arrets.ajouter(line_id, points, arrets)
+index_arrets = IndexArrets()
+# Vitesses apprises par ligne / tronçon / créneau (40 km/h tant qu'aucun ping n'a été vu)
+modele_vitesses = ModeleVitesses(vitesse_defaut=40)
+
+def enregistrer_position(bus_id, line_id, lat, lon, ts=None):
+    """Ping d'un bus : alimente le modèle de vitesses de sa ligne."""
+    ligne = index_arrets.ligne(str(line_id))
+    position = ligne.projeter(lat, lon) if ligne is not None else None
+    if position is not None:
+        modele_vitesses.observer(str(line_id), ligne.longueur_km, bus_id, position[0], ts)
+
+def trouver_bus_pertinents(voyageur_lat, voyageur_lon, line_id, tous_les_bus_actifs, index=None):
     """
     Filtre les bus pour ne garder que ceux qui :
     1. Sont sur la bonne ligne.
     2. Ne sont PAS encore passés devant le voyageur.
     3. Sont les plus proches.
     """
-    
-    # 1. Trouver l'arrêt le plus proche du voyageur
-    index_arret_voyageur = trouver_index_arret_plus_proche(voyageur_lat, voyageur_lon, line_id)
+    index = index if index is not None else index_arrets
+    ligne = index.ligne(str(line_id))
     
     bus_visibles = []
+    candidats = [bus for bus in tous_les_bus_actifs if str(bus.get('line_id')) == str(line_id)]
 
-    for bus in tous_les_bus_actifs:
-        # Vérification 1 : Bonne ligne ?
-        if str(bus.get('line_id')) != str(line_id):
-            continue
+    # Position du voyageur et des bus le long de la ligne (km depuis le départ)
+    position = ligne.projeter(voyageur_lat, voyageur_lon) if ligne is not None else None
+    abscisses_bus = np.full(len(candidats), np.nan)
+    if position is not None:
+        abscisses_bus = ligne.abscisses([b['current_lat'] for b in candidats],
+                                        [b['current_lon'] for b in candidats])
+        # Bus déjà passé (au-delà du voyageur sur la ligne) : NaN (hors ligne) conservé
+        garder = ~(abscisses_bus > position[0])
+        candidats = [b for b, g in zip(candidats, garder) if g]
+        abscisses_bus = abscisses_bus[garder]
+    else:
+        # Sans tracé : on se rabat sur l'index d'arrêt fourni par le bus
+        index_arret_voyageur = trouver_index_arret_plus_proche(voyageur_lat, voyageur_lon, line_id, index)
+        if index_arret_voyageur is not None:
+            candidats = [b for b in candidats
+                         if b.get('dernier_arret_index') is None or b['dernier_arret_index'] <= index_arret_voyageur]
+            abscisses_bus = np.full(len(candidats), np.nan)
 
-        # Vérification 2 : Bus déjà passé ?
-        if bus.get('dernier_arret_index') > index_arret_voyageur:
-            continue 
+    # Calcul des distances : un seul calcul vectorisé pour tous les bus retenus
+    distances = distances_1_n(voyageur_lat, voyageur_lon,
+                              [b['current_lat'] for b in candidats],
+                              [b['current_lon'] for b in candidats])
+    vitesse = modele_vitesses.vitesse_creneau()
 
-        # Calcul de la distance
-        distance = calculer_distance(voyageur_lat, voyageur_lon, bus['current_lat'], bus['current_lon'])
-        
+    for bus, distance, abscisse in zip(candidats, distances, abscisses_bus):
+        distance = float(distance)
+        # Temps estimé le long de la ligne avec les vitesses apprises (à vol d'oiseau à défaut)
+        if np.isnan(abscisse):
+            temps_s = distance / vitesse * 3600
+        else:
+            temps_s = modele_vitesses.duree_s(str(line_id), float(abscisse), position[0])
         bus_visibles.append({
             'bus_id': bus['id'],
             'chauffeur': bus['nom_chauffeur'],
             'distance_km': round(distance, 2),
-            'temps_estime_min': round(distance / 40 * 60),
+            'temps_estime_min': round(temps_s / 60),
             # Les coordonnées indispensables pour la carte :
             'current_lat': bus['current_lat'], 
             'current_lon': bus['current_lon']
@@ -40,17 +76,20 @@ def trouver_bus_pertinents(voyageur_lat, voyageur_lon, line_id, tous_les_bus_act
     
     return bus_visibles
 
+def tracer_ligne(line_id, points, tuiles=None):
+    # Enregistre le tracé d'une ligne ; ses arrêts sont pris dans les tuiles OSM (arrets.TuilesArrets) le long du tracé
+    arrets = tuiles.arrets_le_long(points) if tuiles is not None else None
+    return index_arrets.ajouter(str(line_id), points, arrets or None)
+
 # --- Fonctions utilitaires ---
 
-def trouver_index_arret_plus_proche(lat, lon, line_id):
-    # Simulé : Le voyageur est toujours vers l'arrêt n°3
-    return 3 
+def trouver_index_arret_plus_proche(lat, lon, line_id, index=None):
+    # Arrêt de la ligne le plus proche du voyageur (None si la ligne n'est pas tracée ou trop loin)
+    ligne = (index if index is not None else index_arrets).ligne(str(line_id))
+    if ligne is None:
+        return None
+    return ligne.arret_plus_proche(lat, lon)
 
 def calculer_distance(lat1, lon1, lat2, lon2):
-    # Formule de Haversine
-    R = 6371  # km
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
\ No newline at end of file
+    # Formule de Haversine (voir distances.py pour les calculs en lot)
+    return haversine_km(lat1, lon1, lat2, lon2)
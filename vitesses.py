@@ -0,0 +1,132 @@
+"""
+Modèle de vitesses appris à partir des pings GPS, pour l'ETA.
+
+Chaque ligne tracée (index_arrets) est découpée en tronçons de
+`longueur_troncon_km`, la journée en créneaux de `creneau_min` minutes.
+Pour chaque (sens, créneau, tronçon) on garde une vitesse lissée (EWMA) dans
+un tableau float32 de taille fixe. Deux pings successifs d'un bus donnent une
+vitesse le long de la ligne, appliquée aux tronçons parcourus entre les deux.
+Un bus arrêté ne fait pas avancer sa position de référence : le temps passé à
+l'arrêt est compté dans la vitesse du tronçon suivant.
+
+Pour répondre en temps constant, on tient par (ligne, sens, créneau) le temps
+de parcours cumulé depuis le début de la ligne, recalculé seulement quand un
+tronçon a changé : une ETA est une différence de deux cumuls interpolés.
+Un tronçon jamais observé prend la moyenne de sa ligne sur le créneau, sinon la
+vitesse globale du créneau, sinon `vitesse_defaut`.
+
+Chaque worker apprend des pings qu'il reçoit.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+CROISSANT = 0     # abscisse croissante : vers ville_arrivee
+DECROISSANT = 1   # vers ville_depart
+
+
+class _VitessesLigne:
+    def __init__(self, longueur_km, longueur_troncon_km, nb_creneaux):
+        self.nb_troncons = max(1, int(math.ceil(longueur_km / longueur_troncon_km)))
+        self.vitesses = np.full((2, nb_creneaux, self.nb_troncons), np.nan, dtype=np.float32)
+        self.cumuls = {}  # (sens, creneau) -> temps cumulés (s), invalidés à chaque observation
+
+
+class ModeleVitesses:
+    def __init__(self, longueur_troncon_km=1.0, creneau_min=30, alpha=0.2, vitesse_defaut=25.0,
+                 vitesse_max=110.0, deplacement_min_km=0.05, ecart_max_s=300.0,
+                 decalage_h=1, horloge=time.time):
+        """`decalage_h` : fuseau des créneaux horaires (Algérie : UTC+1)."""
+        self.longueur_troncon_km = longueur_troncon_km
+        self.creneau_s = creneau_min * 60
+        self.nb_creneaux = int(math.ceil(86400 / self.creneau_s))
+        self.alpha = alpha
+        self.vitesse_defaut = vitesse_defaut
+        self.vitesse_max = vitesse_max
+        self.deplacement_min_km = deplacement_min_km
+        self.ecart_max_s = ecart_max_s
+        self.decalage_s = decalage_h * 3600
+        self.horloge = horloge
+        self._lignes = {}
+        self._globale = np.full(self.nb_creneaux, np.nan)   # vitesse moyenne, toutes lignes
+        self._derniers = {}  # driver_id -> (cle, abscisse, ts) : dernière position de référence
+        self._verrou = threading.Lock()
+        self.observations = 0
+
+    def creneau(self, ts=None):
+        ts = self.horloge() if ts is None else ts
+        return int(((ts + self.decalage_s) % 86400) // self.creneau_s)
+
+    def observer(self, cle, longueur_km, driver_id, abscisse, ts=None):
+        """Position d'un bus (km le long de la ligne `cle`) ; met à jour les tronçons parcourus."""
+        ts = self.horloge() if ts is None else ts
+        with self._verrou:
+            prec = self._derniers.get(driver_id)
+            if prec is None or prec[0] != cle or not 0 < ts - prec[2] <= self.ecart_max_s:
+                self._derniers[driver_id] = (cle, abscisse, ts)
+                return
+            deplacement = abscisse - prec[1]
+            if abs(deplacement) < self.deplacement_min_km:
+                return  # à l'arrêt : on garde l'ancienne référence
+            self._derniers[driver_id] = (cle, abscisse, ts)
+            vitesse = abs(deplacement) / (ts - prec[2]) * 3600
+            if vitesse > self.vitesse_max:
+                return  # saut GPS
+            lv = self._lignes.get(cle)
+            if lv is None:
+                lv = self._lignes[cle] = _VitessesLigne(longueur_km, self.longueur_troncon_km, self.nb_creneaux)
+            sens = CROISSANT if deplacement > 0 else DECROISSANT
+            c = self.creneau(ts)
+            debut, fin = sorted((prec[1], abscisse))
+            k0, k1 = self._troncon(lv, debut), self._troncon(lv, fin)
+            v = lv.vitesses[sens, c, k0:k1 + 1]
+            lv.vitesses[sens, c, k0:k1 + 1] = np.where(np.isnan(v), vitesse, v + self.alpha * (vitesse - v))
+            lv.cumuls.pop((sens, c), None)
+            g = self._globale[c]
+            self._globale[c] = vitesse if np.isnan(g) else g + self.alpha * (vitesse - g)
+            self.observations += 1
+
+    def oublier(self, driver_id):
+        with self._verrou:
+            self._derniers.pop(driver_id, None)
+
+    def vitesse_creneau(self, ts=None):
+        """Vitesse moyenne apprise (toutes lignes) pour le créneau, `vitesse_defaut` à défaut."""
+        g = self._globale[self.creneau(ts)]
+        return self.vitesse_defaut if np.isnan(g) else float(g)
+
+    def duree_s(self, cle, depart_km, arrivee_km, ts=None):
+        """Temps (s) pour aller de l'abscisse `depart_km` à `arrivee_km` sur la ligne `cle`."""
+        lv = self._lignes.get(cle)
+        if lv is None:
+            return abs(arrivee_km - depart_km) / self.vitesse_creneau(ts) * 3600
+        sens = CROISSANT if arrivee_km >= depart_km else DECROISSANT
+        cumul = self._cumul(lv, sens, self.creneau(ts))
+        return abs(self._temps_a(lv, cumul, arrivee_km) - self._temps_a(lv, cumul, depart_km))
+
+    def stats(self):
+        return {'lignes': len(self._lignes), 'bus_suivis': len(self._derniers), 'observations': self.observations}
+
+    def _troncon(self, lv, abscisse):
+        return min(lv.nb_troncons - 1, max(0, int(abscisse // self.longueur_troncon_km)))
+
+    def _cumul(self, lv, sens, c):
+        cumul = lv.cumuls.get((sens, c))
+        if cumul is None:
+            with self._verrou:
+                v = lv.vitesses[sens, c].astype(np.float64)
+                connues = ~np.isnan(v)
+                if connues.any():
+                    v[~connues] = v[connues].mean()
+                else:
+                    v[:] = self.vitesse_creneau(c * self.creneau_s - self.decalage_s)
+                cumul = np.concatenate(([0.0], np.cumsum(self.longueur_troncon_km / v * 3600)))
+                lv.cumuls[(sens, c)] = cumul
+        return cumul
+
+    def _temps_a(self, lv, cumul, abscisse):
+        x = abscisse / self.longueur_troncon_km
+        k = min(lv.nb_troncons - 1, max(0, int(x)))
+        return cumul[k] + (x - k) * (cumul[k + 1] - cumul[k])